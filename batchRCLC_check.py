@@ -0,0 +1,75 @@
+# Checks that runmode 4 of batchRCLC_v2.1.py finds exactly the same k hottest and k coldest combinations as
+# runmode 3, with plagioclase analyses that hold K (in which the anorthite activity is not a function of the
+# anorthite content alone).
+#
+# ##### How to use it ######
+#     Run:
+#
+#         python batchRCLC_check.py
+#
+#     or, to choose the number of plagioclase analyses, the random seed they are drawn with and k:
+#
+#         python batchRCLC_check.py 14 1 5
+#
+#     The garnet, opx and modes examples in this directory (gar.txt, opx.txt, modes.txt) are copied to a
+#     temporary directory with random plagioclase analyses (An16 to An95, with up to 18 % orthoclase; the
+#     same seed always gives the same analyses). Both runmodes are run there with Al model 4 for each
+#     criterion, and their output files must be identical. The program ends with an error if they are not.
+
+########################################################
+################# IMPORTING LIBRARIES ##################
+########################################################
+from sys import argv, executable
+from os.path import join, dirname, abspath
+from shutil import copy
+from tempfile import TemporaryDirectory
+from subprocess import run
+from numpy.random import default_rng
+
+HERE = dirname(abspath(__file__))
+SCRIPT = join(HERE, 'batchRCLC_v2.1.py')
+CRITERIA = {'1': 'hottest', '2': 'coldest'} # the runmode 4 criteria, as answered to batchRCLC_v2.1.py
+
+########################################################
+########### DEFINE FUNCTIONS FOR THE PROGRAM ###########
+########################################################
+
+def writeplagioclase(filename, n, seed):
+    # writes n random plagioclase analyses (cations per 8 oxygens) to filename, in the format of pl.txt
+    rng = default_rng(seed)
+    with open(filename, 'w') as f:
+        f.write('Si\tTi\tAl\tCr\tFe3\tFe2\tMn\tMg\tCa\tNa\tK\n')
+        for i in range(n):
+            XSAN = rng.uniform(0, 0.18)
+            XAB = max(1 - rng.uniform(0.16, 0.95) - XSAN, 0.02)
+            XAN = 1 - XAB - XSAN
+            f.write('\t'.join(str(round(x, 4)) for x in [3 - XAN, 0.001, 1 + XAN, 0, 0.001, 0, 0, 0.001, XAN, XAB, XSAN])+'\n')
+
+def runbatchRCLC(directory, answers):
+    # runs batchRCLC_v2.1.py in directory with answers, and returns its output file and its messages
+    finished = run([executable, SCRIPT], cwd=directory, input='\n'.join(answers)+'\n', capture_output=True, text=True)
+    if finished.returncode != 0:
+        print(finished.stdout + finished.stderr)
+        raise SystemExit('batchRCLC_v2.1.py failed with the answers '+' '.join(answers))
+    with open(join(directory, 'outputfile.csv')) as f:
+        return f.read(), finished.stdout
+
+########################################################
+################## RUNNING THE CHECK ###################
+########################################################
+
+n, seed, k = [int(a) for a in argv[1:4]] + [14, 1, 5][len(argv[1:4]):]
+different = []
+with TemporaryDirectory() as directory:
+    for name in ['gar.txt', 'opx.txt', 'modes.txt']:
+        copy(join(HERE, name), directory)
+    writeplagioclase(join(directory, 'pl.txt'), n, seed)
+    for criterion, name in CRITERIA.items():
+        output3, messages3 = runbatchRCLC(directory, ['4', '3', criterion, str(k)])
+        output4, messages4 = runbatchRCLC(directory, ['4', '4', criterion, str(k)])
+        calculated = [line for line in messages4.splitlines() if 'possible combinations calculated' in line]
+        print(name+': the output files of runmodes 3 and 4 are '+('identical' if output3 == output4 else 'DIFFERENT')+' (runmode 4: '+''.join(calculated)+')')
+        if output3 != output4:
+            different.append(name)
+if different:
+    raise SystemExit('runmode 4 did not find the same combinations as runmode 3 ('+', '.join(different)+'; '+str(n)+' plagioclase analyses, seed '+str(seed)+')')
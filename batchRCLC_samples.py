@@ -0,0 +1,190 @@
+# Runs batchRCLC_v2.1.py on many samples at once, e.g. every thin section of a project.
+#
+# ##### How to use it ######
+#     Each sample is a directory holding the usual input files of batchRCLC_v2.1.py (gar.txt, opx.txt,
+#     pl.txt, modes.txt, and optionally crd.txt, bt.txt and the other optional files), so every sample
+#     keeps its own modes. Run:
+#
+#         python batchRCLC_samples.py project
+#
+#     to run every directory below 'project' that holds gar.txt, opx.txt, pl.txt and modes.txt, or:
+#
+#         python batchRCLC_samples.py manifest.txt
+#
+#     to run the samples listed in a manifest file, one directory per line (relative to the manifest),
+#     optionally followed by the answers to the questions batchRCLC_v2.1.py asks for that sample
+#     (e.g. 'sections/A12 4 5 1000 5 0.05 1 0' for Al model 4 and runmode 5 with its settings). The
+#     default answers are '4 2' (Al model 4, runmode 2), or those given after the directory or manifest
+#     on the command line (e.g. python batchRCLC_samples.py project 1 2).
+#
+#     The samples are shared between as many processes as the computer has cores. Large runmode 2
+#     samples are split into parts of about 20000 combinations that are run in parallel and joined
+#     again, and small samples are packed together, so the processes are kept busy until the end. The
+#     largest samples are started first. Samples with optional files that summarise the whole sample
+#     (bootstrap.txt, clusters.txt, modesweep.txt, fe3sweep.txt) are never split. The parts of a sample
+#     with a result cache (resultcache.txt) share its file while they run, as batchRCLC_v2.1.py writes to
+#     it in short transactions. A split sample gives the same results as an unsplit run, as every
+#     combination is calculated from the same starting guesses.
+#
+#     The results of each sample are saved in its directory as usual (outputfile.csv, and the messages
+#     of batchRCLC_v2.1.py in batchRCLC_log.txt). A combined index of all the samples, with the number of
+#     calculations and the 5th, 50th and 95th percentiles of Fe-Al T final and P final of each, is saved
+#     to sampleindex.csv in the project directory (or next to the manifest).
+
+########################################################
+################# IMPORTING LIBRARIES ##################
+########################################################
+from sys import argv, executable
+from os import walk, remove
+from os.path import join, dirname, abspath, isdir, isfile
+from subprocess import run
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import cpu_count
+from re import search as rsearch
+from math import prod
+from csv import reader as csvreader
+from csv import writer as csvwriter
+from numpy import array as nparray
+from numpy import percentile as nppercentile
+from numpy import isfinite as npisfinite
+
+SCRIPT = join(dirname(abspath(__file__)), 'batchRCLC_v2.1.py')
+PARTSIZE = 20000 # about the number of combinations in each part of a large sample (a few minutes each)
+WHOLESAMPLEFILES = ['bootstrap.txt', 'clusters.txt', 'modesweep.txt', 'fe3sweep.txt'] # samples with these are not split
+
+########################################################
+########### DEFINE FUNCTIONS FOR THE PROGRAM ###########
+########################################################
+
+def findsamples(path, answers):
+    # the samples to run, as a list of (directory, answers): every directory below path that holds the
+    # required input files, or the directories listed in the manifest file path
+    required = ['gar.txt', 'opx.txt', 'pl.txt', 'modes.txt']
+    if isdir(path):
+        return [(directory, answers) for directory, subdirectories, files in sorted(walk(path))
+                if all(name in files for name in required)]
+    samples = []
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.split()
+            if line and not line[0].startswith('#'):
+                directory = join(dirname(abspath(path)), line[0])
+                if all(isfile(join(directory, name)) for name in required):
+                    samples.append((directory, line[1:] or answers))
+                else:
+                    print('input files not found in '+directory+', not run')
+    return samples
+
+def countanalyses(filename):
+    # the number of analyses in a mineral input file (0 if there is no such file)
+    if not isfile(filename):
+        return 0
+    with open(filename) as data:
+        return sum(1 for line in data if line.strip() and rsearch('^[A-z]', line) == None)
+
+def countcombinations(directory, answers):
+    # the number of combinations a sample will run, before filtering or merging (an upper bound): every
+    # combination of the analyses in runmode 2, and the number of analyses otherwise
+    counts = [countanalyses(join(directory, m+'.txt')) for m in ['opx', 'gar', 'pl', 'crd', 'bt']]
+    counts = [n for n in counts if n > 0]
+    return prod(counts) if answers[1:2] == ['2'] else max(counts)
+
+def makejobs(samples):
+    # divides the samples into jobs of about PARTSIZE combinations: large runmode 2 samples are split into
+    # parts, and small samples are packed together. Each job is a list of (directory, answers, part, parts)
+    # and the jobs are returned largest first, so that the last jobs to finish are small ones
+    jobs, packed, packedsize = [], [], 0
+    for directory, answers in samples:
+        n = countcombinations(directory, answers)
+        if n > PARTSIZE and answers[1:2] == ['2'] and not any(isfile(join(directory, name)) for name in WHOLESAMPLEFILES):
+            parts = -(-n // PARTSIZE)
+            jobs += [(n / parts, [(directory, answers, i, parts)]) for i in range(parts)]
+        elif n >= PARTSIZE:
+            jobs.append((n, [(directory, answers, 0, 1)]))
+        else:
+            packed.append((directory, answers, 0, 1))
+            packedsize += n
+            if packedsize >= PARTSIZE:
+                jobs.append((packedsize, packed))
+                packed, packedsize = [], 0
+    if packed:
+        jobs.append((packedsize, packed))
+    return [job for size, job in sorted(jobs, key=lambda job: -job[0])]
+
+def runjob(job):
+    # runs each sample (or part of a sample) of a job with batchRCLC_v2.1.py, in its own directory.
+    # Returns the directory, part, success and messages of each run
+    out = []
+    for directory, answers, i, parts in job:
+        output = 'outputfile.csv' if parts == 1 else 'outputfile_part'+str(i)+'.csv'
+        finished = run([executable, SCRIPT, 'part', str(i), str(parts), 'output', output], cwd=directory,
+                       input='\n'.join(answers)+'\n', capture_output=True, text=True)
+        out.append((directory, i, parts, finished.returncode == 0, finished.stdout + finished.stderr))
+    return out
+
+def joinparts(directory, parts):
+    # joins the output files of the parts of a sample into outputfile.csv (the rows are the results and the
+    # columns the combinations, so the columns of each part follow those of the part before it). The weight
+    # row is only written by parts in which analyses were merged, so it is 1 in parts that do not have it
+    joined = dict()
+    for i in range(parts):
+        with open(join(directory, 'outputfile_part'+str(i)+'.csv'), newline='') as f:
+            rows = {row[0]: row[1:] for row in csvreader(f)}
+        before, n = len(joined.get('analyses used', [])), len(rows['analyses used'])
+        for name in list(joined) + [name for name in rows if name not in joined]:
+            if name not in joined:
+                joined[name] = [1 if name.startswith('weight') else ''] * before
+            joined[name] += rows.get(name, [1 if name.startswith('weight') else ''] * n)
+        remove(join(directory, 'outputfile_part'+str(i)+'.csv'))
+    with open(join(directory, 'outputfile.csv'), 'w', newline='') as f:
+        w = csvwriter(f)
+        w.writerows([name] + values for name, values in joined.items())
+
+def summarise(directory):
+    # the number of calculations and the 5th, 50th and 95th percentiles of Fe-Al T final and P final of a
+    # sample, from its outputfile.csv (weighted, if analyses were merged or clustered)
+    if not isfile(join(directory, 'outputfile.csv')):
+        return ['no output'] + [''] * 7
+    with open(join(directory, 'outputfile.csv'), newline='') as f:
+        rows = {row[0]: row[1:] for row in csvreader(f)}
+    T, P = nparray(rows['Fe-Al T final'], dtype=float), nparray(rows['Fe-Al P final'], dtype=float)
+    weights = nparray([row for name, row in rows.items() if name.startswith('weight')][:1] or [[1] * len(T)], dtype=int).ravel()
+    calculated = npisfinite(T) & npisfinite(P)
+    if not calculated.any():
+        return ['ok', len(T)] + [''] * 6
+    T, P = T[calculated].repeat(weights[calculated]), P[calculated].repeat(weights[calculated])
+    return ['ok', int(calculated.sum())] + [float(q) for q in nppercentile(T, [5, 50, 95])] + [float(q) for q in nppercentile(P, [5, 50, 95])]
+
+########################################################
+################## RUNNING THE SAMPLES #################
+########################################################
+
+if len(argv) < 2:
+    print('usage: python batchRCLC_samples.py <project directory or manifest file> [answers, e.g. 4 2]')
+    raise SystemExit
+samples = findsamples(argv[1], argv[2:] or ['4', '2'])
+jobs = makejobs(samples)
+print(str(len(samples))+' samples found, run as '+str(len(jobs))+' jobs on '+str(cpu_count())+' processes\n')
+
+messages, failed = {directory: dict() for directory, answers in samples}, set()
+with ThreadPoolExecutor(cpu_count()) as pool: # each thread waits for its own batchRCLC_v2.1.py process
+    for finished in as_completed([pool.submit(runjob, job) for job in jobs]):
+        for directory, i, parts, success, message in finished.result():
+            messages[directory][i] = message
+            if not success:
+                failed.add(directory)
+            if len(messages[directory]) == parts:
+                if parts > 1 and directory not in failed:
+                    joinparts(directory, parts)
+                with open(join(directory, 'batchRCLC_log.txt'), 'w') as log:
+                    log.write(''.join(messages[directory][j] for j in range(parts)))
+                print(('failed (see batchRCLC_log.txt): ' if directory in failed else 'done: ')+directory)
+
+indexname = join(argv[1] if isdir(argv[1]) else dirname(abspath(argv[1])), 'sampleindex.csv')
+with open(indexname, 'w', newline='') as f:
+    w = csvwriter(f)
+    w.writerow(['sample directory', 'status', 'calculations', 'Fe-Al T final 5th', 'Fe-Al T final 50th', 'Fe-Al T final 95th',
+                'Fe-Al P final 5th', 'Fe-Al P final 50th', 'Fe-Al P final 95th'])
+    for directory, answers in samples:
+        w.writerow([directory] + (['failed'] + [''] * 7 if directory in failed else summarise(directory)))
+print('\nindex of all the samples saved to '+indexname+'\n')
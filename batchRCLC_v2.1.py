@@ -67,6 +67,80 @@
 #           A great advantage of this runmode is to determine the senstivity of the calculated PT to the choice
 #           of input mineral compositions.
 #
+#       3) As runmode 2, but only the k most extreme combinations are saved: the hottest, the coldest,
+#           the highest or lowest pressure, or the smallest difference between the final Fe-Al and
+#           gar-opx Fe-Mg temperatures (the most internally consistent combinations).
+#           Only k combinations are held in memory during the run, so this runmode can be used when
+#           the number of possible combinations is too large to save every result.
+#
+#       4) Finds the same k hottest (or coldest) combinations as runmode 3, without calculating
+#           every possible combination. Plagioclase only affects the calculated T and P through the
+#           anorthite activity, and they change monotonically with it, so each choice of the other
+#           analyses (with more than four plagioclase analyses) is first calculated four times, with
+#           the lowest and highest anorthite activity its plagioclase analyses can have, to bound the
+#           result. Choices that cannot beat the k best combinations found so far are skipped, as are
+#           plagioclase analyses whose anorthite activity lies beyond that of a calculated one that
+#           cannot beat them. Runmodes 3 and 4 save identical results; batchRCLC_check.py checks this
+#           with plagioclase analyses that hold K.
+#
+#       5) PT is calculated for a random sample of all possible combinations, drawn in batches
+#           (pseudo-random, or quasi-random from a Halton sequence over the analyses of each mineral;
+#           the same random seed always gives the same sample). Sampling stops when the 5th, 50th
+#           and 95th percentiles of T and P change by less than a user-defined tolerance from one batch
+#           to the next, and the percentiles and the effective sample size are reported. This makes
+#           samples with too many possible combinations for runmode 2 tractable.
+#           Stratified sampling can be chosen instead, to guarantee that every analysis of every mineral
+#           (e.g. a single high-Al opx core) is used in at least m sampled combinations: each round of
+#           sampling uses every analysis at least once, paired with random permutations of the analyses
+#           of the other minerals (a Latin hypercube over the analyses).
+#
+#       6) A hybrid of runmodes 1 and 2: the user chooses which minerals were analysed in pairs (for
+#           example garnet and orthopyroxene measured at the same contact). Those minerals are run in
+#           sequence (gar1-opx1, gar2-opx2... garN-opxN), and every pair is combined with every
+#           analysis of the other minerals (plagioclase, and biotite and cordierite if included).
+#           The paired minerals must have the same number of analyses.
+#
+#       7) Every garnet analysis is combined with every combination of the analyses of the other minerals
+#           near it: either those within a user-defined distance, or the k nearest analyses of each mineral.
+#           This needs X and Y columns in the input files (see below). If the input files also have a
+#           Sample column, only analyses from the same sample (e.g. thin section) are combined. The
+#           number of combinations then grows roughly linearly with the number of analyses, rather than
+#           as the product of the numbers of analyses of each mineral.
+#
+#       8) Calculates maps of T and P from quantified X-ray maps, in which every pixel is an analysis.
+#           The garnet and opx maps are numpy arrays saved as 'gar.npy' and 'opx.npy', both of shape
+#           (rows, columns, 11) with the 11 cations of each pixel in the order of the input files, and
+#           NaN (or 0) in pixels of other minerals. Each garnet pixel is paired with the nearest opx pixel
+#           within a user-defined distance (in pixels), and is calculated with one user-chosen analysis of
+#           each of the other minerals. The maps are read and calculated a band of rows at a time (all
+#           the pixels of a band at once, and the bands shared among the processor cores), so they do not
+#           have to fit in memory. Fe-Al T final (C) and P final (kbar) are saved as maps of the same
+#           rows and columns, 'outputT.npy' and 'outputP.npy', with NaN where there is no calculation.
+#           gar.txt and opx.txt must still be present, but are not used by this runmode.
+#
+#       9) Calculates T and P along a traverse across a garnet-opx contact. This needs a Distance column
+#           (the distance of each analysis from the garnet-opx interface, in any units) in gar.txt and
+#           opx.txt (see below). Each garnet analysis is paired either with every opx analysis whose
+#           distance is within a user-defined window of its own, or with the opx analysis at the closest
+#           distance, and each pair is combined with every analysis of the other minerals. If both files
+#           have a Sample column, only analyses from the same sample (traverse) are paired. The number of
+#           combinations grows linearly with the length of the traverse. All the combinations in a chunk
+#           are calculated at once, and the distances of the garnet and opx analyses are written as two
+#           extra rows of the output file, so T and P can be plotted against distance.
+#
+#       10) Calculates many samples at once, from input files with a Sample column (see below) holding the
+#           analyses of every sample. Every combination of the analyses of each sample is calculated,
+#           as in runmode 2, but analyses of different samples are never combined. Each sample has its own
+#           modes: modes.txt can hold lines with a third column naming a sample (e.g. 'gar 15 A12'). A
+#           sample with such lines needs one for every mineral it has analyses of (otherwise it is
+#           reported and not calculated), and a sample without any is calculated with the modes without a
+#           sample. Biotite and cordierite are not used if no sample has a mode of them above 0.01, and
+#           their files then need no Sample column. A sample without biotite or cordierite analyses is
+#           calculated without them. The combinations of many samples
+#           are calculated at once, each with its own modes and with or without biotite and cordierite,
+#           so many small samples run about as fast as one large one. The sample of each combination is
+#           written as an extra row of the output file.
+#
 # ##### What you need to run this code ######
 #     The required input data are mineral cations for garnet (normalized to 12 O),
 #     orthpyroxene (normalized to 6 O), and plagioclase (normalized to 8 O) as well as
@@ -94,6 +168,142 @@
 #     Fe3 and Fe2 contents of minerals separately. If Fe3 is not being considered, enter zeros for that
 #     column of the input file and put all Fe as Fe2.
 #
+#     Optional columns: the 11 cation columns can be followed by optional columns, identified by their
+#     names in the header line. X and Y (the coordinates of the analysis, in any units) are needed for
+#     runmode 7, Sample (e.g. the thin section an analysis is from) is used by runmodes 7 and 9 if present,
+#     and needed for runmode 10 (by the biotite and cordierite files only if they are used), and Distance
+#     is needed for runmode 9.
+#     Example header: Si	Ti	Al	Cr	Fe3	Fe2	Mn	Mg	Ca	Na	K	X	Y	Sample
+#
+#     Labels and filters: an optional Label column (e.g. core, rim, inclusion, matrix) can be used to
+#     restrict which analyses are combined, with rules in an optional file 'filter.txt', one per line:
+#         gar.rim with opx.rim     garnet labelled rim is only combined with opx labelled rim
+#         no pl.inclusion          plagioclase labelled inclusion is not used (also: no inclusion pl)
+#         only gar.rim             only garnet labelled rim is used (also: only rim gar)
+#     Excluded combinations are removed before any calculation is run, in every runmode.
+#
+#     Merging near-identical analyses: an optional file 'tolerances.txt' holds a header line of element
+#     names (any of Si Ti Al Cr Fe3 Fe2 Mn Mg Ca Na K) and one line of tolerances, in cations per formula
+#     unit. Analyses of a mineral that agree within every tolerance (and have the same Label and Sample,
+#     if given) are merged into one, so fewer combinations are calculated. Elements not listed must match
+#     exactly. Each calculation is then weighted by the number of combinations of original analyses it
+#     stands for: the weights are written as an extra output row and are used for the runmode 5 percentiles.
+#     The minerals that runmodes 1 and 6 pair by row are not merged (or clustered, see below), as that would
+#     shift their rows.
+#
+#     Representative analyses: an optional file 'clusters.txt' reduces large sets of analyses (e.g. from a
+#     map or traverse) to a few representative analyses, with one line per mineral giving the number of
+#     representatives (e.g. gar 20). The analyses are grouped into that many clusters of similar composition
+#     (k-medoids), and each cluster is represented by its most central analysis, weighted by the number of
+#     analyses in the cluster (see above). Analyses with different labels or samples are not clustered
+#     together. In runmodes 2 and 5, the percentiles of T and P are then compared with those of a random
+#     sample of the combinations of all the analyses: 1000 by default, or n given on a line 'compare n'.
+#
+#     Bootstrap confidence intervals: if an optional file 'bootstrap.txt' is present, confidence intervals of
+#     the median and mean of Fe-Al T final and P final of the calculations in the output are calculated by
+#     resampling, with replacement, the analyses of each mineral (not the combinations). The calculations are
+#     not repeated: each replicate reweights the results already calculated by the number of times their
+#     analyses were drawn, so a thousand replicates take a few seconds. The file can hold lines 'replicates n'
+#     (default 1000), 'confidence c' (in percent, default 95) and 'seed s' (default 0). The estimates and
+#     their limits are printed and saved to bootstrapfile.csv. Only available in runmodes 2 and 5, as resampling
+#     the analyses of each mineral on its own is only valid when each is combined with every analysis of the
+#     others (the other runmodes pair analyses by row, position or sample, or save only some combinations).
+#
+#     Al site models: at the start, the code asks which of four models of the Al site occupancy in opx to
+#     use. With choice 5, Fe-Al T final and P final are also calculated with all four models, for every
+#     combination in the output, and written side by side as extra rows of the output file. Every combination
+#     is calculated with model 4 as usual, and then with models 1-3 at once (1000 combinations at a time), so
+#     all four take little longer than one. Everything else (the other output rows, runmode 3 rankings,
+#     uncertainties...) uses model 4, whose extra rows repeat Fe-Al T final and P final.
+#
+#     Mode sweep: if an optional file 'modesweep.txt' is present, every combination in the output is also
+#     calculated with many sets of modes. Each line gives either a range of the mode of a mineral (e.g.
+#     'gar 10 30 5': five modes from 10 to 30) or a distribution ('gar normal 20 3' or 'gar uniform 10 30'),
+#     with lines 'draws n' (default 100) and 'seed s' (default 0) for the distributions. The sets of modes
+#     are every combination of the ranges, each with every draw of the distributions; minerals not listed
+#     keep their modes from modes.txt. All the sets of modes of a combination are calculated at once, and
+#     the initial intersections, which do not depend on the modes, are not recalculated. Biotite and
+#     cordierite are only included in the sets in which their mode is above 0.01. T and P final of every
+#     combination with every set of modes are saved to modesweepfile.csv, and their percentiles printed.
+#
+#     Fe3+ sweep: if an optional file 'fe3sweep.txt' is present, every combination in the output is also
+#     calculated with many values of Fe3/(Fe3+Fe2) of opx and garnet, with the total Fe of every analysis
+#     held constant. Its lines are written as in modesweep.txt (e.g. 'opx 0 0.3 7' or 'gar normal 0.05
+#     0.02'); a mineral that is not listed keeps the Fe3 and Fe2 of its input file. The garnet calculation
+#     does not use Fe3, so for garnet the Fe2 of the input file is taken as the total Fe. The opx site
+#     occupancies are recalculated with the chosen Al site model, and all the values of a combination are
+#     calculated at once. T and P final of every combination with every Fe3/(Fe3+Fe2) are saved to
+#     fe3sweepfile.csv, and their percentiles printed.
+#
+#     Analytical uncertainty: if an optional file 'uncertainty.txt' is present, the uncertainty of T and P
+#     is calculated for every combination by Monte Carlo. Its first line is a header of element names
+#     (e.g. Si Al Fe2 Mg Ca), followed by a line of the 1 sigma uncertainties of those elements (in cations
+#     per formula unit) for every mineral, and/or lines starting with a mineral name for that mineral
+#     (e.g. gar 0.02 0.02 0.03 0.03 0.01). Uncertainties of individual analyses can be given in optional
+#     files 'gar_sigma.txt', 'opx_sigma.txt'..., laid out like the input files (a header line, then 11
+#     values per analysis). Each combination is calculated 1000 times (or n times, with a line 'draws n'),
+#     with a random error drawn from a normal distribution added to every cation, and all the draws of a
+#     combination are calculated at once. The mean and 1 sigma of Fe-Al T final and P final, and their
+#     covariance, are written as extra rows of the output file. The draws depend only on the analyses
+#     and on a random seed (0, or s with a line 'seed s'), so they are the same in every runmode.
+#
+#     With a line 'linear' in uncertainty.txt, the uncertainty is instead calculated by linear propagation:
+#     the derivatives of Fe-Al T final and P final with respect to every cation of every analysis and to
+#     the mode of every Fe-Mg mineral are calculated (by central differences, with the perturbed calculations
+#     of 1000 combinations run at once), and combined with the 1 sigma uncertainties into a linearised error
+#     ellipse: 1 sigma of T, 1 sigma of P, and their covariance. The uncertainties of the modes (in the units
+#     of modes.txt) are given with lines such as 'mode gar 2'. The error ellipse and the derivatives are
+#     written as extra rows of the output file. This is much faster than Monte Carlo, and is accurate when
+#     the uncertainties are small enough that T and P change linearly with them.
+#
+#     Thermodynamic data uncertainty: if an optional file 'thermouncertainty.txt' is present, the uncertainty
+#     of T and P that comes from the thermodynamic data is calculated for every combination by Monte Carlo.
+#     Each line gives the distribution of one parameter around the value used by this code: 'ALM.H 1500'
+#     (normal, with a standard deviation of 1500) or 'GAR.W112.S uniform 2' (uniform, from 2 below to 2
+#     above). Parameters are named END-MEMBER.H, .S, .K0-.K3 (standard state enthalpy, entropy and heat
+#     capacity coefficients; e.g. ALM, PY, GR, AN, BQ, EN, FS, ALOPX), END-MEMBER.V0-.V4 (volume, expansion
+#     and compressibility), and GAR.W112.H, .S, .V (the Margules parameters of garnet, opx and plagioclase,
+#     e.g. OPX.W12.H or PL.WABOR.S). Parameters with normal distributions can be correlated, with lines
+#     such as 'correlation ALM.H ALM.S 0.9' (between -1 and 1; a correlation that is inconsistent with those
+#     before it, e.g. A-C -0.9 after A-B 0.9 and B-C 0.9, is reported and not used). 1000 sets of parameters
+#     are drawn once (or n, with a line 'draws n'; the random seed is 0, or s with a line 'seed s'), and
+#     every combination is calculated with all of them at once. The mean and 1 sigma of Fe-Al T final and
+#     P final, and their covariance, are written as extra rows of the output file.
+#
+#     Activity cache: if an optional file 'activitycache.txt' is present, the garnet, opx and plagioclase activities
+#     calculated for a composition at a T and P are kept and reused whenever the same composition is calculated at
+#     the same T and P again (in the runmodes that calculate one combination at a time). Its lines are 'size n' (the
+#     number of activities kept, default 100000; the least recently used are dropped), and 'T q' and 'P q', which
+#     round T to the nearest q K and P to the nearest q kbar before the activities are calculated, so that
+#     calculations at nearly the same T and P share them (default 0: not rounded). Rounding changes T and P final
+#     by up to about q, and the iterations for T and P then stop when they change by less than q. Without rounding
+#     the same activities are hardly ever calculated twice, so the cache is then not used at all (it would only
+#     slow the calculations down). The number of activities reused and calculated is printed at the end.
+#
+#     Result cache: if an optional file 'resultcache.txt' is present, the results of every combination calculated
+#     in runmodes 1-7 are saved in a file, and when the same combination is calculated again (e.g. after an analysis
+#     has been added to an input file) its results are read from the file instead. A result is only reused if the
+#     cations of its analyses, the opx site occupancies (Al site model), the modes, the thermodynamic data, the
+#     settings of the calculation and this code are all exactly the same. Its lines are 'file name' (the file, a
+#     SQLite database; default resultcache.sqlite) and 'size n' (in MB, default 100): when the file grows larger,
+#     the results that have not been used for the most runs are dropped. The file can be shared by many samples, also
+#     by runs at the same time (e.g. by batchRCLC_samples.py): results are written to it 1000 at a time, each time in a
+#     short transaction, so a run only waits briefly for the others.
+#
+#     Many samples: batchRCLC_samples.py runs this code on many samples at once (e.g. every thin section of
+#     a project), each in its own directory with its own input files and modes.txt. 'python
+#     batchRCLC_samples.py project' runs every directory below 'project' holding gar.txt, opx.txt, pl.txt
+#     and modes.txt, with Al model 4 and runmode 2 (or other answers given after the directory, e.g.
+#     'project 1 2'); 'python batchRCLC_samples.py manifest.txt' runs the directories listed in a file,
+#     each optionally followed by its own answers. The samples are shared between as many processes as
+#     the computer has cores: large runmode 2 samples are split into parts (this code accepts the
+#     command-line arguments 'part i n' and 'output name' to calculate only the i-th of n parts of the
+#     combinations of runmodes 1 and 2, and save them to another file), small samples are packed
+#     together, and the largest are started first. The parts of a sample can share its result cache (see
+#     above), and give the same results as an unsplit run. The results of each sample are saved in its
+#     directory, and an index of all the samples with the percentiles of T and P of each is saved to
+#     sampleindex.csv.
+#
 # ##### Uncertainty ######
 #     quantifying and reporting uncertainty in phase-equilibrium calculations is
 #     very difficult. This code does not output an uncertainty. The commonly quoted
@@ -102,6 +312,8 @@
 #     diffusional re-equilibration mineral compositions during cooling, this
 #     thermobarometer is likely more accurate than most other methods of thermobarometry
 #     applied to granulite-facies rocks.
+#     The part of the uncertainty that comes from the analytical uncertainty of the mineral
+#     compositions can be calculated by Monte Carlo (see 'Analytical uncertainty' above).
 #
 #     Al-in-orthpyroxene thermobarometry (as used in this code) has been
 #     evaluated in comparison with other methods of thermobarometry on ultrahigh-temperature
@@ -123,9 +335,63 @@
 ########################################################
 from re import search as rsearch
 from numpy import array as nparray
+from numpy import arange as nparange
+from numpy import column_stack as npcolumn_stack
+from numpy import unravel_index as npunravel_index
+from numpy import ravel_multi_index as npravel_multi_index
+from numpy import percentile as nppercentile
+from numpy import hypot as nphypot
+from numpy import argsort as npargsort
+from numpy import ones as npones
+from numpy import cumsum as npcumsum
+from numpy import dot as npdot
+from numpy import concatenate as npconcatenate
+from numpy import linspace as nplinspace
+from numpy import meshgrid as npmeshgrid
+from numpy import where as npwhere
+from numpy import isnan as npisnan
+from numpy import any as npany
+from numpy import count_nonzero as npcount_nonzero
+from numpy import searchsorted as npsearchsorted
+from numpy import inf as npinf
+from numpy import nan as npnan
+from numpy import full as npfull
+from numpy import isfinite as npisfinite
+from numpy import load as npload
+from numpy import exp as npexp
+from numpy import log as nplog
+from numpy import errstate as nperrstate
+from numpy import ndim as npndim
+from numpy import min as npmin
+from numpy import zeros as npzeros
+from numpy import tile as nptile
+from numpy import cov as npcov
+from numpy.random import default_rng
+from numpy.linalg import cholesky
+from numpy.linalg import LinAlgError
+from numpy.lib.format import open_memmap
+from math import floor, ceil
 from math import exp
 from math import log
+from math import prod
+from itertools import product
+from random import Random
+from heapq import heappush, heappushpop
+from collections import OrderedDict
+from operator import itemgetter
+from hashlib import sha256
+from json import dumps as jsondumps
+from json import loads as jsonloads
+from sqlite3 import connect as sqlite3connect
+from sqlite3 import OperationalError as sqlite3OperationalError
 from csv import writer as csvwriter
+from os.path import exists
+from sys import argv
+from multiprocessing import get_context, get_all_start_methods, cpu_count
+try: # optional: used to find neighbouring analyses in runmode 7, which otherwise uses a slower brute-force search
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
 ########################################################
 ################# END IMPORTING LIBRARIES ##############
 ########################################################
@@ -152,70 +418,56 @@ def ALOPX4(): # Al site occupancy model 4
     global aXFEOPX, aXMGOPX, aXAL_M1
     aXFEOPX, aXMGOPX, aXAL_M1 = aFE2OPX/2, aMGOPX/2, (aALOPX-aFE3OPX-aCROPX-(2*aTIOPX))/4
 
-def CP(): # calculates H and S of minerals at T
+def CP(core=True, crd=True, bt=True): # calculates H and S of minerals at T
     global DATASET, HALM, HPY, HGR, HAN, HBQ, HEN, HFS, HALOPX, HPHL, HANN, HCRD, HFECRD
     global SALM, SPY, SGR, SAN, SBQ, SEN, SFS, SALOPX, SPHL, SANN, SCRD, SFECRD, TK, P
-    # STANDARD STATE ENTHALPIES AND HEAT CAPACITY EXPRESSIONS FROM TWQ202B - BA96A.DAT OF BERMAN
-    HALM = DATASET[0][0] + ( (DATASET[0][2] * (TK - 298.15)) + ((2 * DATASET[0][ 3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[0][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[0][5] * ((TK**-2) - (298.15**-2))))
-    HPY = DATASET[1][0] + ((DATASET[1][2] * (TK - 298.15)) + ((2 * DATASET[1][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[1][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[1][5] * ((TK**-2) - (298.15**-2))))
-    HGR = DATASET[2][0] + ((DATASET[2][2] * (TK - 298.15)) + ((2 * DATASET[2][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[2][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[2][5] * ((TK**-2) - (298.15**-2))))
-    HAN = DATASET[3][0] + ((DATASET[3][2] * (TK - 298.15)) + ((2 * DATASET[3][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[3][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[3][5] * ((TK**-2) - (298.15**-2))))
-    HBQ = DATASET[4][ 0] + ((DATASET[4][2] * (TK - 298.15)) + ((2 * DATASET[4][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[4][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[4][5] * ((TK**-2) - (298.15**-2))))
-    HEN = DATASET[5][ 0] + ((DATASET[5][ 2] * (TK - 298.15)) + ((2 * DATASET[5][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[5][ 4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[5][5] * ((TK**-2) - (298.15**-2))))
-    HFS = DATASET[6][ 0] + ((DATASET[6][ 2] * (TK - 298.15)) + ((2 * DATASET[6][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[6][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[6][ 5] * ((TK**-2) - (298.15**-2))))
-    HALOPX = DATASET[7][0] + ((DATASET[7][2] * (TK - 298.15)) + ((2 * DATASET[7][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[7][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[7][5] * ((TK**-2) - (298.15**-2))))
-    HPHL = DATASET[8][ 0] + ((DATASET[8][ 2] * (TK - 298.15)) + ((2 * DATASET[8][ 3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[8][ 4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[8][ 5] * ((TK**-2) - (298.15**-2))))
-    HANN = DATASET[9][0] + ((DATASET[9][2] * (TK - 298.15)) + ((2 * DATASET[9][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[9][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[9][5] * ((TK**-2) - (298.15**-2))))
-    HCRD = DATASET[10][0] + ((DATASET[10][2] * (TK - 298.15)) + ((2 * DATASET[10][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[10][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[10][5] * ((TK**-2) - (298.15**-2))))
-    HFECRD = DATASET[11][ 0] + ((DATASET[11][ 2] * (TK - 298.15)) + ((2 * DATASET[11][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[11][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[11][5] * ((TK**-2) - (298.15**-2))))
-    # STANDARD STATE ENTROPIES AND HEAT CAPACITY EXPRESSIONS FROM TWQ202B - BA96A.DAT OF BERMAN
-    SALM = DATASET[0][1] + ((DATASET[0][ 2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[0][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[0][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[0][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SPY = DATASET[1][1] + ((DATASET[1][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[1][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[1][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[1][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SGR = DATASET[2][1] + ((DATASET[2][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[2][3]) * ((TK ** -.5) - (298.15 ** -.5))) -  ((.5 * DATASET[2][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[2][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SAN = DATASET[3][1] + ((DATASET[3][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[3][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[3][4]) * ((TK**-2) - (298.15**-2))) -  (((1 / 3) * DATASET[3][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SBQ = DATASET[4][1] + ((DATASET[4][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[4][ 3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[4][ 4]) * ((TK**-2) - (298.15**-2))) -    (((1 / 3) * DATASET[4][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SEN = DATASET[5][1] + ((DATASET[5][2] * ((log(TK)) - (log(298.15)))) -     ((2 * DATASET[5][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[5][ 4]) * ((TK**-2) - (298.15**-2))) -    (((1 / 3) * DATASET[5][ 5]) * ((TK ** -3) - (298.15 ** -3))))
-    SFS = DATASET[6][1] + ((DATASET[6][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[6][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[6][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[6][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SALOPX = DATASET[7][1] + ((DATASET[7][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[7][3]) * ((TK ** -.5) - (298.15 ** -.5))) -  ((.5 * DATASET[7][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[7][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SPHL = DATASET[8][1] + ((DATASET[8][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[8][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[8][ 4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[8][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SANN = DATASET[9][1] + ((DATASET[9][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[9][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[9][4]) * ((TK**-2) - (298.15**-2))) -  (((1 / 3) * DATASET[9][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SCRD = DATASET[10][ 1] + ((DATASET[10][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[10][ 3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[10][ 4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[10][5]) * ((TK ** -3) - (298.15 ** -3))))
-    SFECRD = DATASET[11][1] + ((DATASET[11][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[11][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[11][ 4]) * ((TK**-2) - (298.15**-2))) -  (((1 / 3) * DATASET[11][5]) * ((TK ** -3) - (298.15 ** -3))))
-
-def VOLUMEPT(): # Calculates V of minerals at P and T
+    # only the end-members that are needed are calculated: core for garnet, orthopyroxene, plagioclase and quartz,
+    # crd for cordierite and bt for biotite (e.g. a gar-opx-pl rock never needs phlogopite, annite or cordierite)
+    # STANDARD STATE ENTHALPIES, ENTROPIES AND HEAT CAPACITY EXPRESSIONS FROM TWQ202B - BA96A.DAT OF BERMAN
+    if core:
+        HALM = DATASET[0][0] + ( (DATASET[0][2] * (TK - 298.15)) + ((2 * DATASET[0][ 3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[0][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[0][5] * ((TK**-2) - (298.15**-2))))
+        HPY = DATASET[1][0] + ((DATASET[1][2] * (TK - 298.15)) + ((2 * DATASET[1][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[1][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[1][5] * ((TK**-2) - (298.15**-2))))
+        HGR = DATASET[2][0] + ((DATASET[2][2] * (TK - 298.15)) + ((2 * DATASET[2][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[2][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[2][5] * ((TK**-2) - (298.15**-2))))
+        HAN = DATASET[3][0] + ((DATASET[3][2] * (TK - 298.15)) + ((2 * DATASET[3][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[3][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[3][5] * ((TK**-2) - (298.15**-2))))
+        HBQ = DATASET[4][ 0] + ((DATASET[4][2] * (TK - 298.15)) + ((2 * DATASET[4][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[4][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[4][5] * ((TK**-2) - (298.15**-2))))
+        HEN = DATASET[5][ 0] + ((DATASET[5][ 2] * (TK - 298.15)) + ((2 * DATASET[5][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[5][ 4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[5][5] * ((TK**-2) - (298.15**-2))))
+        HFS = DATASET[6][ 0] + ((DATASET[6][ 2] * (TK - 298.15)) + ((2 * DATASET[6][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[6][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[6][ 5] * ((TK**-2) - (298.15**-2))))
+        HALOPX = DATASET[7][0] + ((DATASET[7][2] * (TK - 298.15)) + ((2 * DATASET[7][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[7][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[7][5] * ((TK**-2) - (298.15**-2))))
+        SALM = DATASET[0][1] + ((DATASET[0][ 2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[0][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[0][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[0][5]) * ((TK ** -3) - (298.15 ** -3))))
+        SPY = DATASET[1][1] + ((DATASET[1][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[1][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[1][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[1][5]) * ((TK ** -3) - (298.15 ** -3))))
+        SGR = DATASET[2][1] + ((DATASET[2][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[2][3]) * ((TK ** -.5) - (298.15 ** -.5))) -  ((.5 * DATASET[2][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[2][5]) * ((TK ** -3) - (298.15 ** -3))))
+        SAN = DATASET[3][1] + ((DATASET[3][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[3][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[3][4]) * ((TK**-2) - (298.15**-2))) -  (((1 / 3) * DATASET[3][5]) * ((TK ** -3) - (298.15 ** -3))))
+        SBQ = DATASET[4][1] + ((DATASET[4][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[4][ 3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[4][ 4]) * ((TK**-2) - (298.15**-2))) -    (((1 / 3) * DATASET[4][5]) * ((TK ** -3) - (298.15 ** -3))))
+        SEN = DATASET[5][1] + ((DATASET[5][2] * ((log(TK)) - (log(298.15)))) -     ((2 * DATASET[5][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[5][ 4]) * ((TK**-2) - (298.15**-2))) -    (((1 / 3) * DATASET[5][ 5]) * ((TK ** -3) - (298.15 ** -3))))
+        SFS = DATASET[6][1] + ((DATASET[6][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[6][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[6][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[6][5]) * ((TK ** -3) - (298.15 ** -3))))
+        SALOPX = DATASET[7][1] + ((DATASET[7][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[7][3]) * ((TK ** -.5) - (298.15 ** -.5))) -  ((.5 * DATASET[7][4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[7][5]) * ((TK ** -3) - (298.15 ** -3))))
+    if bt:
+        HPHL = DATASET[8][ 0] + ((DATASET[8][ 2] * (TK - 298.15)) + ((2 * DATASET[8][ 3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[8][ 4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[8][ 5] * ((TK**-2) - (298.15**-2))))
+        HANN = DATASET[9][0] + ((DATASET[9][2] * (TK - 298.15)) + ((2 * DATASET[9][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[9][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[9][5] * ((TK**-2) - (298.15**-2))))
+        SPHL = DATASET[8][1] + ((DATASET[8][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[8][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[8][ 4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[8][5]) * ((TK ** -3) - (298.15 ** -3))))
+        SANN = DATASET[9][1] + ((DATASET[9][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[9][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[9][4]) * ((TK**-2) - (298.15**-2))) -  (((1 / 3) * DATASET[9][5]) * ((TK ** -3) - (298.15 ** -3))))
+    if crd:
+        HCRD = DATASET[10][0] + ((DATASET[10][2] * (TK - 298.15)) + ((2 * DATASET[10][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[10][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[10][5] * ((TK**-2) - (298.15**-2))))
+        HFECRD = DATASET[11][ 0] + ((DATASET[11][ 2] * (TK - 298.15)) + ((2 * DATASET[11][3]) * ((TK ** .5) - (298.15 ** .5))) - (DATASET[11][4] * ((1/TK) - (1/298.15))) - (.5 * DATASET[11][5] * ((TK**-2) - (298.15**-2))))
+        SCRD = DATASET[10][ 1] + ((DATASET[10][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[10][ 3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[10][ 4]) * ((TK**-2) - (298.15**-2))) - (((1 / 3) * DATASET[10][5]) * ((TK ** -3) - (298.15 ** -3))))
+        SFECRD = DATASET[11][1] + ((DATASET[11][2] * ((log(TK)) - (log(298.15)))) - ((2 * DATASET[11][3]) * ((TK ** -.5) - (298.15 ** -.5))) - ((.5 * DATASET[11][ 4]) * ((TK**-2) - (298.15**-2))) -  (((1 / 3) * DATASET[11][5]) * ((TK ** -3) - (298.15 ** -3))))
+
+def VOLUMEPT(core=True, crd=True, bt=True): # Calculates V of minerals at P and T (of the end-members that are needed, see CP())
     global PBARS, VALM, VPY, VGR, VAN, VBQ, VEN, VFS, VALOPX, VPHL, VANN, VCRD, VFECRD, TK, P
-    # STANDARD STATE VOLUMES AND EXPANSION AND COMPRESSIBILITY EXPRESSIONS FROM TWQ202B - BA96A.DAT OF BERMAN
-    VALM = 11.524 * (1 + (.0000185989054 * (TK - 298)) + (7.4711E-09 * ((TK - 298) ** 2)) + (-.000000570324 * PBARS) + (4.344E-13 * (PBARS ** 2)))
-    VPY = 11.311 * (1 + (0.0000225186544 * (TK - 298)) + (3.7044E-09 * ((TK - 298) ** 2)) + (-.000000576209 * PBARS) + (4.42E-13 * (PBARS ** 2)))
-    VGR = 12.538 * (1 + (0.0000189942017 * (TK - 298)) + (7.9756E-09 * ((TK - 298) ** 2)) + (-.0000006539136 * PBARS) + (1.635E-12 * (PBARS ** 2)))
-    VAN = 10.075 * (1 + (.0000109181141 * (TK - 298)) + (4.1985E-09 * ((TK - 298) ** 2)) + (-.0000012724268 * PBARS) + (3.1762E-12 * (PBARS ** 2)))
-    VBQ = 2.37 * (1 + (0 * (TK - 298)) + (0 * ((TK - 298) ** 2)) + (-.0000012382672 * PBARS) + (7.0871E-12 * (PBARS ** 2)))
-    VEN = 3.133 * (1 + (.0000246558172 * (TK - 298)) + (7.467E-09 * ((TK - 298) ** 2)) + (-.0000007493458 * PBARS) + (4.467E-13 * (PBARS ** 2)))
-    VFS = 3.295 * (1 + (.0000314064017 * (TK - 298)) + (8.04E-09 * ((TK - 298) ** 2)) + (-.0000009111044 * PBARS) + (3.034E-13 * (PBARS ** 2)))
-    VALOPX = 3.093 * (1 + (.0000246558172 * (TK - 298)) + (7.467E-09 * ((TK - 298) ** 2)) + (-.0000007493458 * PBARS) + (4.467E-13 * (PBARS ** 2)))
-    VPHL = 14.971 * (1 + (.0000344473262 * (TK - 298)) + (0 * ((TK - 298) ** 2)) + (-.0000016969784 * PBARS) + (0 * (PBARS ** 2)))
-    VANN = 15.487 * (1 + (.0000344473262 * (TK - 298)) + (0 * ((TK - 298) ** 2)) + (-.0000016969784 * PBARS) + (0 * (PBARS ** 2)))
-    VCRD = 23.311 * (1 + (.0000030028742 * (TK - 298)) + (1.8017E-09 * ((TK - 298) ** 2)) + (-.0000011582515 * PBARS) + (0 * (PBARS ** 2)))
-    VFECRD = 23.706 * (1 + (.0000042647431 * (TK - 298)) + (0 * ((TK - 298) ** 2)) + (-.0000016998228 * PBARS) + (0 * (PBARS ** 2)))
+    # STANDARD STATE VOLUMES AND EXPANSION AND COMPRESSIBILITY EXPRESSIONS FROM TWQ202B - BA96A.DAT OF BERMAN (VOLUMEDATA)
+    if core:
+        VALM, VPY, VGR, VAN, VBQ, VEN, VFS, VALOPX = [V[0] * (1 + (V[1] * (TK - 298)) + (V[2] * ((TK - 298) ** 2)) + (V[3] * PBARS) + (V[4] * (PBARS ** 2))) for V in VOLUMEDATA[:8]]
+    if bt:
+        VPHL, VANN = [V[0] * (1 + (V[1] * (TK - 298)) + (V[2] * ((TK - 298) ** 2)) + (V[3] * PBARS) + (V[4] * (PBARS ** 2))) for V in VOLUMEDATA[8:10]]
+    if crd:
+        VCRD, VFECRD = [V[0] * (1 + (V[1] * (TK - 298)) + (V[2] * ((TK - 298) ** 2)) + (V[3] * PBARS) + (V[4] * (PBARS ** 2))) for V in VOLUMEDATA[10:12]]
 
 def GARNET():
     global AGR, APY, AAL, GAMMAGAR, PBARS, TK, P, XCAGAR, XMGGAR, XFEGAR, XMNGAR
     # GARNET ACTIVITIES FOR CA-FE-MG-MN GARNET WITH THE MODEL IN TWQ202B - BA96a.SLN OF BERMAN
     X1, X2, X3, X4 = XCAGAR, XMGGAR, XFEGAR, XMNGAR
-    W112 = (85529) - (TK * 18.79) + (PBARS * .21)
-    W122 = 50874.9 - (TK * 18.79) + (PBARS * .02)
-    W113 = 24025.5 - (TK * 9.43) + (PBARS * .17)
-    W133 = 9876.2 - (TK * 9.43) + (PBARS * .09)
-    W223 = 1307.4 + (PBARS * .01)
-    W233 = 2092.4 + (PBARS * .06)
-    W123 = 86852.8 - (TK * 28.22) + (PBARS * .28)
-    W124 = 82759.9 - (TK * 28.79) + (PBARS * .1)
-    W134 = 7053.9 + (TK * 30.01) + (PBARS * .13)
-    W234 = (6361) + (TK * 29.44) + (PBARS * .04)
-    W224 = (14558) - (TK * (10)) + (PBARS * .04)
-    W244 = (14558) - (TK * (10)) + (PBARS * .04)
-    W344 = (158) + (TK * 35.1) + (PBARS * .04)
-    W334 = (-(19952)) + (TK * 43.78) + (PBARS * .04)
+    # MARGULES PARAMETERS AT T AND P (GARMARGULES, IN THIS ORDER)
+    W112, W122, W113, W133, W223, W233, W123, W124, W134, W234, W224, W244, W344, W334 = [WH - (TK * WS) + (PBARS * WV) for WH, WS, WV in GARMARGULES.values()]
 
     # This "fixme" comment was left in Widney's code, although it isn't clear why.
     # Things seem to work corrrectly. I have left it here in case someone else notices anything wrong
@@ -265,13 +517,8 @@ def PLAGIOCLASE():
     # THIS SUBROUTINE CALCULATES PLAGIOCLASE ACTIVITIES WITH THE MODEL
     # IN TWQ202B - BA96a.SLN OF BERMAN. IT IS THE MODEL OF FUHRMAN AND LINDSLEY (1988)
     # WITH WORABAN MODIFIED BY BERMAN FOR TWQ202B.
-    WABOR = 18.81 - (TK * .0103) + (P * .39)
-    WORAB = 27.32 - (TK * .0103) + (P * .39)
-    WABAN = 28.226
-    WANAB = 8.471
-    WANOR = 52.468 - (P * .12)
-    WORAN = 47.396
-    WORABAN = 100.0455 - (TK * .0103) - (P * .76)
+    # MARGULES PARAMETERS AT T AND P (PLMARGULES, IN THIS ORDER)
+    WABOR, WORAB, WABAN, WANAB, WANOR, WORAN, WORABAN = [WH - (TK * WS) + (P * WV) for WH, WS, WV in PLMARGULES.values()]
     FIRSTTERM = WORAB * (XAB * XSAN * (.5 - XAN - (2 * XAB)))
     SECONDTERM = WABOR * (XAB * XSAN * (.5 - XAN - (2 * XSAN)))
     THIRDTERM = WORAN * ((2 * XSAN * XAN * (1 - XAN)) + (XAB * XSAN * (.5 - XAN)))
@@ -315,12 +562,11 @@ def ORTHOPYROXENE():
     # IN TWQ202B - BA96a.SLN OF BERMAN. IT IS BASED ON THE MODEL OF ARANOVICH AND BERMAN (1997)
     # NOTE THAT THE ALOPX ACTIVITY MODEL INCLUDES A DARKEN CORRECTION OF THE FORM
     # RTLN(GAMMA)ALOPX =RTLN(GAMMA)ALOPX + FE/(FE+MG)*(DH-T*DS)
-    W12 = -4543.8 + (TK * 3.36)
-    W23 = -32213.3 - (PBARS * .69)
-    W13 = -26944.5 - (PBARS * .58)
+    # MARGULES PARAMETERS AT T AND P (OPXMARGULES, IN THIS ORDER)
+    W12, W23, W13, WDARKEN = [WH - (TK * WS) + (PBARS * WV) for WH, WS, WV in OPXMARGULES.values()]
     RTGAMMAMGOPX = (W12 * (XFEOPX - (XFEOPX * XMGOPX))) - (W23 * XFEOPX * XAL_M1) + (W13 * (XAL_M1 - (XMGOPX * XAL_M1)))
     RTGAMMAFEOPX = (W12 * (XMGOPX - (XFEOPX * XMGOPX))) + (W23 * (XAL_M1 - (XFEOPX * XAL_M1))) - (W13 * XMGOPX * XAL_M1)
-    RTGAMMAALOPX = (-1 * (W12 * XFEOPX * XMGOPX)) + (W23 * (XFEOPX - (XFEOPX * XAL_M1))) + (W13 * (XMGOPX - (XMGOPX * XAL_M1))) + (FERATIOOPX * ((24307) - (TK * 14.404) + (PBARS * .185)))
+    RTGAMMAALOPX = (-1 * (W12 * XFEOPX * XMGOPX)) + (W23 * (XFEOPX - (XFEOPX * XAL_M1))) + (W13 * (XMGOPX - (XMGOPX * XAL_M1))) + (FERATIOOPX * WDARKEN)
     GAMMAMGOPX = exp(RTGAMMAMGOPX / (8.314 * TK))
     GAMMAFEOPX = exp(RTGAMMAFEOPX / (8.314 * TK))
     GAMMAALOPX = exp( RTGAMMAALOPX / (8.314 * TK) )
@@ -329,24 +575,998 @@ def ORTHOPYROXENE():
     AALOPX = XAL_M1 * GAMMAALOPX
     GAMMAOPX = GAMMAMGOPX / GAMMAFEOPX
 
-def outputfunc():
+# the compositions each activity model depends on (read from the globals all at once), and the activities it
+# calculates (see ACTIVITIES())
+CACHEDMODELS = {'GARNET': (itemgetter('XCAGAR', 'XMGGAR', 'XFEGAR', 'XMNGAR'), ['AGR', 'APY', 'AAL', 'GAMMAGAR']),
+                'PLAGIOCLASE': (itemgetter('XAN', 'XAB', 'XSAN'), ['AAN']),
+                'ORTHOPYROXENE': (itemgetter('XFEOPX', 'XMGOPX', 'XAL_M1', 'FERATIOOPX'), ['AEN', 'AFS', 'AALOPX', 'GAMMAOPX'])}
+
+def ACTIVITIES(model):
+    # runs an activity model (GARNET, PLAGIOCLASE or ORTHOPYROXENE) through the activity cache, if it is used (see
+    # activitycache.txt): the activities of a composition at a T and P (rounded to the nearest cacheTquantum K and
+    # cachePquantum kbar, if not 0) are calculated once, and kept until they are the least recently used of more than
+    # cachesize. The cache is only used when T or P is rounded. Calculations of many combinations at once (see
+    # RCLCvectorized()) do not use it
+    global TK, P, PBARS, AAN
+    if model is PLAGIOCLASE and boundAAN is not None: # a bound of the anorthite activity, not that of an analysis (see plbounds())
+        AAN = boundAAN
+        return
+    if activitycache is None:
+        model()
+        return
+    inputs, outputs = CACHEDMODELS[model.__name__]
+    g = globals()
+    try:
+        T = round(TK / cacheTquantum) * cacheTquantum if cacheTquantum else TK
+        Pkbar = round(P / cachePquantum) * cachePquantum if cachePquantum else P
+        key = (model, T, Pkbar) + inputs(g)
+        activities = activitycache.get(key)
+    except TypeError: # arrays of compositions, T or P, which can be neither rounded nor kept
+        model()
+        return
+    if activities is None:
+        cachecounts['misses'] += 1
+        if cacheTquantum or cachePquantum: # the activities at the rounded T and P
+            nominal = TK, P, PBARS
+            TK, P, PBARS = T, Pkbar, (Pkbar * 1000 if cachePquantum else PBARS)
+            try:
+                model()
+            finally:
+                TK, P, PBARS = nominal
+        else:
+            model()
+        activities = tuple(g[name] for name in outputs)
+        activitycache[key] = activities
+        if len(activitycache) > cachesize:
+            activitycache.popitem(last=False) # the least recently used
+    else:
+        cachecounts['hits'] += 1
+        activitycache.move_to_end(key)
+        g.update(zip(outputs, activities))
+
+def present(m):
+    # True if cordierite or biotite (m) is included in the calculation: if it has an input file and a mode
+    # above 0.01. The modes can also be arrays (one mode per calculation, see sensitivities()), in which
+    # case this is an array too, with one element per calculation
+    if {'crd': skip_crd, 'bt': skip_bt}[m]:
+        return False
+    return minmodes[m] > 0.01 if npndim(minmodes[m]) else float(minmodes[m]) > 0.01
+
+def masked(use, value, otherwise):
+    # value in the calculations that include a mineral (use, from present()) and otherwise in the others. use is
+    # True or False for a single calculation, or an array with one element per calculation
+    if npndim(use) == 0:
+        return value if use else otherwise
+    return npwhere(use, value, otherwise)
+
+def TPsteps():
+    # the changes of T (K) and P (kbar) in an iteration below which T and P have converged: TTOLERANCE and PTOLERANCE,
+    # or with an activity cache that rounds T and P (see ACTIVITIES()), the rounding, as they cannot converge more finely
+    if activitycache is not None:
+        return max(TTOLERANCE, cacheTquantum), max(PTOLERANCE, cachePquantum)
+    return TTOLERANCE, PTOLERANCE
+
+def TPconverged(TKOLD, POLD):
+    # True if T and P changed by less than TPsteps() in the last iteration (in every calculation, if many are
+    # calculated at once; NaN, e.g. from pixels that cannot be calculated, never prevents this)
+    Tstep, Pstep = TPsteps()
+    return not npany(abs(TK - TKOLD) > Tstep) and not npany(abs(P - POLD) > Pstep)
+
+def notconverged(stage, TKOLD, POLD):
+    # counts the calculations whose T and P had not converged when the iterations of a stage stopped after
+    # MAXITERATIONS (one, or those of many calculated at once that had not), so that they are reported at the end
+    Tstep, Pstep = TPsteps()
+    unconverged[stage] = unconverged.get(stage, 0) + int(npcount_nonzero((abs(TK - TKOLD) > Tstep) | (abs(P - POLD) > Pstep)))
+
+def MGRATIOS(XMGROCK, MFGAR, MFOPX, KDGAROPX, others):
+    # corrected Mg-ratios of garnet, opx and the other Fe-Mg minerals that satisfy every Fe-Mg exchange KD and the
+    # XMGROCK mass balance together. others holds (MF, KD, use, MGRATIO) of cordierite and biotite, if included.
+    # Returns MGRATIOGAR, MGRATIOOPX and a list of the Mg-ratios of others (MGRATIO where use is False)
+    if not others: # gar-opx only: the quadratic solution of the mass balance and KD(GRT-OPX) is exact
+        A = MFOPX - (KDGAROPX * MFOPX)
+        B = (MFOPX * KDGAROPX) + MFGAR + (XMGROCK * KDGAROPX) - XMGROCK
+        C = -(XMGROCK * KDGAROPX)
+        MGRATIOOPX = (-B + (((B ** 2) - (4 * A * C)) ** .5)) / (2 * A)
+        return (XMGROCK - (MGRATIOOPX * MFOPX)) / MFGAR, MGRATIOOPX, []
+    # every exchange gives the Mg-ratio of the mineral from that of garnet, X = KD*XGAR / (1 + (KD-1)*XGAR), so the
+    # mass balance is one equation in the Mg-ratio of garnet, increasing from -XMGROCK at 0 to 1-XMGROCK at 1. It is
+    # solved by Newton's method, with a bisection step whenever a Newton step would leave the bracket of the root
+    exchanges = [(MFOPX, KDGAROPX, True)] + [(MF, KD, use) for MF, KD, use, MGRATIO in others]
+    MGRATIOGAR = XMGROCK + 0 * MFGAR # an array if any of the inputs is
+    lo, hi = 0 * MGRATIOGAR, 0 * MGRATIOGAR + 1
+    for L in range(60): # converges in a few iterations; 60 bisections would narrow the bracket to 1e-18
+        F, DF = (MGRATIOGAR * MFGAR) - XMGROCK, MFGAR
+        for MF, KD, use in exchanges:
+            F = F + masked(use, MF * KD * MGRATIOGAR / (1 + ((KD - 1) * MGRATIOGAR)), 0)
+            DF = DF + masked(use, MF * KD / ((1 + ((KD - 1) * MGRATIOGAR)) ** 2), 0)
+        lo, hi = masked(F < 0, MGRATIOGAR, lo), masked(F < 0, hi, MGRATIOGAR)
+        NEWTON = MGRATIOGAR - (F / DF)
+        NEWTON = masked((NEWTON > lo) & (NEWTON < hi), NEWTON, (lo + hi) / 2)
+        converged = not npany(abs(NEWTON - MGRATIOGAR) > 1e-12) # NaN (e.g. map pixels that cannot be calculated) never blocks this
+        MGRATIOGAR = NEWTON
+        if converged:
+            break
+    MGRATIOOPX = KDGAROPX * MGRATIOGAR / (1 + ((KDGAROPX - 1) * MGRATIOGAR))
+    return MGRATIOGAR, MGRATIOOPX, [masked(use, KD * MGRATIOGAR / (1 + ((KD - 1) * MGRATIOGAR)), MGRATIO) for MF, KD, use, MGRATIO in others]
+
+def outputrow():
+    # the results of the most recent calculation, in the order in which they are written to the output file
+    return [TC, P, TGAROPX, TGARBT, TGARCRD, TFEALI, PFEALI, TGAROPXI, PGAROPXI, TGARBTI, PGARBTI, TGARCRDI, PGARCRDI, MASSBALANCE]
+
+def outputfunc(combo, row=None):
     # this function builds the output variables from the output of each iteration of the main program
-    global TFEALIout, TFEALI, PFEALIout, PFEALI, TGAROPXIout, TGAROPXI, PGAROPXIout
-    global PGAROPXI, TGARBTIout, TGARBTI, PGARBTIout, PGARBTI, TGARCRDIout, TGARCRDI
-    global PGARCRDIout, PGARCRDI, TCout, TC, Pout, P, TGAROPXout, TGAROPX, TGARBTout, TGARBT, TGARCRDout, TGARCRD
-    TFEALIout.append(TFEALI)
-    PFEALIout.append(PFEALI)
-    TGAROPXIout.append(TGAROPXI)
-    PGAROPXIout.append(PGAROPXI)
-    TGARBTIout.append(TGARBTI)
-    PGARBTIout.append(PGARBTI)
-    TGARCRDIout.append(TGARCRDI)
-    PGARCRDIout.append(PGARCRDI)
-    TCout.append(TC)
-    Pout.append(P)
-    TGAROPXout.append(TGAROPX)
-    TGARBTout.append(TGARBT)
-    TGARCRDout.append(TGARCRD)
+    # (or from a row of results that was saved earlier, e.g. by runmode 3)
+    if row is None:
+        row = outputrow()
+    calctracker.append(combolabel(combo))
+    combosout.append(tuple(combo))
+    weightout.append(comboweight(combo))
+    for out, value in zip(results[1:], row):
+        out.append(value)
+    if mcdraws: # analytical uncertainty
+        for out, value in zip(mcout, montecarlo(combo)):
+            out.append(value)
+    if thermodraws: # uncertainty of the thermodynamic data
+        for out, value in zip(thermomcout, thermomontecarlo(combo)):
+            out.append(value)
+
+def outputbatch(combos, modes=None):
+    # outputfunc() for each of an array of combinations calculated at once by RCLCvectorized(), with the
+    # modes of each combination (if given as arrays, see combomodes()) also used for its uncertainties
+    global minmodes
+    row = outputrow()
+    rows = [[float(value[j]) if npndim(value) else value for value in row] for j in range(len(combos))]
+    nominal = minmodes
+    try:
+        for j, (combo, row) in enumerate(zip(combos, rows)):
+            if modes is not None:
+                minmodes = {m: float(modes[m][j]) for m in modes}
+            outputfunc(combo, row)
+    finally:
+        minmodes = nominal
+
+def comboweight(combo):
+    # the number of combinations of the input analyses that a combination stands for, when near-identical
+    # analyses have been merged (1 otherwise)
+    return prod(int(weights[m][i]) for m, i in zip(minerals, combo))
+
+def setanalyses(combo):
+    # sets the mineral compositions used by RCLCfunction() to the analyses in combo (one analysis
+    # index per mineral, in the order of the minerals list). All compositions are reset for every
+    # calculation because RCLCfunction() modifies some of them (e.g. XFEOPX and XMGOPX) while correcting
+    # the Fe-Mg ratios, and the result of a calculation must not depend on the calculation run before it.
+    global SIOPX, TIOPX, ALOPX, CROPX, FE3OPX, FE2OPX, MNOPX, MGOPX, CAOPX, XFEOPX, XMGOPX, XAL_M1
+    global FEGAR, MNGAR, MGGAR, CAGAR
+    global CAPL, NAPL, KPL
+    global SIBT, TIBT, ALBT, FEBT, MNBT, MGBT, NABT, KBT
+    global FECRD, MNCRD, MGCRD
+    # combo can also be an array of combinations (one row per combination), which sets each composition to
+    # an array of analyses, one for each combination (see RCLCvectorized())
+    c = dict(zip(minerals, nparray(combo).T))
+    i = c['opx']
+    SIOPX, TIOPX, ALOPX, CROPX, FE3OPX, FE2OPX, MNOPX, MGOPX, CAOPX = aSIOPX[i], aTIOPX[i], aALOPX[i], aCROPX[i], aFE3OPX[i], aFE2OPX[i], aMNOPX[i], aMGOPX[i], aCAOPX[i]
+    XFEOPX, XMGOPX, XAL_M1 = aXFEOPX[i], aXMGOPX[i], aXAL_M1[i]
+    i = c['gar']
+    FEGAR, MNGAR, MGGAR, CAGAR = aFEGAR[i], aMNGAR[i], aMGGAR[i], aCAGAR[i]
+    i = c['pl']
+    CAPL, NAPL, KPL = aCAPL[i], aNAPL[i], aKPL[i]
+    if 'bt' in c: # if using biotite
+        i = c['bt']
+        SIBT, TIBT, ALBT, FEBT, MNBT, MGBT, NABT, KBT = aSIBT[i], aTIBT[i], aALBT[i], aFEBT[i], aMNBT[i], aMGBT[i], aNABT[i], aKBT[i]
+    if 'crd' in c: # if using cordierite
+        i = c['crd']
+        FECRD, MNCRD, MGCRD = aFECRD[i], aMNCRD[i], aMGCRD[i]
+
+def RCLCvectorized(modes=None):
+    # runs RCLCfunction() for many combinations at once, when the mineral compositions are arrays (one
+    # element per combination, see setanalyses()) rather than single analyses. The calculation has no
+    # branches that depend on the compositions, so only exp and log have to be replaced by their numpy
+    # versions, which work element by element. The results (TC, P...) are then arrays as well. The modes
+    # can be given as arrays too (one mode per combination, e.g. from combomodes()), in which case biotite
+    # and cordierite are included in some combinations and not others (see present())
+    global exp, log, minmodes, activitycache
+    scalar, nominal, cache = (exp, log), minmodes, activitycache
+    exp, log = npexp, nplog
+    if modes is not None:
+        minmodes = modes
+    activitycache = None # the thermodynamic data can be arrays here (see thermomontecarlo())
+    try:
+        with nperrstate(all='ignore'): # e.g. pixels whose compositions cannot be calculated give NaN
+            RCLCfunction()
+    finally:
+        (exp, log), minmodes, activitycache = scalar, nominal, cache
+
+def combomodes(combos):
+    # the modes of each of combos (an array of combinations), as arrays with one mode per combination: those of
+    # modes.txt, or in runmode 10 those of the sample of each combination (see modesbysample)
+    if runmode != 10:
+        return {m: npfull(len(combos), minmodes[m]) for m in minmodes}
+    samples = [extracolumns['gar']['sample'][g] for g in combos[:, minerals.index('gar')]]
+    return {m: nparray([modesbysample[sample][m] for sample in samples], dtype=float) for m in minmodes}
+
+def alsitemodels(combos, models):
+    # Fe-Al T final and P final of each of combos (an array of combinations) with each of the Al site models in
+    # models (e.g. [ALOPX1, ALOPX2]), calculated at once. The models only change XFEOPX, XMGOPX and XAL_M1, so the
+    # combinations are repeated once per model and everything else is set once. Returns two arrays (T and P) with
+    # one row per combination and one column per model
+    global XFEOPX, XMGOPX, XAL_M1
+    nominal = {'aXFEOPX': aXFEOPX, 'aXMGOPX': aXMGOPX, 'aXAL_M1': aXAL_M1}
+    i = combos[:, minerals.index('opx')]
+    sites = []
+    for model in models:
+        model()
+        sites.append([aXFEOPX[i], aXMGOPX[i], aXAL_M1[i]])
+    globals().update(nominal)
+    setanalyses(nptile(combos, (len(models), 1)))
+    XFEOPX, XMGOPX, XAL_M1 = [npconcatenate(site) for site in zip(*sites)]
+    RCLCvectorized({m: nptile(modes, len(models)) for m, modes in combomodes(combos).items()})
+    return nparray(TC).reshape(len(models), len(combos)).T, nparray(P).reshape(len(models), len(combos)).T
+
+def combolabel(combo):
+    # builds the 'analyses used' label of a combination of mineral analyses, numbering the analyses
+    # as in the input files
+    c = {m: analysisnumbers[m][i] for m, i in zip(minerals, combo)}
+    if runmode == 1:
+        return 'calculation'+str(c['opx'])
+    label = 'opx'+str(c['opx'])+' gar'+str(c['gar'])+' pl'+str(c['pl'])
+    if runmode == 10: # biotite or cordierite of another sample only stand in for a sample that has none
+        sample = extracolumns['gar']['sample'][combo[minerals.index('gar')]]
+        c = {m: c[m] for m, i in zip(minerals, combo) if extracolumns[m]['sample'][i] == sample}
+    if 'bt' in c:
+        label += ' bt'+str(c['bt'])
+    if 'crd' in c:
+        label += ' crd'+str(c['crd'])
+    return label
+
+def readfilter(filename):
+    # reads the rules in filter.txt that restrict which analyses may be combined, using the labels in the
+    # optional Label column of the mineral input files. One rule per line:
+    #   gar.rim with opx.rim    a garnet labelled rim may only be combined with opx labelled rim
+    #   no pl.inclusion         (or: no inclusion pl) plagioclase labelled inclusion is not used
+    #   only gar.rim            (or: only rim gar) only garnet labelled rim is used
+    rules = []
+    with open(filename) as rulefile:
+        for line in rulefile:
+            words = line.lower().replace('.', ' ').split()
+            if not words or words[0].startswith('#'):
+                continue
+            if words[0] in ['no', 'only'] and len(words) == 3:
+                m, label = (words[1], words[2]) if words[1] in extracolumns else (words[2], words[1])
+                rule = (words[0], m, label)
+            elif len(words) == 5 and words[2] == 'with':
+                rule = ('with', words[0], words[1], words[3], words[4])
+            else:
+                print('filter rule not understood and not used: '+line.strip())
+                continue
+            if any(m not in extracolumns or 'label' not in extracolumns[m] for m in rule[1::2]):
+                print('filter rule not used, because a mineral in it is not included or has no Label column: '+line.strip())
+                continue
+            rules.append(rule)
+    return rules
+
+def combofilter(combos):
+    # True for each combination (a row of analysis indices, as yielded by combinations()) allowed by the
+    # filter rules. The rules are evaluated on the whole array of combinations at once, before any is run
+    allowed = npones(len(combos), dtype=bool)
+    for rule in filterrules:
+        labels = nparray([str(label).lower() for label in extracolumns[rule[1]]['label']])[combos[:, minerals.index(rule[1])]]
+        if rule[0] == 'no':
+            allowed &= labels != rule[2]
+        elif rule[0] == 'only':
+            allowed &= labels == rule[2]
+        else:
+            labels2 = nparray([str(label).lower() for label in extracolumns[rule[3]]['label']])[combos[:, minerals.index(rule[3])]]
+            allowed &= (labels != rule[2]) | (labels2 == rule[4])
+    return allowed
+
+def analysisallowed(m, i):
+    # False if analysis i of mineral m is excluded outright by a 'no' or 'only' filter rule
+    for rule in filterrules:
+        if rule[0] in ['no', 'only'] and rule[1] == m:
+            if (str(extracolumns[m]['label'][i]).lower() == rule[2]) == (rule[0] == 'no'):
+                return False
+    return True
+
+def combinations(chunksize=10000):
+    # yields the combinations of mineral analyses to calculate, chunksize combinations at a time, as
+    # arrays of analysis indices (one row per calculation, one column per mineral in the minerals list).
+    # Only one chunk is held in memory at a time, so runs with a very large number of combinations
+    # do not have to build the full list of combinations first. Combinations excluded by the rules
+    # in filter.txt are removed before they are run.
+    for combos in candidatecombinations(chunksize):
+        if filterrules:
+            combos = combos[combofilter(combos)]
+        if len(combos) > 0:
+            yield combos
+
+def candidatecombinations(chunksize):
+    # yields every combination of mineral analyses for the selected runmode, before filtering (see combinations())
+    shape = [nanalyses[m] for m in minerals]
+    if runmode == 1: # analyses in sequence: gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN
+        total = shape[0]
+    else: # every possible combination, in the same order as nested loops over opx, gar, pl, crd, bt
+        total = prod(shape)
+    if runmode == 6: # the paired minerals in sequence, crossed with every analysis of the other minerals
+        crossed = [m for m in minerals if m not in paired]
+        pairshape = [nanalyses[paired[0]]] + [nanalyses[m] for m in crossed]
+        for start in range(0, prod(pairshape), chunksize):
+            indices = npunravel_index(nparange(start, min(start + chunksize, prod(pairshape))), pairshape)
+            yield npcolumn_stack([indices[0] if m in paired else indices[1 + crossed.index(m)] for m in minerals])
+        return
+    if runmode == 7: # every garnet analysis with every combination of the analyses of the other minerals near it
+        for g in range(nanalyses['gar']):
+            combos = list(product(*[[g] if m == 'gar' else neighbours(m, g) for m in minerals]))
+            if combos:
+                yield nparray(combos)
+        return
+    if runmode == 9: # the garnet and opx analyses of a traverse at about the same distance from the interface,
+        # crossed with every analysis of the other minerals
+        others = [m for m in minerals if m not in ['gar', 'opx']]
+        gardistance = nparray(extracolumns['gar']['distance'], dtype=float)
+        pairs = [(g, o) for g in npargsort(gardistance, kind='stable') for o in transectpartners(g)]
+        combos = [[{'gar': g, 'opx': o}[m] if m in ['gar', 'opx'] else rest[others.index(m)] for m in minerals] \
+                  for g, o in pairs for rest in product(*[range(nanalyses[m]) for m in others])]
+        for start in range(0, len(combos), chunksize):
+            yield nparray(combos[start:start + chunksize], dtype=int)
+        return
+    if runmode == 10: # every combination of the analyses of each sample, with many samples packed into each chunk
+        batch = []
+        for sample in sampleanalyses:
+            batch += product(*[sampleanalyses[sample][m] for m in minerals])
+            while len(batch) >= chunksize:
+                yield nparray(batch[:chunksize], dtype=int)
+                batch = batch[chunksize:]
+        if batch:
+            yield nparray(batch, dtype=int)
+        return
+    if runmode == 5: # a random sample of every possible combination, one batch of chunksize at a time
+        rng = Random(seed)
+        shift = [rng.random() for m in minerals] # random shift of the quasi-random sequence, so it is seeded too
+        seen, n = set(), 0
+        while len(seen) < total:
+            batch = []
+            while len(batch) < chunksize and len(seen) < total:
+                if sampling == 1: # pseudo-random
+                    candidates = [rng.randrange(total)]
+                elif sampling == 2: # quasi-random
+                    n += 1
+                    combo = [int(((halton(n, PRIMES[d]) + shift[d]) % 1) * shape[d]) for d in range(len(shape))]
+                    candidates = [int(npravel_multi_index(tuple(combo), shape))]
+                else: # stratified: a Latin hypercube over the analyses of each mineral. Every analysis of
+                    # every mineral is used at least once in each round of max(shape) combinations, and the
+                    # analyses of different minerals are paired by independent random permutations
+                    columns = []
+                    for d in range(len(shape)):
+                        column = []
+                        while len(column) < max(shape):
+                            permutation = list(range(shape[d]))
+                            rng.shuffle(permutation)
+                            column += permutation
+                        columns.append(column[:max(shape)])
+                    candidates = [int(npravel_multi_index(combo, shape)) for combo in zip(*columns)]
+                for flat in candidates:
+                    if flat not in seen: # combinations are sampled without replacement
+                        seen.add(flat)
+                        batch.append(flat)
+            yield npcolumn_stack(npunravel_index(nparray(batch), shape))
+        return
+    first, last = total * part[0] // part[1], total * (part[0] + 1) // part[1] # every combination, unless split into parts
+    for start in range(first, last, chunksize):
+        flat = nparange(start, min(start + chunksize, last))
+        if runmode == 1:
+            yield npcolumn_stack([flat] * len(minerals))
+        else:
+            yield npcolumn_stack(npunravel_index(flat, shape))
+
+def selectanalyses(m, keep):
+    # keeps only the analyses of mineral m with indices in keep (in that order), in every array holding its data
+    for name in MINERALDATA[m]:
+        globals()[name] = nparray(globals()[name])[keep]
+    for name in extracolumns[m]:
+        extracolumns[m][name] = [extracolumns[m][name][i] for i in keep]
+    weights[m], analysisnumbers[m] = weights[m][keep], analysisnumbers[m][keep]
+    if m in sigmas:
+        sigmas[m] = sigmas[m][keep]
+
+def mergeanalyses(m, tolerance):
+    # merges each analysis of mineral m whose cations are all within tolerance (a dictionary of element:
+    # tolerance) of an earlier analysis, and that has the same label and sample if those columns are present,
+    # into that earlier analysis. The earlier analysis is then counted once for every analysis merged into it
+    data = npcolumn_stack([nparray(globals()[name], dtype=float) for name in MINERALDATA[m]])
+    tolerances = nparray([tolerance[ELEMENTS[name[1:-len(m)]]] for name in MINERALDATA[m]])
+    keys = [tuple(extracolumns[m][name][i] for name in ['label', 'sample'] if name in extracolumns[m]) for i in range(len(data))]
+    keep, counts = [], []
+    for i in range(len(data)):
+        close = [j for j in (abs(data[keep] - data[i]) <= tolerances).all(axis=1).nonzero()[0] if keys[keep[j]] == keys[i]] if keep else []
+        if close:
+            counts[close[0]] += weights[m][i]
+        else:
+            keep.append(i)
+            counts.append(weights[m][i])
+    selectanalyses(m, keep)
+    weights[m] = nparray(counts)
+
+def clusteranalyses(m, k):
+    # reduces the analyses of mineral m to k representative analyses: the medoids of k clusters of similar
+    # compositions (k-medoids, with each cation scaled by its standard deviation). Each representative is
+    # then counted once for every analysis in its cluster. Analyses with different labels or samples are
+    # never put in the same cluster, so there is at least one representative for every label and sample
+    data = npcolumn_stack([nparray(globals()[name], dtype=float) for name in MINERALDATA[m]])
+    scale = data.std(axis=0)
+    scale[scale == 0] = 1
+    data = data / scale
+    keys = [tuple(extracolumns[m][name][i] for name in ['label', 'sample'] if name in extracolumns[m]) for i in range(len(data))]
+    codes = {key: c for c, key in enumerate(dict.fromkeys(keys))}
+    keys = nparray([codes[key] for key in keys]) # one number for each label and sample
+    everyone = nparange(len(data))
+    w = weights[m]
+    # the initial medoids: the most central analysis of each label and sample, then the analysis furthest
+    # from the medoids chosen so far, until there are k
+    medoids = []
+    for c in codes.values():
+        medoids.append(clustermedoid(data, keys, w, (keys == c).nonzero()[0]))
+    while len(medoids) < k:
+        furthest = npcolumn_stack([clusterdistances(data, keys, c, everyone) for c in medoids]).min(axis=1)
+        if furthest.max() == 0: # fewer distinct compositions than k
+            break
+        medoids.append(int(furthest.argmax()))
+    for iteration in range(100):
+        nearest = npcolumn_stack([clusterdistances(data, keys, c, everyone) for c in medoids]).argmin(axis=1)
+        updated = []
+        for c in range(len(medoids)):
+            members = (nearest == c).nonzero()[0]
+            if len(members) == 0: # a medoid with the same composition as another one
+                continue
+            updated.append(clustermedoid(data, keys, w, members))
+        if updated == medoids:
+            break
+        medoids = updated
+    nearest = npcolumn_stack([clusterdistances(data, keys, c, everyone) for c in medoids]).argmin(axis=1)
+    counts = [int(w[nearest == c].sum()) for c in range(len(medoids))]
+    order = npargsort(medoids)
+    selectanalyses(m, [medoids[c] for c in order])
+    weights[m] = nparray([counts[c] for c in order])
+
+def clusterdistances(data, keys, i, others):
+    # the distances of the analyses others (indices of rows of data) from analysis i (see clusteranalyses()), infinite
+    # for those with a different label or sample (keys). Only one row of distances is held in memory at a time
+    distance = ((data[others] - data[i]) ** 2).sum(axis=1) ** 0.5
+    distance[keys[others] != keys[i]] = npinf
+    return distance
+
+def clustermedoid(data, keys, w, members):
+    # the analysis among members (indices of rows of data) with the smallest sum of distances from the others,
+    # each weighted by the number of analyses it stands for (see clusteranalyses())
+    return int(members[nparray([(clusterdistances(data, keys, i, members) * w[members]).sum() for i in members]).argmin()])
+
+def cations(m, i):
+    # the 11 cations of analysis i of mineral m, in the order of the input files (0 for those that are not used)
+    row = npzeros(11)
+    for name in MINERALDATA[m]:
+        row[COLUMNS.index(ELEMENTS[name[1:-len(m)]])] = globals()[name][i]
+    return row
+
+def setcompositions(compositions):
+    # sets the mineral compositions used by RCLCfunction() to arrays of compositions that are not in the
+    # input files, e.g. the pixels of a map (runmode 8). compositions is a dictionary of mineral: array with
+    # one row of 11 cations (in the order of the input files) for each calculation. The analyses read from
+    # the input files are left as they were
+    saved = {name: globals()[name] for m in compositions for name in MINERALDATA[m]}
+    saved.update({'aXFEOPX': aXFEOPX, 'aXMGOPX': aXMGOPX, 'aXAL_M1': aXAL_M1})
+    for m in compositions:
+        for name in MINERALDATA[m]:
+            globals()[name] = compositions[m][:, COLUMNS.index(ELEMENTS[name[1:-len(m)]])]
+    {1: ALOPX1, 2: ALOPX2, 3: ALOPX3, 4: ALOPX4}[num]()
+    n = len(compositions[minerals[0]])
+    setanalyses(npcolumn_stack([nparange(n)] * len(minerals)))
+    globals().update(saved)
+
+def montecarlo(combo):
+    # the mean and standard deviation of Fe-Al T final and P final, and their covariance, over mcdraws
+    # calculations of combo in which every cation of every analysis has a random error added, drawn from
+    # a normal distribution with the standard deviation in sigmas. All the draws are calculated at once.
+    # The random errors depend only on mcseed and the analyses in combo, so they are the same in every runmode
+    rng = default_rng([mcseed] + [int(analysisnumbers[m][i]) for m, i in zip(minerals, combo)])
+    setcompositions({m: (cations(m, i) + rng.standard_normal((mcdraws, 11)) * sigmas[m][i]).clip(0) for m, i in zip(minerals, combo)})
+    RCLCvectorized()
+    return drawsummary()
+
+def sensitivities(combos):
+    # the derivatives of Fe-Al T final and P final with respect to every cation of the analyses of each of combos
+    # (an array of combinations) and to the modes (see derivativeinputs()), by central differences. The
+    # perturbed calculations of all the combinations are run at once. Returns two arrays (T and P) with one
+    # row per combination and one column per input
+    global minmodes
+    inputs = derivativeinputs()
+    n = 2 * len(inputs) # one calculation with each input increased by DERIVATIVESTEP, and one with it decreased
+    compositions = {m: nparray([cations(m, i) for i in combos[:, d]]).repeat(n, axis=0) for d, m in enumerate(minerals)}
+    modes = {m: modes.repeat(n) for m, modes in combomodes(combos).items()}
+    for k, (m, element) in enumerate(inputs):
+        for sign, offset in [(1, 2 * k), (-1, 2 * k + 1)]:
+            rows = nparange(offset, len(combos) * n, n)
+            if m == 'mode':
+                modes[element][rows] += sign * DERIVATIVESTEP
+            else:
+                compositions[m][rows, COLUMNS.index(element)] += sign * DERIVATIVESTEP
+    nominal, minmodes = minmodes, modes
+    try:
+        setcompositions(compositions)
+        RCLCvectorized()
+    finally:
+        minmodes = nominal
+    perturbedT, perturbedP = nparray(TC).reshape(len(combos), len(inputs), 2), nparray(P).reshape(len(combos), len(inputs), 2)
+    return (perturbedT[:, :, 0] - perturbedT[:, :, 1]) / (2 * DERIVATIVESTEP), (perturbedP[:, :, 0] - perturbedP[:, :, 1]) / (2 * DERIVATIVESTEP)
+
+def derivativeinputs():
+    # the inputs that sensitivities() calculates derivatives with respect to: (mineral, element) for each
+    # cation that is used, and ('mode', mineral) for the mode of each Fe-Mg mineral
+    return [(m, ELEMENTS[name[1:-len(m)]]) for m in minerals for name in MINERALDATA[m]] + [('mode', m) for m in minerals if m != 'pl']
+
+def linearerrors(combos, dT, dP):
+    # 1 sigma of Fe-Al T final and P final, and their covariance (the linearised error ellipse), of each of combos
+    # from the derivatives calculated by sensitivities() and the uncertainties of the cations and modes
+    out = []
+    for combo, dTcombo, dPcombo in zip(combos, dT, dP):
+        c = dict(zip(minerals, combo))
+        sigma = nparray([modesigma.get(element, 0) if m == 'mode' else sigmas[m][c[m], COLUMNS.index(element)] for m, element in derivativeinputs()])
+        out.append([float((dTcombo ** 2 * sigma ** 2).sum() ** .5), float((dPcombo ** 2 * sigma ** 2).sum() ** .5), float((dTcombo * dPcombo * sigma ** 2).sum())])
+    return out
+
+def thermomontecarlo(combo):
+    # the mean and standard deviation of Fe-Al T final and P final, and their covariance, over the thermodynamic
+    # data sets drawn by drawthermodata(), for combo. All the data sets are calculated at once
+    nominal = {name: globals()[name] for name in thermodraws}
+    globals().update(thermodraws)
+    try:
+        setanalyses(combo)
+        RCLCvectorized()
+    finally:
+        globals().update(nominal)
+    return drawsummary()
+
+def drawsummary():
+    # the mean and standard deviation of Fe-Al T final and P final, and their covariance, from the most recent
+    # calculation of an array of random draws (see montecarlo() and thermomontecarlo())
+    drawnT, drawnP = nparray(TC), nparray(P)
+    calculated = npisfinite(drawnT) & npisfinite(drawnP) # draws that cannot be calculated are left out
+    if calculated.sum() < 2:
+        return [npnan] * 5
+    covariance = npcov(drawnT[calculated], drawnP[calculated])
+    return [float(drawnT[calculated].mean()), float(covariance[0, 0] ** .5), float(drawnP[calculated].mean()), float(covariance[1, 1] ** .5), float(covariance[0, 1])]
+
+def thermoparameters():
+    # the thermodynamic parameters that can be given an uncertainty (in thermouncertainty.txt), as a dictionary
+    # of name: (table, row, column). e.g. ALM.H is the enthalpy of almandine in DATASET, PY.V3 a compressibility
+    # coefficient of pyrope in VOLUMEDATA, and GAR.W112.S the entropy term of W112 in GARMARGULES
+    parameters = dict()
+    for i, endmember in enumerate(ENDMEMBERS):
+        for j, name in enumerate(['H', 'S', 'K0', 'K1', 'K2', 'K3']):
+            parameters[endmember+'.'+name] = ('DATASET', i, j)
+        for j in range(5):
+            parameters[endmember+'.V'+str(j)] = ('VOLUMEDATA', i, j)
+    for mineral, table in [('GAR', 'GARMARGULES'), ('OPX', 'OPXMARGULES'), ('PL', 'PLMARGULES')]:
+        for W in globals()[table]:
+            for j, name in enumerate(['H', 'S', 'V']):
+                parameters[mineral+'.'+W+'.'+name] = (table, W, j)
+    return parameters
+
+def drawthermodata(filename):
+    # reads the uncertainties of thermodynamic parameters in filename, and returns copies of the tables of
+    # thermodynamic data (DATASET, VOLUMEDATA, GARMARGULES...) in which each of those parameters is an array of
+    # random draws. One line per parameter, or a correlation between two parameters with normal distributions:
+    #   ALM.H 1500              normal distribution with a standard deviation of 1500 (also: ALM.H normal 1500)
+    #   GAR.W112.S uniform 2    uniform distribution from 2 below to 2 above the value in this code
+    #   correlation ALM.H ALM.S 0.9
+    # and optionally the number of draws (draws n, default 1000) and the random seed (seed s, default 0)
+    parameters, ndraws, seed = thermoparameters(), 1000, 0
+    normal, uniform, correlations = dict(), dict(), []
+    with open(filename) as thermodata:
+        for line in thermodata:
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+            if len(words) == 2 and words[0].lower() == 'draws':
+                ndraws = int(words[1])
+            elif len(words) == 2 and words[0].lower() == 'seed':
+                seed = int(words[1])
+            elif len(words) == 4 and words[0].lower() == 'correlation':
+                correlations.append((words[1].upper(), words[2].upper(), float(words[3])))
+            elif len(words) == 3 and words[0].upper() in parameters and words[1].lower() == 'uniform':
+                uniform[words[0].upper()] = float(words[2])
+            elif words[0].upper() in parameters and ((len(words) == 2 and words[1].lower() not in ['normal', 'uniform']) or (len(words) == 3 and words[1].lower() == 'normal')):
+                normal[words[0].upper()] = float(words[-1])
+            else: # (also a line with too few or too many words, e.g. a parameter without its uncertainty)
+                print('line of '+filename+' not understood and not used: '+line.strip())
+    # correlated normal draws: the standard deviations scaled by the Cholesky factor of the correlation matrix
+    names = list(normal)
+    correlation = npzeros((len(names), len(names)))
+    for i in range(len(names)):
+        correlation[i, i] = 1
+    for a, b, rho in correlations:
+        if a not in normal or b not in normal:
+            print('correlation not used, because '+a+' and '+b+' do not both have normal distributions')
+        elif a == b or not -1 < rho < 1:
+            print('correlation '+a+' '+b+' '+str(rho)+' not used, because a correlation of two parameters must be between -1 and 1')
+        else: # each correlation must be consistent with those before it (the matrix must be positive definite)
+            i, j = names.index(a), names.index(b)
+            previous = correlation[i, j]
+            correlation[i, j] = correlation[j, i] = rho
+            try:
+                cholesky(correlation)
+            except LinAlgError:
+                correlation[i, j] = correlation[j, i] = previous
+                print('correlation '+a+' '+b+' '+str(rho)+' not used, because it is inconsistent with the correlations before it in '+filename+ \
+                      ' (together they are not a possible correlation matrix)')
+    rng = default_rng(seed)
+    drawn = rng.standard_normal((ndraws, len(names))) @ cholesky(correlation).T if names else npzeros((ndraws, 0))
+    tables = {'DATASET': [list(row) for row in DATASET], 'VOLUMEDATA': [list(row) for row in VOLUMEDATA]}
+    tables.update({table: {W: list(value) for W, value in globals()[table].items()} for table in ['GARMARGULES', 'OPXMARGULES', 'PLMARGULES']})
+    for k, name in enumerate(names):
+        table, row, column = parameters[name]
+        tables[table][row][column] = tables[table][row][column] + drawn[:, k] * normal[name]
+    for name in uniform:
+        table, row, column = parameters[name]
+        tables[table][row][column] = tables[table][row][column] + rng.uniform(-uniform[name], uniform[name], ndraws)
+    print(str(len(normal) + len(uniform))+' thermodynamic parameters read from '+filename+'; the uncertainty of T and P will be calculated from '+str(ndraws)+' random draws of them\n')
+    return tables
+
+def mapband(rows):
+    # calculates Fe-Al T final and P final for the garnet pixels in a band of rows (start, stop) of the maps
+    # (runmode 8). Each garnet pixel is paired with the nearest opx pixel within mapradius pixels, and all the
+    # pairs in the band are calculated at once; pixels that are not garnet, or have no opx pixel near them, are NaN.
+    # Only this band (and mapradius rows either side of it) of the maps is read into memory. Also returns the number
+    # of pixels of the band whose T and P did not converge (see notconverged()), as it may run in another process
+    start, stop = rows
+    top, bottom = max(0, start - mapradius), min(garmap.shape[0], stop + mapradius)
+    gar = nparray(garmap[start:stop], dtype=float)
+    opx = nparray(opxmap[top:bottom], dtype=float)
+    isgar = npisfinite(gar).all(axis=2) & (gar.sum(axis=2) > 0) # pixels of other minerals are NaN or 0
+    isopx = npisfinite(opx).all(axis=2) & (opx.sum(axis=2) > 0)
+    pairs = npfull(isgar.shape, -1) # the opx pixel paired with each garnet pixel (flat index in the band of opx rows)
+    y, x = nparange(start - top, stop - top)[:, None], nparange(gar.shape[1])[None, :]
+    for dy, dx in mapoffsets: # nearest first
+        oy, ox = y + dy, x + dx
+        inside = (oy >= 0) & (oy < bottom - top) & (ox >= 0) & (ox < gar.shape[1])
+        oy, ox = oy.clip(0, bottom - top - 1), ox.clip(0, gar.shape[1] - 1)
+        found = isgar & (pairs < 0) & inside & isopx[oy, ox]
+        pairs[found] = (oy * gar.shape[1] + ox)[found]
+    Tband, Pband = npfull(isgar.shape, npnan), npfull(isgar.shape, npnan)
+    paired = pairs >= 0
+    before = dict(unconverged)
+    if paired.any():
+        compositions = {'gar': gar[paired], 'opx': opx.reshape(-1, opx.shape[2])[pairs[paired]]}
+        compositions.update({m: nptile(cations(m, mapanalysis[m]), (paired.sum(), 1)) for m in minerals if m not in compositions})
+        setcompositions(compositions)
+        RCLCvectorized()
+        Tband[paired], Pband[paired] = TC, P
+    return start, stop, Tband, Pband, {stage: n - before.get(stage, 0) for stage, n in unconverged.items()}
+
+def saveanalyses():
+    # a copy of the analyses of every mineral (see restoreanalyses()), e.g. to compare the results of the
+    # cluster representatives with those of all the analyses
+    return {m: ({name: globals()[name] for name in MINERALDATA[m]}, dict(extracolumns[m]), weights[m], analysisnumbers[m], sigmas.get(m)) for m in extracolumns}
+
+def restoreanalyses(saved):
+    # restores the analyses saved by saveanalyses()
+    for m in saved:
+        for name in saved[m][0]:
+            globals()[name] = saved[m][0][name]
+        extracolumns[m], weights[m], analysisnumbers[m] = dict(saved[m][1]), saved[m][2], saved[m][3]
+        if saved[m][4] is not None:
+            sigmas[m] = saved[m][4]
+        nanalyses[m] = len(weights[m])
+    {1: ALOPX1, 2: ALOPX2, 3: ALOPX3, 4: ALOPX4}[num]()
+
+def optionalcolumns(filename):
+    # reads the optional columns that follow the 11 cation columns of a mineral input file (e.g. X, Y and
+    # sample), identified by their names in the header line. Returns a dictionary of column name: values
+    names, columns = [], dict()
+    with open(filename) as data:
+        for line in data:
+            line = line.rstrip().split()
+            if not line:
+                continue
+            if rsearch('^[A-z]', line[0]) != None:
+                names = [name.lower() for name in line[11:]]
+                columns = {name: [] for name in names}
+            else:
+                for name, value in zip(names, line[11:]):
+                    try:
+                        columns[name].append(float(value))
+                    except ValueError: # e.g. sample names
+                        columns[name].append(value)
+    return columns
+
+def neighbours(m, g):
+    # the analyses of mineral m that are within maxdistance of garnet analysis g, or the nearestk analyses
+    # closest to it (runmode 7). If both input files have a sample column, only analyses from the same
+    # sample are used. A k-d tree of the analyses of each mineral (and sample) is built the first time it is needed
+    gx, gy = extracolumns['gar']['x'][g], extracolumns['gar']['y'][g]
+    sample = None
+    if 'sample' in extracolumns['gar'] and 'sample' in extracolumns[m]:
+        sample = extracolumns['gar']['sample'][g]
+    if (m, sample) not in spatialindex:
+        indices = nparray([i for i in range(nanalyses[m]) if sample == None or extracolumns[m]['sample'][i] == sample], dtype=int)
+        points = npcolumn_stack([nparray(extracolumns[m]['x'], dtype=float)[indices], nparray(extracolumns[m]['y'], dtype=float)[indices]])
+        if cKDTree != None and len(indices) > 0:
+            points = cKDTree(points)
+        spatialindex[(m, sample)] = (indices, points)
+    indices, points = spatialindex[(m, sample)]
+    if len(indices) == 0:
+        return []
+    if cKDTree != None:
+        if nearestk:
+            found = points.query([gx, gy], k=[n + 1 for n in range(min(nearestk, len(indices)))])[1]
+        else:
+            found = points.query_ball_point([gx, gy], maxdistance)
+    else:
+        distances = nphypot(points[:, 0] - gx, points[:, 1] - gy)
+        if nearestk:
+            found = npargsort(distances, kind='stable')[:nearestk]
+        else:
+            found = (distances <= maxdistance).nonzero()[0]
+    return sorted(int(i) for i in indices[found])
+
+def transectpartners(g):
+    # the opx analyses of a traverse paired with garnet analysis g (runmode 9): those whose distance from the
+    # gar-opx interface is within transectwindow of that of g, or, if transectwindow is None, the one whose
+    # distance is closest to it. If both input files have a sample column (e.g. one sample per traverse),
+    # only opx analyses from the same sample are used
+    distances = abs(nparray(extracolumns['opx']['distance'], dtype=float) - extracolumns['gar']['distance'][g])
+    if 'sample' in extracolumns['gar'] and 'sample' in extracolumns['opx']:
+        distances[nparray(extracolumns['opx']['sample']) != extracolumns['gar']['sample'][g]] = npinf
+    if transectwindow == None:
+        return [int(distances.argmin())] if distances.min() < npinf else []
+    return [int(o) for o in npargsort(distances, kind='stable') if distances[o] <= transectwindow]
+
+def halton(n, base):
+    # the n-th number of the van der Corput sequence in base (one dimension of a Halton sequence)
+    f, x = 1, 0
+    while n > 0:
+        f = f / base
+        x += f * (n % base)
+        n = n // base
+    return x
+
+def samplequantiles():
+    # the 5th, 50th and 95th percentiles of Fe-Al T final and Fe-Al P final of the calculations so far (runmode 5)
+    return weightedpercentiles(TCout[1:], weightout[1:], [5, 50, 95]) + weightedpercentiles(Pout[1:], weightout[1:], [5, 50, 95])
+
+def weightedpercentiles(values, w, percentiles):
+    # percentiles of values in which each value counts w times: the same as numpy's percentile of the values
+    # repeated w times (linear interpolation), without building that array
+    values, w = nparray(values, dtype=float), nparray(w)
+    order = npargsort(values, kind='stable')
+    values, cumulative = values[order], npcumsum(w[order])
+    return [sortedpercentile(values, cumulative, q) for q in percentiles]
+
+def sortedpercentile(values, cumulative, q):
+    # the q-th percentile of sorted values, given the cumulative sum of their weights (see weightedpercentiles)
+    h = (cumulative[-1] - 1) * q / 100 # position in the repeated values
+    lower = values[npsearchsorted(cumulative, floor(h), side='right')]
+    upper = values[npsearchsorted(cumulative, ceil(h), side='right')]
+    return float(lower + (h - floor(h)) * (upper - lower))
+
+def bootstrap():
+    # bootstrap confidence intervals of the median and mean of Fe-Al T final and P final of the calculations in
+    # the output. Each replicate resamples, with replacement, as many analyses of each mineral as there are
+    # (counting merged or clustered analyses once for every analysis they stand for), and counts every
+    # calculation in the output once for every combination of the resampled analyses it stands for. The
+    # calculations are never repeated: a replicate only reweights the results already calculated. This is only
+    # valid when the output holds the combinations of every analysis of each mineral with every analysis of the
+    # others (or a random sample of them: runmodes 2 and 5).
+    # Returns the estimates and the lower and upper limits, in the order median T, mean T, median P, mean P, and the
+    # number of replicates used (the limits are None if no replicate drew the analyses of any calculation)
+    combos = nparray(combosout, dtype=int)
+    T, P = nparray(TCout[1:], dtype=float), nparray(Pout[1:], dtype=float)
+    keep = npisfinite(T) & npisfinite(P)
+    combos, T, P, w0 = combos[keep], T[keep], P[keep], nparray(weightout[1:])[keep]
+    orderT, orderP = npargsort(T, kind='stable'), npargsort(P, kind='stable') # sorted once for all replicates
+    def statistics(w):
+        return [sortedpercentile(T[orderT], npcumsum(w[orderT]), 50), float(npdot(w, T) / w.sum()),
+                sortedpercentile(P[orderP], npcumsum(w[orderP]), 50), float(npdot(w, P) / w.sum())]
+    rng = default_rng(bootstrapseed)
+    replicatestatistics = []
+    for r in range(replicates):
+        w = npones(len(combos), dtype=int)
+        for i, m in enumerate(minerals):
+            draws = rng.multinomial(weights[m].sum(), weights[m] / weights[m].sum())
+            w *= draws[combos[:, i]]
+        if w.sum() > 0: # at least one calculation in the output is made of resampled analyses
+            replicatestatistics.append(statistics(w))
+    if not replicatestatistics:
+        return statistics(w0), None, None, 0
+    limits = nppercentile(nparray(replicatestatistics), [(100 - confidence) / 2, (100 + confidence) / 2], axis=0)
+    return statistics(w0), limits[0], limits[1], len(replicatestatistics)
+
+def readsweep(filename, nominal):
+    # reads the values of some quantities to sweep over (e.g. the modes), from a file in which each line gives either
+    # a range (e.g. gar 10 30 5: five values from 10 to 30) or a distribution (gar normal 20 3, or gar uniform 10 30)
+    # of one quantity, with lines 'draws n' (default 100) and 'seed s' (default 0) for the distributions. Returns a
+    # dictionary of quantity: array of values, with every combination of the ranges, each with every draw of the
+    # distributions. Quantities that are not in the file keep their values in nominal
+    with open(filename) as sweepdata:
+        lines = [line.lower().split() for line in sweepdata if line.strip()]
+    ranges, distributions, draws, seed = dict(), dict(), 100, 0
+    for line in lines:
+        if line[0] == 'draws':
+            draws = int(line[1])
+        elif line[0] == 'seed':
+            seed = int(line[1])
+        elif line[0] in nominal and line[1] in ['normal', 'uniform']:
+            distributions[line[0]] = (line[1], float(line[2]), float(line[3]))
+        elif line[0] in nominal:
+            ranges[line[0]] = nplinspace(float(line[1]), float(line[2]), int(line[3]))
+        else:
+            print('line of '+filename+' not understood, and not used: '+' '.join(line))
+    grid = npcolumn_stack([values.ravel() for values in npmeshgrid(*ranges.values(), indexing='ij')]) if ranges else npzeros((1, 0))
+    rng = default_rng(seed)
+    n = draws if distributions else 1
+    scenarios = {name: npfull(len(grid) * n, nominal[name]) for name in nominal}
+    for j, name in enumerate(ranges):
+        scenarios[name] = grid[:, j].repeat(n)
+    for name, (kind, a, b) in distributions.items():
+        scenarios[name] = nptile((rng.normal(a, b, draws) if kind == 'normal' else rng.uniform(a, b, draws)).clip(0), len(grid))
+    return scenarios
+
+def modesweep(combos):
+    # Fe-Al T final and P final of each of combos (an array of combinations) with each set of modes in
+    # modescenarios, calculated at once. The initial intersections do not depend on the modes and have already
+    # been calculated for every combination in the output, so only the rest of the calculation is run.
+    # Returns three arrays with one row per combination and one column per set of modes: T, P, and (as a
+    # dictionary of mineral: array) the modes used, those of the combination for minerals that are not swept
+    global modesonly
+    n = len(modescenarios['gar'])
+    swept = {m: nptile(modescenarios[m], len(combos)) for m in minmodes}
+    modes = {m: npwhere(npisnan(swept[m]), nominal.repeat(n), swept[m]) for m, nominal in combomodes(combos).items()}
+    modesonly = True
+    try:
+        setanalyses(combos.repeat(n, axis=0))
+        RCLCvectorized(modes)
+    finally:
+        modesonly = False
+    return nparray(TC).reshape(len(combos), n), nparray(P).reshape(len(combos), n), {m: modes[m].reshape(len(combos), n) for m in modes}
+
+def fe3sweep(combos):
+    # Fe-Al T final and P final of each of combos (an array of combinations) with each Fe3/(Fe3+Fe2) of opx and
+    # garnet in fe3scenarios, calculated at once. Total Fe (Fe3 + Fe2) of each analysis is held constant; the
+    # garnet calculation does not use Fe3, so for garnet the Fe2 of the input file is taken as the total Fe.
+    # Returns three arrays with one row per combination and one column per set: T, P, and the Fe3/(Fe3+Fe2)
+    # of opx and garnet actually used (those of the input file where the fraction is not swept)
+    n = len(fe3scenarios['opx'])
+    compositions = {m: nparray([cations(m, i) for i in combos[:, d]]).repeat(n, axis=0) for d, m in enumerate(minerals)}
+    fractions = []
+    for m in ['opx', 'gar']:
+        fe3, fe2 = compositions[m][:, COLUMNS.index('Fe3')], compositions[m][:, COLUMNS.index('Fe2')]
+        total, swept = fe3 + fe2, nptile(fe3scenarios[m], len(combos))
+        fraction = npwhere(npisnan(swept), fe3 / total, swept)
+        compositions[m][:, COLUMNS.index('Fe3')], compositions[m][:, COLUMNS.index('Fe2')] = fraction * total, (1 - fraction) * total
+        fractions.append(fraction.reshape(len(combos), n))
+    setcompositions(compositions)
+    RCLCvectorized({m: modes.repeat(n) for m, modes in combomodes(combos).items()})
+    return nparray(TC).reshape(len(combos), n), nparray(P).reshape(len(combos), n), fractions
+
+def effectivesamplesize(weights):
+    # Kish's effective sample size of a sample of calculations with these weights
+    return sum(weights) ** 2 / sum(w ** 2 for w in weights)
+
+def resultcontext():
+    # everything other than the analyses that the results of a calculation depend on: the modes, the minerals used, the
+    # thermodynamic data, the settings of the iterations and this code itself (see resultkey())
+    settings = [sorted(minmodes.items()), minerals, DATASET, VOLUMEDATA, GARMARGULES, OPXMARGULES, PLMARGULES,
+                [DENSFEGAR, DENSMGGAR, DENSCAGAR, DENSMNGAR, DENSFEOPX, DENSMGOPX, DENSMGCRD, DENSFECRD, DENSFEBT, DENSMGBT],
+                [TTOLERANCE, PTOLERANCE, MAXITERATIONS], [activitycache is not None, cacheTquantum, cachePquantum]]
+    with open(__file__, 'rb') as code:
+        return sha256(repr(settings).encode() + code.read()).digest()
+
+def resultkey(combo):
+    # the key of a combination in the result cache: a hash of the exact cations of its analyses, the opx site
+    # occupancies (which depend on the Al site model) and resultcontext(), so a result is only reused if it would be
+    # calculated again exactly as it was
+    i = combo[minerals.index('opx')]
+    analyses = [cations(m, j).tolist() for m, j in zip(minerals, combo)] + [[float(aXFEOPX[i]), float(aXMGOPX[i]), float(aXAL_M1[i])]]
+    return sha256(contextkey + repr(analyses).encode()).digest()
+
+def solve(combo):
+    # calculates a combination (one analysis index per mineral) and returns its row of results (see outputrow()), or
+    # returns the row saved in the result cache if it was calculated before (see resultcache.txt)
+    setanalyses(combo)
+    if resultcache is None:
+        RCLCfunction()
+        return outputrow()
+    key = resultkey(combo)
+    found = resultcache.execute('SELECT row FROM results WHERE key = ?', (key,)).fetchone()
+    resultcounts['reused' if found else 'calculated'] += 1
+    if found:
+        resultused.append((resultcounts['run'], key))
+        row = jsonloads(found[0])
+    else:
+        RCLCfunction()
+        row = outputrow()
+        resultrows.append((key, jsondumps([float(value) if npndim(value) == 0 and not isinstance(value, int) else value for value in row]), resultcounts['run']))
+    if len(resultrows) + len(resultused) >= RESULTBATCH:
+        saveresults()
+    return row
+
+def saveresults():
+    # writes the results calculated since the last time to the result cache, and marks those reused as used in this
+    # run, in one short transaction, so that other processes sharing the file (see batchRCLC_samples.py) only wait for
+    # it briefly. Until then the results are only held in memory (see RESULTBATCH)
+    if resultrows or resultused:
+        with resultcache: # committed at the end
+            resultcache.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', resultrows)
+            resultcache.executemany('UPDATE results SET used = ? WHERE key = ?', resultused)
+        resultrows.clear()
+        resultused.clear()
+
+def evictresults():
+    # drops the least recently used results from the result cache until the file holds less than resultcachesize MB
+    page = resultcache.execute('PRAGMA page_size').fetchone()[0]
+    used = (resultcache.execute('PRAGMA page_count').fetchone()[0] - resultcache.execute('PRAGMA freelist_count').fetchone()[0]) * page
+    if used > resultcachesize * 1e6:
+        n = resultcache.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        excess = ceil(n * (1 - (0.9 * resultcachesize * 1e6 / used)))
+        with resultcache:
+            resultcache.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)', (excess,))
+        print(str(excess)+' least recently used results dropped from the result cache')
+        try: # the file only shrinks when no other process is using it; otherwise its free pages are reused
+            resultcache.execute('VACUUM')
+        except sqlite3OperationalError:
+            pass
+
+def savetopk(combo, row):
+    # saves a row of results of combo (see outputrow()) if it is among the k best found so far
+    # (runmodes 3 and 4) and returns its score. Ties go to the combination that comes first in runmode 2.
+    n = int(npravel_multi_index(tuple(combo), [nanalyses[m] for m in minerals]))
+    entry = (criterion(row), -n, tuple(combo), row)
+    if len(topk) < k:
+        heappush(topk, entry)
+    else:
+        heappushpop(topk, entry)
+    return entry[0]
+
+def beatstopk(score):
+    # True if a result with this score could still be one of the k best (runmodes 3 and 4)
+    return len(topk) < k or score >= topk[0][0]
+
+def ANactivityrange(i, TKrange, Prange):
+    # the lowest and highest anorthite activity of plagioclase analysis i at any T (K) and P (kbar) within TKrange and
+    # Prange. ln AAN is a sum of Margules terms (WH - T*WS + P*WV) / RT, which is linear in 1/T and in P/T, so its
+    # extremes within the ranges are at their corners (used by runmode 4)
+    global XAN, XAB, XSAN, TK, P
+    XAN, XAB, XSAN = aCAPL[i]/(aCAPL[i]+aNAPL[i]+aKPL[i]), aNAPL[i]/(aNAPL[i]+aCAPL[i]+aKPL[i]), aKPL[i]/(aNAPL[i]+aCAPL[i]+aKPL[i])
+    activities = []
+    for TK, P in product(TKrange, Prange):
+        PLAGIOCLASE()
+        activities.append(AAN)
+    return min(activities), max(activities)
+
+def plbounds(branch, pls, TKrange, Prange):
+    # T final (C) and P final (kbar), as the start of a row of results (see outputrow()), of a branch (runmode 4: one
+    # choice of every analysis but plagioclase) calculated with the lowest and with the highest anorthite activity that
+    # any of the plagioclase analyses pls has within TKrange (K) and Prange (kbar), held constant. Plagioclase only
+    # enters the calculation through AAN (in the GRT-OPX-PL-QTZ barometer), and T final and P final change monotonically
+    # with it, so if those of the branch with each of pls lie within the ranges, they lie between those of the two rows
+    global boundAAN, modesonly
+    lows, highs = zip(*[ANactivityrange(pl, TKrange, Prange) for pl in pls])
+    rows = []
+    modesonly = True # (the initial intersections are not needed)
+    try:
+        for boundAAN in [min(lows), max(highs)]:
+            setanalyses(branch[:ipl] + (pls[0],) + branch[ipl:])
+            RCLCfunction()
+            rows.append([TC, P]) # (the rest of the row is not calculated)
+    finally:
+        boundAAN, modesonly = None, False
+    return rows
+
+def TPrange(rows, margins):
+    # the ranges of T final (K) and of P final (kbar) of rows of results (see outputrow()), each widened by its margin
+    # (runmode 4). None if any of them is NaN
+    if npany(npisnan([row[:2] for row in rows])):
+        return None
+    TKs, Ps = [row[0] + 273 for row in rows], [row[1] for row in rows]
+    return [(min(TKs) - margins[0], max(TKs) + margins[0]), (min(Ps) - margins[1], max(Ps) + margins[1])]
 
 ########################################################
 ######## END DEFINING FUNCTIONS FOR THE PROGRAM ########
@@ -356,6 +1576,129 @@ def outputfunc():
 ############### DEFINE THE MAIN PROGRAM ################
 ########################################################
 
+def INTERSECTIONS(usecrd, usebt): # the initial intersections, before the Fe-Mg ratios are corrected
+    global TGAROPXI, PGAROPXI, TGARBTI, PGARBTI, TGARCRDI, PGARCRDI
+    global TGAROPX, TGARBT, TGARCRD
+    global PBARS, TK, P
+    anycrd, anybt = bool(npany(usecrd)), bool(npany(usebt)) # usecrd and usebt can be arrays (see present())
+
+    #  CALCULATE GRT-OPX FE-MG  -  GRT-OPX-PL-QTZ (FE-END MEMBER)INTERSECTION
+    TK, P, PBARS = 1123.85, 6, 6000 #INITIAL GUESSES 850 C and 6 kbar
+    CP(True, False, False) #CALCULATE H AND S AT STARTING GUESSES
+    for J in range(MAXITERATIONS): # SHOULD CONVERGE IN < 10 ITERATIONS
+        TKOLD, POLD = TK, P
+        # CALCULATE GRT-OPX-PL-QTZ (FE-END MEMBER) PRESSURE
+            # the following comment was left in by Widney, although the problem seems to have been fixed, whatever it was
+            # FIXME: Causing an error on numbers,
+        ACTIVITIES(GARNET)
+        ACTIVITIES(PLAGIOCLASE)
+        ACTIVITIES(ORTHOPYROXENE)
+        VOLUMEPT(True, False, False)
+        DELTAHGAPES = (((3 * HAN) + (6 * HFS)) - ((3 * HBQ) + (2 * HALM) + HGR)) / 1000
+        DELTASGAPES = (((3 * SAN) + (6 * SFS)) - ((3 * SBQ) + (2 * SALM) + SGR)) / 1000
+        DELTAVGAPES = ((3 * VAN) + (6 * VFS)) - ((3 * VBQ) + (2 * VALM) + VGR)
+        KGAPES = ((AAN ** 3) * (AFS ** 6)) / (AGR * (AAL ** 2))
+        P = ((TK * DELTASGAPES) - DELTAHGAPES - (.008314 * TK * (log(KGAPES)))) / DELTAVGAPES
+        PBARS = P * 1000
+        # CALCULATE GRT-OPX FE-MG EXCHANGE TEMP AT THIS PRESSURE
+        DELTAHFEMGOPX = (((1 * HEN) + ((1 / 3) * HALM)) - ((1 * HFS) + ((1 / 3) * HPY))) / 1000
+        DELTASFEMGOPX = (((1 * SEN) + ((1 / 3) * SALM)) - ((1 * SFS) + ((1 / 3) * SPY))) / 1000
+        DELTAVFEMGOPX = ((1 * VEN) + ((1 / 3) * VALM)) - ((1 * VFS) + ((1 / 3) * VPY))
+        GAMMAFEMGOPX = GAMMAGAR * GAMMAOPX
+        KDGAROPX = (XFEGAR * XMGOPX) / (XMGGAR * XFEOPX)
+        TGAROPX = (DELTAHFEMGOPX + (P * DELTAVFEMGOPX)) / (DELTASFEMGOPX - (.008314 * log(KDGAROPX)) - (.008314 * log(GAMMAFEMGOPX)))
+        TK = TGAROPX
+        TCGAROPX = TGAROPX - 273
+        CP(True, False, False) # UPDATE H AND S AND REITERATE
+        if TPconverged(TKOLD, POLD):
+            break
+    else:
+        notconverged('initial gar-opx intersection', TKOLD, POLD)
+    TGAROPXI = TCGAROPX
+    PGAROPXI = P
+
+    #  CALCULATE GRT-CRD FE-MG  -  GRT-OPX-PL-QTZ (FE END MEMBER) INTERSECTION IF CORDIERITE IS BEING CONSIDERED
+    if anycrd:
+        TK, P, PBARS = 1123.85, 6, 6000 #INITIAL GUESSES 850 C and 6 kbar
+        CP(True, True, False) #CALCULATE H AND S AT STARTING GUESSES
+        for J in range(MAXITERATIONS): # SHOULD CONVERGE IN < 10 ITERATIONS
+            TKOLD, POLD = TK, P
+            # CALCULATE GRT-OPX-PL-QTZ (FE-END MEMBER) PRESSURE
+            ACTIVITIES(GARNET)
+            ACTIVITIES(PLAGIOCLASE)
+            ACTIVITIES(ORTHOPYROXENE)
+            VOLUMEPT(True, True, False)
+            DELTAHGAPES = (((3 * HAN) + (6 * HFS)) - ((3 * HBQ) + (2 * HALM) + HGR)) / 1000
+            DELTASGAPES = (((3 * SAN) + (6 * SFS)) - ((3 * SBQ) + (2 * SALM) + SGR)) / 1000
+            DELTAVGAPES = ((3 * VAN) + (6 * VFS)) - ((3 * VBQ) + (2 * VALM) + VGR)
+            KGAPES = ((AAN ** 3) * (AFS ** 6)) / (AGR * (AAL ** 2))
+            P = ((TK * DELTASGAPES) - DELTAHGAPES - (.008314 * TK * (log(KGAPES)))) / DELTAVGAPES
+            PBARS = P * 1000
+            # CALCULATE GRT-CRD FE-MG EXCHANGE TEMP AT THIS PRESSURE
+            CORDIERITE()
+            DELTAHFEMGCRD = (((.5 * HCRD) + ((1 / 3) * HALM)) - ((.5 * HFECRD) + ((1 / 3) * HPY))) / 1000
+            DELTASFEMGCRD = (((.5 * SCRD) + ((1 / 3) * SALM)) - ((.5 * SFECRD) + ((1 / 3) * SPY))) / 1000
+            DELTAVFEMGCRD = ((.5 * VCRD) + ((1 / 3) * VALM)) - ((.5 * VFECRD) + ((1 / 3) * VPY))
+            GAMMAFEMGCRD = GAMMAGAR * GAMMACRD
+            KDGARCRD = (XFEGAR * XMGCRD) / (XMGGAR * XFECRD)
+            TKGARCRD = (DELTAHFEMGCRD + (P * DELTAVFEMGCRD)) / (DELTASFEMGCRD - (.008314 * log(KDGARCRD)) - (.008314 * log(GAMMAFEMGCRD)))
+            TK = TKGARCRD
+            TGARCRD = TKGARCRD - 273
+            CP(True, True, False) # UPDATE H AND S AND REITERATE
+            if TPconverged(TKOLD, POLD):
+                break
+        else:
+            notconverged('initial gar-crd intersection', TKOLD, POLD)
+        TGARCRD = masked(usecrd, TGARCRD, 0)
+        TGARCRDI = TGARCRD
+        PGARCRDI = masked(usecrd, P, 0)
+    else:
+        TGARCRD = 0
+        TGARCRDI = 0
+        PGARCRD = 0
+        PGARCRDI = 0
+
+    #  CALCULATE GRT-BT FE-MG  -  GRT-OPX-PL-QTZ (FE END MEMBER) INTERSECTION IF BIOTITE IS BEING CONSIDERED
+    if anybt:
+        TK, P, PBARS = 1123.85, 6, 6000 #INITIAL GUESSES 850 C and 6 kbar
+        CP(True, False, True) #CALCULATE H AND S AT STARTING GUESSES
+        for J in range (MAXITERATIONS): #SHOULD CONVERGE IN LESS THAN 10 ITERATIONS
+            TKOLD, POLD = TK, P
+            # CALCULATE GRT-OPX-PL-QTZ (FE-END MEMBER) PRESSURE
+            ACTIVITIES(GARNET)
+            ACTIVITIES(PLAGIOCLASE)
+            ACTIVITIES(ORTHOPYROXENE)
+            VOLUMEPT(True, False, True)
+            DELTAHGAPES = (((3 * HAN) + (6 * HFS)) - ((3 * HBQ) + (2 * HALM) + HGR)) / 1000
+            DELTASGAPES = (((3 * SAN) + (6 * SFS)) - ((3 * SBQ) + (2 * SALM) + SGR)) / 1000
+            DELTAVGAPES = ((3 * VAN) + (6 * VFS)) - ((3 * VBQ) + (2 * VALM) + VGR)
+            KGAPES = ((AAN ** 3) * (AFS ** 6)) / (AGR * (AAL ** 2))
+            P = ((TK * DELTASGAPES) - DELTAHGAPES - (.008314 * TK * (log(KGAPES)))) / DELTAVGAPES
+            PBARS = P * 1000
+            # CALCULATE GRT-BT FE-MG EXCHANGE TEMP AT THIS PRESSURE
+            BIOTITE()
+            DELTAHFEMGBT = ((((1 / 3) * HPHL) + ((1 / 3) * HALM)) - (((1 / 3) * HANN) + ((1 / 3) * HPY))) / 1000
+            DELTASFEMGBT = ((((1 / 3) * SPHL) + ((1 / 3) * SALM)) - (((1 / 3) * SANN) + ((1 / 3) * SPY))) / 1000
+            DELTAVFEMGBT = (((1 / 3) * VPHL) + ((1 / 3) * VALM)) - (((1 / 3) * VANN) + ((1 / 3) * VPY))
+            GAMMAGARBT = GAMMABT * GAMMAGAR
+            KDGARBT = (XFEGAR * XMGBT) / (XMGGAR * XFEBT)
+            TKGARBT = (DELTAHFEMGBT + (P * DELTAVFEMGBT)) / (DELTASFEMGBT - (.008314 * log(KDGARBT)) - (.008314 * log(GAMMAGARBT)))
+            TK = TKGARBT
+            TGARBT = TKGARBT - 273
+            CP(True, False, True) # UPDATE H AND S AND REITERATE
+            if TPconverged(TKOLD, POLD):
+                break
+        else:
+            notconverged('initial gar-bt intersection', TKOLD, POLD)
+        TGARBT = masked(usebt, TGARBT, 0)
+        TGARBTI = TGARBT
+        PGARBTI = masked(usebt, P, 0)
+    else:
+        TGARBT = 0
+        TGARBTI = 0
+        PGARBT = 0
+        PGARBTI = 0
+
 def RCLCfunction():
     #SOME OF THESE MIGHT NOT BE USED. VESTIGES OF WIDNEY'S CODE THAT WAS MODIFIED TO MAKE THIS
     global XMNGAR, XFEGAR, XCAGAR, XMGGAR, XFEGARI, MGRATIOGA, MGRATIOGARI, MODXCAGAR
@@ -370,14 +1713,18 @@ def RCLCfunction():
     global SALM, SPY, SGR, SAN, SBQ, SEN, SFS, SALOPX, SPHL, SANN, SCRD, SFECRD
     global VALM, VPY, VGR, VAN, VBQ, VEN, VFS, VALOPX, VPHL, VANN, VCRD, VFECRD
     global AGR, APY, AAL, GAMMAGAR
-    global MGRATIOCRD
+    global MGRATIOCRD, XFECRD, XMGCRD
     global TK, XFEBT, XALBT, XTIBT, XMGBT
     global TFEALI, PFEALI, TGAROPXI, PGAROPXI, TGARBTI, PGARBTI, TGARCRDI, PGARCRDI
-    global TC, P, TGAROPX, TGARBT, TGARCRD
+    global TC, P, TGAROPX, TGARBT, TGARCRD, MASSBALANCE
     global FERATIOOPX
     global AAN, XAB, XSAN, XAN
     global PBARS, TK, P
 
+    # whether cordierite and biotite are included in the calculation (or in each calculation, see present())
+    usecrd, usebt = present('crd'), present('bt')
+    anycrd, anybt = bool(npany(usecrd)), bool(npany(usebt))
+
     # ORTHOPYROXENE mole graction calculations
     XFEOPXI = XFEOPX
     MGRATIOOPX = MGOPX / (MGOPX + FE2OPX)
@@ -396,7 +1743,7 @@ def RCLCfunction():
     MODXCAGAR = (CAGAR + MNGAR) / (CAGAR + MNGAR + FEGAR + MGGAR)
 
     # BIOTITE MOLE FRACTION CALCULATIONS
-    if  (minmodes['bt'] < 0.01) or skip_bt:
+    if  not anybt:
             XFEBT, XMGBT, XTIBT, XALBT, MGRATIOBT = 0,0,0,0,0
     else:
             ALIVBT = 4.0 - SIBT
@@ -406,16 +1753,18 @@ def RCLCfunction():
             XALBT = ALVIBT/ (FEBT+MGBT+ALVIBT+TIBT+MNBT)
             XTIBT = TIBT/  (FEBT+MGBT+ALVIBT+TIBT+MNBT)
             MGRATIOBT = MGBT / (MGBT + FEBT)
+            XFEBT, XMGBT, XTIBT, XALBT, MGRATIOBT = [masked(usebt, X, 0) for X in [XFEBT, XMGBT, XTIBT, XALBT, MGRATIOBT]]
     XFEBTI, MGRATIOBTI = XFEBT, MGRATIOBT
 
     # CORDIERITE MOLE FRACTION CALCULATIONS
-    if  (minmodes['crd'] < 0.01) or skip_crd:
+    if  not anycrd:
             XFECRD, XMGCRD, XMNCRD, MGRATIOCRD = 0,0,0,0
     else:
             XFECRD = FECRD / (FECRD + MGCRD + MNCRD)
             XMGCRD = MGCRD / (FECRD + MGCRD + MNCRD)
             XMNCRD = MNCRD / (FECRD + MGCRD + MNCRD)
             MGRATIOCRD = MGCRD / (MGCRD + FECRD)
+            XFECRD, XMGCRD, XMNCRD, MGRATIOCRD = [masked(usecrd, X, 0) for X in [XFECRD, XMGCRD, XMNCRD, MGRATIOCRD]]
     XFECRDI, MGRATIOCRDI = XFECRD, MGRATIOCRD
 
     # PLAGIOCLASE MOLE FRACTIONS
@@ -436,30 +1785,30 @@ def RCLCfunction():
     #  MOLECULAR WEIGHTS
     MWOPX = (SIOPX * 28.1) + (TIOPX*47.9) + (ALOPX * 26.1) + (CROPX*(52)) + (FE3OPX*55.8) + (FE2OPX * 55.8) + (MGOPX * 24.3) + (MNOPX * 54.9) + (CAOPX * 40.1) + (6 * 16)
     MWGAR = (3.00  * 28.1) + (2.00  * 26.1) + (FEGAR * 55.8) + (MGGAR * 24.3) + (MNGAR * 54.9) + (CAGAR * 40.1) + (12 * 16)
-    if (minmodes['crd'] > 0.01) and not skip_crd:
+    if anycrd:
         MWCRD = (5.00  * 28.1) + (4.00  * 26.1) + (FECRD * 55.8) + (MGCRD * 24.3) + (MNCRD * 54.9) + (18 * 16)
-    if (minmodes['bt']>0.01) and not skip_bt:
+    if anybt:
         MWBT =  (SIBT * 28.1)  + (TIBT * 47.9)  + (ALBT * 26.1)  + (FEBT * 55.8)  + (MNBT * 54.9)  + (MGBT * 24.3)  + (NABT * 23) + (KBT * 39.1) + (11 * 16) + 2
     #   MOLES OF MINERALS
     MOLEGAR = (VFGAR * DENSGAR) / MWGAR
     MOLEOPX = (VFOPX * DENSOPX) / MWOPX
-    if (minmodes['crd'] < 0.01) or skip_crd:
+    if not anycrd:
         MOLECRD = 0
     else:
-        MOLECRD = (VFCRD * DENSCRD) / MWCRD
-    if (minmodes['bt'] < 0.01) or skip_bt:
+        MOLECRD = masked(usecrd, (VFCRD * DENSCRD) / MWCRD, 0)
+    if not anybt:
         MOLEBT = 0
     else:
-        MOLEBT = (VFBT * DENSBT) / MWBT
+        MOLEBT = masked(usebt, (VFBT * DENSBT) / MWBT, 0)
     # MOLES OF FE-MG COMPONENTS OF MINERALS
     MOLEFEMGGAR = MOLEGAR * (FEGAR + MGGAR)
     MOLEFEMGOPX = MOLEOPX * (FE2OPX + MGOPX)
-    if (minmodes['crd'] > 0.01) and not skip_crd:
-        MOLEFEMGCRD = MOLECRD * (FECRD + MGCRD)
+    if anycrd:
+        MOLEFEMGCRD = masked(usecrd, MOLECRD * (FECRD + MGCRD), 0)
     else:
         MOLEFEMGCRD = 0
-    if (minmodes['bt'] > 0.01) and not skip_bt:
-        MOLEFEMGBT =  MOLEBT  * (FEBT  + MGBT )
+    if anybt:
+        MOLEFEMGBT =  masked(usebt, MOLEBT  * (FEBT  + MGBT ), 0)
     else:
         MOLEFEMGBT = 0
     # MOLE FRACTION OF FE-MG COMPONENTS OF MINERALS
@@ -467,127 +1816,33 @@ def RCLCfunction():
     MFOPX = MOLEFEMGOPX / (MOLEFEMGGAR + MOLEFEMGOPX + MOLEFEMGCRD + MOLEFEMGBT)
     MFCRD = MOLEFEMGCRD / (MOLEFEMGGAR + MOLEFEMGOPX + MOLEFEMGCRD + MOLEFEMGBT)
     MFBT =  MOLEFEMGBT  / (MOLEFEMGGAR + MOLEFEMGOPX + MOLEFEMGCRD + MOLEFEMGBT)
-    #  CALCULATE XMG ROCK (THIS APPEARS TO HAVE BEEN USED AS A TEST IN WIDNEY'S ORIGINAL CODE. NOT NEEDED ANYMORE BUT HAVEN'T DELETED YET WHILE I CHECK THE REST OF THE CODE)
+    #  CALCULATE XMG ROCK (THE MG-RATIO OF THE FE-MG MINERALS TOGETHER, WHICH THE CORRECTED MG-RATIOS MUST KEEP)
     XMGROCK = (MGRATIOGAR * MFGAR) + (MGRATIOOPX * MFOPX) + (MGRATIOCRD * MFCRD) + (MGRATIOBT * MFBT)
 
-    #  CALCULATE GRT-OPX FE-MG  -  GRT-OPX-PL-QTZ (FE-END MEMBER)INTERSECTION
-    TK, P, PBARS = 1123.85, 6, 6000 #INITIAL GUESSES 850 C and 6 kbar
-    CP() #CALCULATE H AND S AT STARTING GUESSES
-    for J in range(10): # SHOULD CONVERGE IN < 10 ITERATIONS
-        # CALCULATE GRT-OPX-PL-QTZ (FE-END MEMBER) PRESSURE
-            # the following comment was left in by Widney, although the problem seems to have been fixed, whatever it was
-            # FIXME: Causing an error on numbers,
-        GARNET()
-        PLAGIOCLASE()
-        ORTHOPYROXENE()
-        VOLUMEPT()
-        DELTAHGAPES = (((3 * HAN) + (6 * HFS)) - ((3 * HBQ) + (2 * HALM) + HGR)) / 1000
-        DELTASGAPES = (((3 * SAN) + (6 * SFS)) - ((3 * SBQ) + (2 * SALM) + SGR)) / 1000
-        DELTAVGAPES = ((3 * VAN) + (6 * VFS)) - ((3 * VBQ) + (2 * VALM) + VGR)
-        KGAPES = ((AAN ** 3) * (AFS ** 6)) / (AGR * (AAL ** 2))
-        P = ((TK * DELTASGAPES) - DELTAHGAPES - (.008314 * TK * (log(KGAPES)))) / DELTAVGAPES
-        PBARS = P * 1000
-        # CALCULATE GRT-OPX FE-MG EXCHANGE TEMP AT THIS PRESSURE
-        DELTAHFEMGOPX = (((1 * HEN) + ((1 / 3) * HALM)) - ((1 * HFS) + ((1 / 3) * HPY))) / 1000
-        DELTASFEMGOPX = (((1 * SEN) + ((1 / 3) * SALM)) - ((1 * SFS) + ((1 / 3) * SPY))) / 1000
-        DELTAVFEMGOPX = ((1 * VEN) + ((1 / 3) * VALM)) - ((1 * VFS) + ((1 / 3) * VPY))
-        GAMMAFEMGOPX = GAMMAGAR * GAMMAOPX
-        KDGAROPX = (XFEGAR * XMGOPX) / (XMGGAR * XFEOPX)
-        TGAROPX = (DELTAHFEMGOPX + (P * DELTAVFEMGOPX)) / (DELTASFEMGOPX - (.008314 * log(KDGAROPX)) - (.008314 * log(GAMMAFEMGOPX)))
-        TK = TGAROPX
-        TCGAROPX = TGAROPX - 273
-        CP() # UPDATE H AND S AND REITERATE
-    TGAROPXI = TCGAROPX
-    PGAROPXI = P
-
-    #  CALCULATE GRT-CRD FE-MG  -  GRT-OPX-PL-QTZ (FE END MEMBER) INTERSECTION IF CORDIERITE IS BEING CONSIDERED
-    if (minmodes['crd'] > 0.01) and not skip_crd:
-        TK, P, PBARS = 1123.85, 6, 6000 #INITIAL GUESSES 850 C and 6 kbar
-        CP() #CALCULATE H AND S AT STARTING GUESSES
-        for J in range(10): # SHOULD CONVERGE IN < 10 ITERATIONS
-            # CALCULATE GRT-OPX-PL-QTZ (FE-END MEMBER) PRESSURE
-            GARNET()
-            PLAGIOCLASE()
-            ORTHOPYROXENE()
-            VOLUMEPT()
-            DELTAHGAPES = (((3 * HAN) + (6 * HFS)) - ((3 * HBQ) + (2 * HALM) + HGR)) / 1000
-            DELTASGAPES = (((3 * SAN) + (6 * SFS)) - ((3 * SBQ) + (2 * SALM) + SGR)) / 1000
-            DELTAVGAPES = ((3 * VAN) + (6 * VFS)) - ((3 * VBQ) + (2 * VALM) + VGR)
-            KGAPES = ((AAN ** 3) * (AFS ** 6)) / (AGR * (AAL ** 2))
-            P = ((TK * DELTASGAPES) - DELTAHGAPES - (.008314 * TK * (log(KGAPES)))) / DELTAVGAPES
-            PBARS = P * 1000
-            # CALCULATE GRT-CRD FE-MG EXCHANGE TEMP AT THIS PRESSURE
-            CORDIERITE()
-            DELTAHFEMGCRD = (((.5 * HCRD) + ((1 / 3) * HALM)) - ((.5 * HFECRD) + ((1 / 3) * HPY))) / 1000
-            DELTASFEMGCRD = (((.5 * SCRD) + ((1 / 3) * SALM)) - ((.5 * SFECRD) + ((1 / 3) * SPY))) / 1000
-            DELTAVFEMGCRD = ((.5 * VCRD) + ((1 / 3) * VALM)) - ((.5 * VFECRD) + ((1 / 3) * VPY))
-            GAMMAFEMGCRD = GAMMAGAR * GAMMACRD
-            KDGARCRD = (XFEGAR * XMGCRD) / (XMGGAR * XFECRD)
-            TKGARCRD = (DELTAHFEMGCRD + (P * DELTAVFEMGCRD)) / (DELTASFEMGCRD - (.008314 * log(KDGARCRD)) - (.008314 * log(GAMMAFEMGCRD)))
-            TK = TKGARCRD
-            TGARCRD = TKGARCRD - 273
-            CP() # UPDATE H AND S AND REITERATE
-        TGARCRDI = TGARCRD
-        PGARCRDI = P
-    else:
-        TGARCRD = 0
-        TGARCRDI = 0
-        PGARCRD = 0
-        PGARCRDI = 0
-
-    #  CALCULATE GRT-BT FE-MG  -  GRT-OPX-PL-QTZ (FE END MEMBER) INTERSECTION IF BIOTITE IS BEING CONSIDERED
-    if (minmodes['bt'] > 0.01) and not skip_bt:
-        TK, P, PBARS = 1123.85, 600, 6000 #INITIAL GUESSES 850 C and 6 kbar
-        CP() #CALCULATE H AND S AT STARTING GUESSES
-        for J in range (10): #SHOULD CONVERGE IN LESS THAN 10 ITERATIONS
-            # CALCULATE GRT-OPX-PL-QTZ (FE-END MEMBER) PRESSURE
-            GARNET()
-            PLAGIOCLASE()
-            ORTHOPYROXENE()
-            VOLUMEPT()
-            DELTAHGAPES = (((3 * HAN) + (6 * HFS)) - ((3 * HBQ) + (2 * HALM) + HGR)) / 1000
-            DELTASGAPES = (((3 * SAN) + (6 * SFS)) - ((3 * SBQ) + (2 * SALM) + SGR)) / 1000
-            DELTAVGAPES = ((3 * VAN) + (6 * VFS)) - ((3 * VBQ) + (2 * VALM) + VGR)
-            KGAPES = ((AAN ** 3) * (AFS ** 6)) / (AGR * (AAL ** 2))
-            P = ((TK * DELTASGAPES) - DELTAHGAPES - (.008314 * TK * (log(KGAPES)))) / DELTAVGAPES
-            PBARS = P * 1000
-            # CALCULATE GRT-BT FE-MG EXCHANGE TEMP AT THIS PRESSURE
-            BIOTITE()
-            DELTAHFEMGBT = ((((1 / 3) * HPHL) + ((1 / 3) * HALM)) - (((1 / 3) * HANN) + ((1 / 3) * HPY))) / 1000
-            DELTASFEMGBT = ((((1 / 3) * SPHL) + ((1 / 3) * SALM)) - (((1 / 3) * SANN) + ((1 / 3) * SPY))) / 1000
-            DELTAVFEMGBT = (((1 / 3) * VPHL) + ((1 / 3) * VALM)) - (((1 / 3) * VANN) + ((1 / 3) * VPY))
-            GAMMAGARBT = GAMMABT * GAMMAGAR
-            KDGARBT = (XFEGAR * XMGBT) / (XMGGAR * XFEBT)
-            TKGARBT = (DELTAHFEMGBT + (P * DELTAVFEMGBT)) / (DELTASFEMGBT - (.008314 * log(KDGARBT)) - (.008314 * log(GAMMAGARBT)))
-            TK = TKGARBT
-            TGARBT = TKGARBT - 273
-            CP() # UPDATE H AND S AND REITERATE
-        TGARBTI = TGARBT
-        PGARBTI = P
-    else:
-        TGARBT = 0
-        TGARBTI = 0
-        PGARBT = 0
-        PGARBTI = 0
+    # INITIAL INTERSECTIONS, WHICH DO NOT DEPEND ON THE MODES (NOT RECALCULATED WHEN ONLY THE MODES HAVE CHANGED, SEE modesweep())
+    if not modesonly:
+        INTERSECTIONS(usecrd, usebt)
 
     # CALCULATE CONVERGED INTERSECTION OF GRT-OPX AL-SOLUBILITY AND GRT-OPX-PL-QTZ USING
     # FE-END MEMBER EXPRESSIONS.
     # CONVERGENCE APPROACH - 1. CALCULATE INITIAL INTERSECTION OF GRT-OPX AL-SOLUB AND GRT-OPX-PL-QTZ.
     # 2. CHANGE KD GRT-OPX (AND if  APPLICABLE KD GRT-CRD AND KD GRT-BT) SO COINCIDES WITH 1.
     # 3. ADJUST FE/MG RATIOS OF FE-MG MINERALS TO SATISFY KD'S.
-    # 4. REPEAT 10 TIMES (I = 1 TO 10) TO GET CONVERGENCE.
-    # ASSUME INITIAL TEMP TO BEGIN
-    TK, P, PBARS = 1123.85, 600, 6000 #INITIAL GUESSES 850 C and 6 kbar
-
-    for I in range(10): #should converge in <10 iterations
-        CP() # calculate H and S for starting PT guesses
-        # CALCULATE INTERSECTION OF FE-AL-OPX AND GRT-OPX-PL-QTZ IN 10 ITERATIONS (J = 1 TO 10)
-        for J in range (10): #should converge in < 10 iterations
+    # 4. REPEAT UNTIL T AND P CHANGE BY LESS THAN TTOLERANCE AND PTOLERANCE (SEE TPconverged()).
+    # ASSUME INITIAL TEMP TO BEGIN.
+    TK, P, PBARS = 1123.85, 6, 6000 #INITIAL GUESSES 850 C and 6 kbar
+
+    for I in range(MAXITERATIONS): #should converge in <20 iterations
+        TKI, PI = TK, P
+        CP(True, False, False) # calculate H and S for starting PT guesses
+        # CALCULATE INTERSECTION OF FE-AL-OPX AND GRT-OPX-PL-QTZ, ITERATING UNTIL T AND P CONVERGE
+        for J in range (MAXITERATIONS): #should converge in < 10 iterations
+            TKOLD, POLD = TK, P
             # CALCULATE GRT-OPX-PL-QTZ (FE-END MEMBER) PRESSURE
-            GARNET()
-            PLAGIOCLASE()
-            ORTHOPYROXENE()
-            VOLUMEPT()
+            ACTIVITIES(GARNET)
+            ACTIVITIES(PLAGIOCLASE)
+            ACTIVITIES(ORTHOPYROXENE)
+            VOLUMEPT(True, False, False)
             DELTAHGAPES = (((3 * HAN) + (6 * HFS)) - ((3 * HBQ) + (2 * HALM) + HGR)) / 1000
             DELTASGAPES = (((3 * SAN) + (6 * SFS)) - ((3 * SBQ) + (2 * SALM) + SGR)) / 1000
             DELTAVGAPES = ((3 * VAN) + (6 * VFS)) - ((3 * VBQ) + (2 * VALM) + VGR)
@@ -602,18 +1857,23 @@ def RCLCfunction():
             TFEAL = (DELTAHFEAL + (P * DELTAVFEAL)) / (DELTASFEAL - (.008314 * log(KFEAL)))
             TK = TFEAL
             TC = TK - 273
-            CP() #update H and S for next iteration
+            CP(True, False, False) #update H and S for next iteration
+            if TPconverged(TKOLD, POLD):
+                break
+        else:
+            notconverged('Fe-Al intersection', TKOLD, POLD)
         if  (I==0): #for the first iteration, define the initial T and P calculated
             TFEALI = TC
             PFEALI = P
 
-        GARNET()
-        ORTHOPYROXENE()
-        if  (minmodes['crd'] > 0.01) and not skip_crd:
+        CP(False, anycrd, anybt) # H and S of the cordierite and biotite end-members (if needed) at the final T
+        ACTIVITIES(GARNET)
+        ACTIVITIES(ORTHOPYROXENE)
+        if  anycrd:
             CORDIERITE()
-        if  (minmodes['bt'] > 0.01) and not skip_bt:
+        if  anybt:
             BIOTITE()
-        VOLUMEPT()
+        VOLUMEPT(True, anycrd, anybt)
 
         # CALCULATES A CORRECTED KD(GRT-OPX(FE-MG))
         DELTAHFEMGOPX = (((1 * HEN) + ((1 / 3) * HALM)) - ((1 * HFS) + ((1 / 3) * HPY))) / 1000
@@ -623,7 +1883,7 @@ def RCLCfunction():
         KDGAROPX = ((TK * DELTASFEMGOPX) - DELTAHFEMGOPX - (P * DELTAVFEMGOPX) - (.008314 * TK * (log(GAMMAFEMGOPX)))) / (.008314 * TK)
         KDGAROPX = exp(KDGAROPX)
         # CALCULATES A CORRECTED KD(GRT-CRD) if cordierite is  being considered
-        if  (minmodes['crd'] > 0.01) and not skip_crd:
+        if  anycrd:
             DELTAHFEMGCRD = (((.5 * HCRD) + ((1 / 3) * HALM)) - ((.5 * HFECRD) + ((1 / 3) * HPY))) / 1000
             DELTASFEMGCRD = (((.5 * SCRD) + ((1 / 3) * SALM)) - ((.5 * SFECRD) + ((1 / 3) * SPY))) / 1000
             DELTAVFEMGCRD = ((.5 * VCRD) + ((1 / 3) * VALM)) - ((.5 * VFECRD) + ((1 / 3) * VPY))
@@ -631,7 +1891,7 @@ def RCLCfunction():
             KDGARCRD = ((TK * DELTASFEMGCRD) - DELTAHFEMGCRD - (P * DELTAVFEMGCRD) - (.008314 * TK * (log(GAMMAFEMGCRD)))) / (.008314 * TK)
             KDGARCRD = exp(KDGARCRD)
         # CALCULATES A CORRECTED KD(GRT-BT) if biotite is being considered
-        if  (minmodes['bt'] > 0.01) and not skip_bt:
+        if  anybt:
             DELTAHFEMGBT = ((((1 / 3) * HPHL) + ((1 / 3) * HALM)) - (((1 / 3) * HANN) + ((1 / 3) * HPY))) / 1000
             DELTASFEMGBT = ((((1 / 3) * SPHL) + ((1 / 3) * SALM)) - (((1 / 3) * SANN) + ((1 / 3) * SPY))) / 1000
             DELTAVFEMGBT = (((1 / 3) * VPHL) + ((1 / 3) * VALM)) - (((1 / 3) * VANN) + ((1 / 3) * VPY))
@@ -639,28 +1899,17 @@ def RCLCfunction():
             KDGARBT = ((TK * DELTASFEMGBT) - DELTAHFEMGBT - (P * DELTAVFEMGBT) - (.008314 * TK * (log(GAMMAGARBT)))) / (.008314 * TK)
             KDGARBT = exp(KDGARBT)
 
-        # QUADRATIC SOLUTION TO CORRECTED MG-RATIOS OF MINERALS
-        for L in range(10): #should converge in < 10 iterations
-            # QUADRATIC SOLUTION TO CORRECTED MG-RATIO OF GARNET AND OPX
-            A = MFOPX - (KDGAROPX * MFOPX)
-            B = (MFOPX * KDGAROPX) + MFGAR + (XMGROCK * KDGAROPX) - XMGROCK - (KDGAROPX * MGRATIOCRD * MFCRD) - (KDGAROPX * MGRATIOBT * MFBT) + (MFCRD * MGRATIOCRD) + (MFBT * MGRATIOBT)
-            C = (MGRATIOCRD * MFCRD * KDGAROPX) + (MGRATIOBT * MFBT * KDGAROPX) - (XMGROCK * KDGAROPX)
-            MGRATIOOPX = (-B + (((B ** 2) - (4 * A * C)) ** .5)) / (2 * A)
-            MGRATIOGAR = (XMGROCK - (MGRATIOOPX * MFOPX) - (MGRATIOCRD * MFCRD) - (MGRATIOBT * MFBT)) / MFGAR
-            # QUADRATIC SOLUTION TO CORRECTED MG-RATIO OF GARNET AND BIOTITE if biotite is being considered
-            if  (minmodes['bt'] > 0.01) and not skip_bt:
-                A = MFBT - (KDGARBT * MFBT)
-                B = (MFBT * KDGARBT) + MFGAR + (XMGROCK * KDGARBT) - XMGROCK - (KDGARBT * MGRATIOOPX * MFOPX) - (KDGARBT * MGRATIOCRD * MFCRD) + (MFOPX * MGRATIOOPX) + (MFCRD * MGRATIOCRD)
-                C = (MGRATIOOPX * MFOPX * KDGARBT) + (MGRATIOCRD * MFCRD * KDGARBT) - (XMGROCK * KDGARBT)
-                MGRATIOBT = (-B + (((B ** 2) - (4 * A * C)) ** .5)) / (2 * A)
-                MGRATIOGAR = (XMGROCK - (MGRATIOBT * MFBT) - (MGRATIOOPX * MFOPX) - (MGRATIOCRD * MFCRD)) / MFGAR
-            # QUADRATIC SOLUTION TO CORRECTED MG-RATIO OF GARNET AND CORDIERITE if cordierite is being considered
-            if  (minmodes['crd'] > 0.01) and not skip_crd:
-                A = MFCRD - (KDGARCRD * MFCRD)
-                B = (MFCRD * KDGARCRD) + MFGAR + (XMGROCK * KDGARCRD) - XMGROCK - (KDGARCRD * MGRATIOOPX * MFOPX) - (KDGARCRD * MGRATIOBT * MFBT) + (MFOPX * MGRATIOOPX) + (MFBT * MGRATIOBT)
-                C = (MGRATIOOPX * MFOPX * KDGARCRD) + (MGRATIOBT * MFBT * KDGARCRD) - (XMGROCK * KDGARCRD)
-                MGRATIOCRD = (-B + (((B ** 2) - (4 * A * C)) ** .5)) / (2 * A)
-                MGRATIOGAR = (XMGROCK - (MGRATIOCRD * MFCRD) - (MGRATIOOPX * MFOPX) - (MGRATIOBT * MFBT)) / MFGAR
+        # CORRECTED MG-RATIOS OF MINERALS, SOLVING THE MASS BALANCE AND ALL THE KD'S AT ONCE (SEE MGRATIOS())
+        others = []
+        if  anycrd:
+            others.append((MFCRD, KDGARCRD, usecrd, MGRATIOCRD))
+        if  anybt:
+            others.append((MFBT, KDGARBT, usebt, MGRATIOBT))
+        MGRATIOGAR, MGRATIOOPX, others = MGRATIOS(XMGROCK, MFGAR, MFOPX, KDGAROPX, others)
+        if  anycrd:
+            MGRATIOCRD = others.pop(0)
+        if  anybt:
+            MGRATIOBT = others.pop(0)
 
         FERATIOOPX = 1 - MGRATIOOPX
         XMGOPX = (MGRATIOOPX) * ((FE2OPX + MGOPX) / 2)
@@ -671,21 +1920,25 @@ def RCLCfunction():
         XFECRD = (1 - MGRATIOCRD) * (XFECRD + XMGCRD)
         XMGBT =  MGRATIOBT * (XFEBT + XMGBT)
         XFEBT =  (1 - MGRATIOBT) * (XFEBT + XMGBT)
+        if  I > 0 and TPconverged(TKI, PI): # the Mg-ratios are corrected at least once
+            break
+    else:
+        notconverged('Fe-Mg correction', TKI, PI)
     #NEXT I
 
     # CALCULATE GRT-OPX FE-MG T TO SEE if  AGREES WITH FINAL FE-AL-OPX T
     KDGAROPX = (XFEGAR * XMGOPX) / (XMGGAR * XFEOPX)
     TGAROPX = (DELTAHFEMGOPX + (P * DELTAVFEMGOPX)) / (DELTASFEMGOPX - (.008314 * log(KDGAROPX)) - (.008314 * log(GAMMAFEMGOPX)))-273
     # CALCULATE GRT-CRD FE-MG T TO SEE if  AGREES WITH FINAL FE-AL-OPX T, if cordierite is being considered
-    if  (minmodes['crd'] > 0.01) and not skip_crd:
+    if  anycrd:
         KDGARCRD = (XFEGAR * XMGCRD) / (XMGGAR * XFECRD)
-        TGARCRD = (DELTAHFEMGCRD + (P * DELTAVFEMGCRD)) / (DELTASFEMGCRD - (.008314 * log(KDGARCRD)) - (.008314 * log(GAMMAFEMGCRD)))-273
+        TGARCRD = masked(usecrd, (DELTAHFEMGCRD + (P * DELTAVFEMGCRD)) / (DELTASFEMGCRD - (.008314 * log(KDGARCRD)) - (.008314 * log(GAMMAFEMGCRD)))-273, 0)
     # CALCULATE GRT-BT FE-MG T TO SEE if  AGREES WITH FINAL FE-AL-OPX T, if biotite is being considered
-    if  (minmodes['bt'] > 0.01) and not skip_bt:
+    if  anybt:
         KDGARBT = (XFEGAR * XMGBT) / (XMGGAR * XFEBT)
-        TGARBT = (DELTAHFEMGBT + (P * DELTAVFEMGBT)) / (DELTASFEMGBT - (.008314 * log(KDGARBT)) - (.008314 * log(GAMMAGARBT)))-273
-    # CHECK if  RECALCULATED XMGROCK IS THE SAME AS THE INITIAL XMGROCKI (this TEST is not currently being used, but has not been deleted while I look through the rest of the code)
-    TEST = (MGRATIOGAR * MFGAR) + (MGRATIOOPX * MFOPX) + (MGRATIOCRD * MFCRD) + (MGRATIOBT * MFBT)
+        TGARBT = masked(usebt, (DELTAHFEMGBT + (P * DELTAVFEMGBT)) / (DELTASFEMGBT - (.008314 * log(KDGARBT)) - (.008314 * log(GAMMAGARBT)))-273, 0)
+    # RESIDUAL OF THE XMGROCK MASS BALANCE WITH THE CORRECTED MG-RATIOS (WRITTEN TO THE OUTPUT FILE)
+    MASSBALANCE = (MGRATIOGAR * MFGAR) + (MGRATIOOPX * MFOPX) + (MGRATIOCRD * MFCRD) + (MGRATIOBT * MFBT) - XMGROCK
 
 ########################################################
 ########## END DEFINING THE MAIN PROGRAM ###############
@@ -695,6 +1948,16 @@ def RCLCfunction():
 ######### IMPORTING COMPOSITIONAL DATA & MODES #########
 ########################################################
 
+# the arrays holding the analyses of each mineral, and the element (input file column) in each array
+MINERALDATA = {'opx': ['aSIOPX', 'aTIOPX', 'aALOPX', 'aCROPX', 'aFE3OPX', 'aFE2OPX', 'aMNOPX', 'aMGOPX', 'aCAOPX'],
+               'gar': ['aFEGAR', 'aMNGAR', 'aMGGAR', 'aCAGAR'],
+               'pl':  ['aCAPL', 'aNAPL', 'aKPL'],
+               'crd': ['aFECRD', 'aMNCRD', 'aMGCRD'],
+               'bt':  ['aSIBT', 'aTIBT', 'aALBT', 'aFEBT', 'aMNBT', 'aMGBT', 'aNABT', 'aKBT']}
+ELEMENTS = {'SI': 'Si', 'TI': 'Ti', 'AL': 'Al', 'CR': 'Cr', 'FE3': 'Fe3', 'FE2': 'Fe2', 'FE': 'Fe2', 'MN': 'Mn',
+            'MG': 'Mg', 'CA': 'Ca', 'NA': 'Na', 'K': 'K'}
+COLUMNS = ['Si', 'Ti', 'Al', 'Cr', 'Fe3', 'Fe2', 'Mn', 'Mg', 'Ca', 'Na', 'K'] # the cation columns of the input files
+
 #import opx formula normalized to 6 oxygen
 aSIOPX, aTIOPX, aALOPX, aCROPX, aFE3OPX, aFE2OPX, aMNOPX, aMGOPX, aCAOPX = [],[],[],[],[],[],[],[],[]
 with open('opx.txt') as opxdata:
@@ -778,19 +2041,204 @@ try:
                 aNABT.append(float(line[9]))
                 aKBT.append(float(line[10]))
     #converted to numpy arrays for consistency with OPX data
-    aSIBT, aALBT, aFEBT = nparray(aSIBT), nparray(aALBT), nparray(aFEBT)
+    aSIBT, aTIBT, aALBT, aFEBT = nparray(aSIBT), nparray(aTIBT), nparray(aALBT), nparray(aFEBT)
     aMNBT, aMGBT, aNABT, aKBT = nparray(aMNBT), nparray(aMGBT), nparray(aNABT), nparray(aKBT)
     skip_bt = False
 except:
     print('no biotite compositional file found in directory\nbiotite will not be considered in the calculation\n')
     skip_bt = True
 
-#import mineral modes
-minmodes = dict()
+#import optional columns that follow the cation columns of the mineral input files (e.g. X, Y and sample)
+extracolumns = dict()
+for m in ['opx', 'gar', 'pl', 'crd', 'bt']:
+    if not (m == 'crd' and skip_crd) and not (m == 'bt' and skip_bt):
+        extracolumns[m] = optionalcolumns(m+'.txt')
+
+#import the optional rules restricting which labelled analyses may be combined
+try:
+    filterrules = readfilter('filter.txt')
+    print(str(len(filterrules))+' filter rules read from filter.txt\n')
+except FileNotFoundError:
+    filterrules = []
+
+#import mineral modes (lines with a third column are the modes of one sample, used by runmode 10)
+minmodes, samplemodes = dict(), dict()
 with open('modes.txt') as modes:
     for line in modes:
         line = line.rstrip().split()
-        minmodes[line[0]]=float(line[1])
+        if len(line) > 2:
+            try: # sample names are read as in the Sample columns of the input files (see optionalcolumns())
+                sample = float(line[2])
+            except ValueError:
+                sample = line[2]
+            samplemodes.setdefault(sample, dict())[line[0]] = float(line[1])
+        else:
+            minmodes[line[0]]=float(line[1])
+
+#import the ranges or distributions of the modes to sweep over (optional): each line of modesweep.txt gives a range
+#or a distribution of the mode of a mineral (see readsweep()). Every combination is calculated with every set of modes
+modescenarios, modesonly = None, False # modesonly: RCLCfunction() is only recalculating the parts that depend on the modes
+boundAAN = None # the anorthite activity used instead of that of the plagioclase analysis (see plbounds())
+if exists('modesweep.txt'):
+    modescenarios = readsweep('modesweep.txt', {m: npnan for m in minmodes}) # NaN: the mode of modes.txt (or of the sample)
+    print(str(len(modescenarios['gar']))+' sets of modes read from modesweep.txt\n')
+
+#import the ranges or distributions of Fe3/(Fe3+Fe2) of opx and garnet to sweep over (optional): each line of
+#fe3sweep.txt gives a range or a distribution for a mineral (see readsweep()), with total Fe held constant
+fe3scenarios = None
+if exists('fe3sweep.txt'):
+    fe3scenarios = readsweep('fe3sweep.txt', {'opx': npnan, 'gar': npnan}) # NaN: Fe3 and Fe2 as in the input file
+    print(str(len(fe3scenarios['opx']))+' sets of Fe3/(Fe3+Fe2) read from fe3sweep.txt\n')
+
+#import the analytical uncertainties (optional): if uncertainty.txt or any of the files gar_sigma.txt, opx_sigma.txt...
+#is present, the uncertainty of T and P is calculated for every combination by Monte Carlo (see README)
+sigmas, mcdraws, mcseed, linearuncertainty, modesigma = dict(), 0, 0, False, dict()
+if exists('uncertainty.txt') or any(exists(m+'_sigma.txt') for m in extracolumns):
+    mcdraws = 1000
+    defaultsigma = {m: npzeros(11) for m in extracolumns}
+    if exists('uncertainty.txt'):
+        with open('uncertainty.txt') as sigmadata:
+            lines = [line.split() for line in sigmadata if line.strip()]
+        for line in lines[1:]: # 1 sigma of each element in the header line, for every mineral
+            if rsearch('^[A-z]', line[0]) == None:
+                for m in extracolumns:
+                    defaultsigma[m][[COLUMNS.index(name) for name in lines[0]]] = [float(value) for value in line]
+        for line in lines[1:]: # 1 sigma of each element for one mineral, or the number of draws and the random seed
+            if line[0].lower() == 'draws':
+                mcdraws = int(line[1])
+            elif line[0].lower() == 'seed':
+                mcseed = int(line[1])
+            elif line[0].lower() == 'linear': # linear propagation with derivatives, instead of Monte Carlo
+                linearuncertainty = True
+            elif line[0].lower() == 'mode': # 1 sigma of the mode of a mineral, e.g. mode gar 0.02
+                modesigma[line[1].lower()] = float(line[2])
+            elif line[0].lower() in extracolumns:
+                defaultsigma[line[0].lower()][[COLUMNS.index(name) for name in lines[0]]] = [float(value) for value in line[1:]]
+    for m in extracolumns:
+        sigmas[m] = nptile(defaultsigma[m], (len(globals()[MINERALDATA[m][0]]), 1))
+        if exists(m+'_sigma.txt'): # 1 sigma of every cation of every analysis, laid out like the input file
+            with open(m+'_sigma.txt') as sigmadata:
+                rows = [[float(value) for value in line.split()[:11]] for line in sigmadata if line.strip() and rsearch('^[A-z]', line) == None]
+            if len(rows) != len(sigmas[m]):
+                raise ValueError(m+'_sigma.txt must have one line for every analysis in '+m+'.txt')
+            sigmas[m] = nparray(rows)
+    if linearuncertainty:
+        mcdraws = 0
+        print('the uncertainty of T and P will be calculated from the derivatives of T and P with respect to each cation and mode\n')
+    else:
+        print('the uncertainty of T and P will be calculated from '+str(mcdraws)+' random draws of the analytical errors of each combination\n')
+
+#merge near-identical analyses (optional): analyses of a mineral whose cations are all within the tolerances
+#in tolerances.txt of an earlier analysis are merged into it, and counted once for each analysis merged
+weights = {m: npones(len(globals()[MINERALDATA[m][0]]), dtype=int) for m in extracolumns}
+analysisnumbers = {m: nparange(1, len(globals()[MINERALDATA[m][0]]) + 1) for m in extracolumns}
+inputanalyses, reduced = saveanalyses(), set() # the analyses as read, and the minerals merged or clustered since (see rowpaired)
+try:
+    with open('tolerances.txt') as tolerancedata:
+        lines = [line.split() for line in tolerancedata if line.strip()]
+    tolerance = {element: 0.0 for element in ELEMENTS.values()}
+    tolerance.update({name: float(value) for name, value in zip(lines[0], lines[1])})
+    for m in extracolumns:
+        n = len(weights[m])
+        mergeanalyses(m, tolerance)
+        if len(weights[m]) < n:
+            reduced.add(m)
+        print(m+': '+str(n)+' analyses merged into '+str(len(weights[m]))+' within the tolerances in tolerances.txt')
+    print('')
+except FileNotFoundError:
+    pass
+
+#reduce large sets of analyses to representative analyses (optional): clusters.txt lists a mineral and the
+#number of representatives on each line (e.g. gar 20), and optionally the number of combinations of all the
+#analyses to sample for comparison on a line 'compare n' (default 1000, 0 to skip the comparison)
+allanalyses, ncompare = None, 1000
+try:
+    with open('clusters.txt') as clusterdata:
+        lines = [line.lower().split() for line in clusterdata if line.strip()]
+    allanalyses = saveanalyses()
+    for line in lines:
+        if line[0] == 'compare':
+            ncompare = int(line[1])
+        elif line[0] in extracolumns:
+            n = len(weights[line[0]])
+            clusteranalyses(line[0], int(line[1]))
+            if len(weights[line[0]]) < n:
+                reduced.add(line[0])
+            print(line[0]+': '+str(n)+' analyses reduced to '+str(len(weights[line[0]]))+' representative analyses')
+        else:
+            print('line of clusters.txt not understood or mineral not included, and not used: '+' '.join(line))
+    print('')
+except FileNotFoundError:
+    pass
+
+#bootstrap confidence intervals (optional): if bootstrap.txt is present, confidence intervals of the median and
+#mean of T and P are calculated by resampling the analyses of each mineral, with lines 'replicates n' (default
+#1000), 'confidence c' (in percent, default 95) and 'seed s' (default 0)
+replicates, confidence, bootstrapseed = 0, 95.0, 0
+try:
+    with open('bootstrap.txt') as bootstrapdata:
+        lines = [line.lower().split() for line in bootstrapdata if line.strip()]
+    replicates = 1000
+    for line in lines:
+        if line[0] == 'replicates':
+            replicates = int(line[1])
+        elif line[0] == 'confidence':
+            confidence = float(line[1])
+        elif line[0] == 'seed':
+            bootstrapseed = int(line[1])
+        else:
+            print('line of bootstrap.txt not understood, and not used: '+' '.join(line))
+except FileNotFoundError:
+    pass
+
+#activity cache (optional): if activitycache.txt is present, the garnet, opx and plagioclase activities of each
+#composition at each T and P are kept and reused, with lines 'size n' (the number kept, default 100000), 'T q' and
+#'P q' (T and P are rounded to the nearest q K and q kbar before the activities are calculated; default 0, not rounded,
+#in which case the cache is not used)
+activitycache, cachesize, cacheTquantum, cachePquantum = None, 100000, 0.0, 0.0
+cachecounts = {'hits': 0, 'misses': 0}
+try:
+    with open('activitycache.txt') as cachedata:
+        lines = [line.lower().split() for line in cachedata if line.strip()]
+    activitycache = OrderedDict()
+    for line in lines:
+        if line[0] == 'size':
+            cachesize = int(line[1])
+        elif line[0] == 't':
+            cacheTquantum = float(line[1])
+        elif line[0] == 'p':
+            cachePquantum = float(line[1])
+        else:
+            print('line of activitycache.txt not understood, and not used: '+' '.join(line))
+    if not cacheTquantum and not cachePquantum: # the same composition is hardly ever calculated at exactly the same T and P again
+        print('activitycache.txt rounds neither T nor P, so the activity cache is not used')
+        activitycache = None
+except FileNotFoundError:
+    pass
+
+#result cache (optional): if resultcache.txt is present, the results of every combination calculated are saved in a
+#file (a SQLite database), and reused when the same combination is calculated again with the same modes, thermodynamic
+#data and settings, with lines 'file name' (default resultcache.sqlite) and 'size n' (in MB, default 100)
+resultcache, resultcachefile, resultcachesize = None, 'resultcache.sqlite', 100.0
+resultcounts = {'reused': 0, 'calculated': 0, 'run': 0}
+resultrows, resultused = [], [] # results calculated and reused since they were last written to the file (see saveresults())
+RESULTBATCH = 1000 # the number of results written to the file at once
+try:
+    with open('resultcache.txt') as resultcachedata:
+        lines = [line.split() for line in resultcachedata if line.strip()]
+    for line in lines:
+        if line[0].lower() == 'file':
+            resultcachefile = line[1]
+        elif line[0].lower() == 'size':
+            resultcachesize = float(line[1])
+        else:
+            print('line of resultcache.txt not understood, and not used: '+' '.join(line))
+    resultcache = sqlite3connect(resultcachefile, timeout=60) # several processes can share it (see batchRCLC_samples.py)
+    resultcache.execute('PRAGMA journal_mode=WAL') # so they can read it while another writes
+    resultcache.execute('CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, row TEXT, used INTEGER)')
+    resultcounts['run'] = resultcache.execute('SELECT COALESCE(MAX(used), 0) + 1 FROM results').fetchone()[0]
+except FileNotFoundError:
+    pass
 
 ########################################################
 ####### END IMPORTING COMPOSITIONAL DATA & MODES #######
@@ -804,8 +2252,12 @@ print ("YOU HAVE A CHOICE FOR CALCULATING XALM IN OPX.\nTHE FOLLOWING FORMULAE A
 print ("1: XAL_M1 = Al - (2 - Si)")
 print ("2: XAL_M1 = Al/2")
 print ("3: XAL_M1 = (Al/2) / (Fe2+ + Mg + Mn + Ca + (Al/2) )")
-print ("4: XAL_M1 = (Al - Fe3+ - Cr - (2*Ti) ) / 2 \n")
-num = int( input("Please enter 1,2,3,4: "))
+print ("4: XAL_M1 = (Al - Fe3+ - Cr - (2*Ti) ) / 2")
+print ("5: ALL FOUR, SIDE BY SIDE (T AND P FINAL OF EACH AS EXTRA OUTPUT ROWS; EVERYTHING ELSE USES 4)\n")
+num = int( input("Please enter 1,2,3,4,5: "))
+allmodels = num == 5
+if  allmodels:
+    num = 4
 if  num == 1:
     ALOPX1()
 if  num == 2:
@@ -835,9 +2287,52 @@ DATASET = [[-5265317.1, 341.5824, 621.4269, -3287.931, -15081040, 2211865100], \
 [-5155234.4, 405.01, 727.208, -4775.04, -13831900, 2119060000], \
 [-9161425.7, 416.2714, 954.3865, -7962.274, -2317258, -370214090], \
 [-8429860.2, 482.8282, 983.479, -8403.659, -1870290, -85683500]]
+ENDMEMBERS = ['ALM', 'PY', 'GR', 'AN', 'BQ', 'EN', 'FS', 'ALOPX', 'PHL', 'ANN', 'CRD', 'FECRD'] # the rows of DATASET and VOLUMEDATA
+# V = V0 * (1 + V1 * (T - 298) + V2 * (T - 298)^2 + V3 * P + V4 * P^2), with P in bars: V0, V1, V2, V3, V4 of each end member
+VOLUMEDATA = [[11.524, .0000185989054, 7.4711E-09, -.000000570324, 4.344E-13], \
+[11.311, 0.0000225186544, 3.7044E-09, -.000000576209, 4.42E-13], \
+[12.538, 0.0000189942017, 7.9756E-09, -.0000006539136, 1.635E-12], \
+[10.075, .0000109181141, 4.1985E-09, -.0000012724268, 3.1762E-12], \
+[2.37, 0, 0, -.0000012382672, 7.0871E-12], \
+[3.133, .0000246558172, 7.467E-09, -.0000007493458, 4.467E-13], \
+[3.295, .0000314064017, 8.04E-09, -.0000009111044, 3.034E-13], \
+[3.093, .0000246558172, 7.467E-09, -.0000007493458, 4.467E-13], \
+[14.971, .0000344473262, 0, -.0000016969784, 0], \
+[15.487, .0000344473262, 0, -.0000016969784, 0], \
+[23.311, .0000030028742, 1.8017E-09, -.0000011582515, 0], \
+[23.706, .0000042647431, 0, -.0000016998228, 0]]
+# W = WH - T * WS + P * WV (P in bars for garnet and opx, and in kbar for plagioclase): WH, WS, WV of each Margules parameter
+GARMARGULES = {'W112': [85529, 18.79, .21], 'W122': [50874.9, 18.79, .02], 'W113': [24025.5, 9.43, .17],
+               'W133': [9876.2, 9.43, .09], 'W223': [1307.4, 0, .01], 'W233': [2092.4, 0, .06],
+               'W123': [86852.8, 28.22, .28], 'W124': [82759.9, 28.79, .1], 'W134': [7053.9, -30.01, .13],
+               'W234': [6361, -29.44, .04], 'W224': [14558, 10, .04], 'W244': [14558, 10, .04],
+               'W344': [158, -35.1, .04], 'W334': [-19952, -43.78, .04]}
+OPXMARGULES = {'W12': [-4543.8, -3.36, 0], 'W23': [-32213.3, 0, -.69], 'W13': [-26944.5, 0, -.58],
+               'DARKEN': [24307, 14.404, .185]} # the Darken correction of the Al-opx activity
+PLMARGULES = {'WABOR': [18.81, .0103, .39], 'WORAB': [27.32, .0103, .39], 'WABAN': [28.226, 0, 0],
+              'WANAB': [8.471, 0, 0], 'WANOR': [52.468, 0, -.12], 'WORAN': [47.396, 0, 0],
+              'WORABAN': [100.0455, .0103, -.76]}
 DENSFEGAR, DENSMGGAR, DENSCAGAR, DENSMNGAR, DENSFEOPX = 4.33, 3.54, 3.56, 4.19, 3.96
 DENSMGOPX, DENSMGCRD, DENSFECRD, DENSFEBT, DENSMGBT = 3.21, 2.53, 2.78, 3.3, 2.7
 
+#import the uncertainties of the thermodynamic data (optional): if thermouncertainty.txt is present, the uncertainty
+#of T and P is calculated for every combination over random draws of the thermodynamic data (see README)
+thermodraws = dict()
+if exists('thermouncertainty.txt'):
+    thermodraws = drawthermodata('thermouncertainty.txt')
+
+DERIVATIVESTEP = 1e-6 # change in cations per formula unit (and in mode) used to calculate derivatives
+
+PRIMES = [2, 3, 5, 7, 11] # bases of the Halton sequence used by runmode 5, one per mineral
+
+# the iterations for T and P stop when T (K) and P (kbar) change by less than these, or after MAXITERATIONS
+TTOLERANCE, PTOLERANCE, MAXITERATIONS = 1e-3, 1e-5, 50
+# runmode 4: the range of T (K) and P (kbar) within which T final and P final of every combination are assumed to lie, to
+# bound the anorthite activity of its plagioclase (see plbounds()). A branch whose bound leaves it is calculated in full
+PLBOX = ((473, 2273), (-10, 50))
+# the number of calculations of each stage whose T and P had not converged after MAXITERATIONS (see notconverged())
+unconverged = dict()
+
 ########################################################
 ############## end Thermodynamic data ##################
 ########################################################
@@ -845,9 +2340,6 @@ DENSMGOPX, DENSMGCRD, DENSFECRD, DENSFEBT, DENSMGBT = 3.21, 2.53, 2.78, 3.3, 2.7
 ########################################################
 ##### run calcs for various compositional combos #######
 ########################################################
-# this section works, but is not particularly elegant
-# redundant code could be consolidated if desired
-
 #output variables
 TFEALIout = ['Fe-Al T init']
 PFEALIout = ['Fe-Al P init']
@@ -857,108 +2349,448 @@ TGARBTIout = ['gar-bt Fe-Mg T init']
 PGARBTIout = ['gar-bt Fe-Mg P init']
 TGARCRDIout = ['gar-crd Fe-Mg T init']
 PGARCRDIout = ['gar-crd Fe-Mg P init']
+MASSBALANCEout = ['XMg rock mass balance residual']
 TCout = ['Fe-Al T final']
 Pout = ['Fe-Al P final']
 TGAROPXout = ['gar-opx Fe-Mg T final']
 TGARBTout = ['gar-bt Fe-Mg T final']
 TGARCRDout = ['gar-crd Fe-Mg T final']
 calctracker = ['analyses used'] #will be used to track which mineral combos were used for each calculation
+combosout = [] #the same combinations, as analysis indices
+weightout = ['weight (combinations of input analyses represented)'] #only written if analyses were merged or clustered
+mcout = [['Fe-Al T final MC mean'], ['Fe-Al T final MC 1 sigma'], ['Fe-Al P final MC mean'], ['Fe-Al P final MC 1 sigma'],
+         ['Fe-Al T-P final MC covariance']] #only calculated and written if analytical uncertainties are given
+thermomcout = [['Fe-Al T final thermo MC mean'], ['Fe-Al T final thermo MC 1 sigma'], ['Fe-Al P final thermo MC mean'],
+               ['Fe-Al P final thermo MC 1 sigma'], ['Fe-Al T-P final thermo MC covariance']] #only if thermouncertainty.txt is given
+results = [calctracker,TCout,Pout,TGAROPXout,TGARBTout,TGARCRDout,TFEALIout,PFEALIout,TGAROPXIout,PGAROPXIout,TGARBTIout,PGARBTIout,TGARCRDIout,PGARCRDIout,MASSBALANCEout]
+
+# optional command-line arguments, used by batchRCLC_samples.py to split large runs between processes:
+# 'part i n' only calculates the i-th of n equal parts (counting from 0) of the combinations of runmodes 1 and 2,
+# and 'output name' saves the results to the file name instead of outputfile.csv
+part, outputname = (0, 1), 'outputfile.csv'
+if 'part' in argv:
+    part = (int(argv[argv.index('part') + 1]), int(argv[argv.index('part') + 2]))
+if 'output' in argv:
+    outputname = argv[argv.index('output') + 1]
+
+# the minerals used in each calculation, in the order in which runmode 2 loops through them
+minerals = ['opx', 'gar', 'pl']
+if not skip_crd:
+    minerals.append('crd')
+if not skip_bt:
+    minerals.append('bt')
+nanalyses = {'opx': len(aSIOPX), 'gar': len(aFEGAR), 'pl': len(aCAPL), 'crd': len(aFECRD), 'bt': len(aSIBT)}
+rowcounts = {m: len(inputanalyses[m][2]) for m in minerals} # the number of rows of each input file, paired by runmodes 1 and 6
+
+# criteria available to runmode 3 for ranking combinations. Each takes a row of results (see outputrow())
+# and returns a score; the combinations with the k highest scores are kept.
+topkcriteria = {1: ('highest Fe-Al T final (hottest)', lambda row: row[0]),
+                2: ('lowest Fe-Al T final', lambda row: -row[0]),
+                3: ('highest Fe-Al P final', lambda row: row[1]),
+                4: ('lowest Fe-Al P final', lambda row: -row[1]),
+                5: ('smallest |Fe-Al T final - gar-opx Fe-Mg T final| (most internally consistent)', lambda row: -abs(row[0] - row[2]))}
+
+# the minerals runmode 10 uses, which need Sample columns: biotite and cordierite only if a sample (or the modes
+# without a sample) has a mode of them above 0.01 (see present())
+sampleminerals = [m for m in minerals if m not in ['crd', 'bt'] or \
+                  max([minmodes.get(m, 0.0)] + [modes.get(m, 0.0) for modes in samplemodes.values()]) > 0.01]
 
 # Determine run mode from user. either
 # run calculations in sequence (gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN)
 # or run every possible combination of the input mineral analyses
-if len(aMGGAR) == len(aMGOPX) == len(aCAPL):
-    if not skip_bt and not skip_crd:
-        if len(aMGBT) == len(aMGGAR) == len(aMGCRD):
-            print('You entered an equal number of GAR, OPX, PL, CRD, and BT analyses.\nWould you like to:')
-            print('1: Run them in sequence (gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN) or')
-            print('2: Run every possible combination of the input mineral analyses?\n')
-            runmode = int(input('Enter 1 or 2: '))
-        else:
-            print('You did not enter an equal number of analyses for each mineral.')
-            print('Runmode 2 will be used: run every possible combination of the input mineral analyses.\n')
-            print('If you would rather use runmode 1 (run in sequence: gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN),\n include the same number of analyses for each mineral in your input files.')
-            runmode = 2
-    elif not skip_bt:
-        if len(aMGBT) == len(aMGGAR):
-            print('You entered an equal number of GAR, OPX, PL, and BT analyses.\nWould you like to:')
-            print('1: Run them in sequence (gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN) or')
-            print('2: Run every possible combination of the input mineral analyses?\n')
-            runmode = int(input('Enter 1 or 2: '))
-        else:
-            print('You did not enter an equal number of analyses for each mineral.')
-            print('Runmode 2 will be used: run every possible combination of the input mineral analyses.\n')
-            print('If you would rather use runmode 1 (run in sequence: gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN),\n include the same number of analyses for each mineral in your input files.')
-            runmode = 2
-    elif not skip_crd:
-        if len(aMGCRD) == len(aMGGAR):
-            print('You entered an equal number of GAR, OPX, PL, and CRD analyses.\nWould you like to:')
-            print('1: Run them in sequence (gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN) or')
-            print('2: Run every possible combination of the input mineral analyses?\n')
-            runmode = int(input('Enter 1 or 2: '))
-        else:
-            print('You did not enter an equal number of analyses for each mineral.')
-            print('Runmode 2 will be used: run every possible combination of the input mineral analyses.\n')
-            print('If you would rather use runmode 1 (run in sequence: gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN),\n include the same number of analyses for each mineral in your input files.')
-            runmode = 2
-    else:
-        print('You entered an equal number of GAR, OPX, and PL analyses.\nWould you like to:')
-        print('1: Run them in sequence (gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN) or')
-        print('2: Run every possible combination of the input mineral analyses?\n')
-        runmode = int(input('Enter 1 or 2: '))
+mineralnames = [m.upper() for m in ['gar', 'opx', 'pl', 'crd', 'bt'] if m in minerals]
+mineralnames = ', '.join(mineralnames[:-1]) + ', and ' + mineralnames[-1]
+if len(set(rowcounts.values())) == 1:
+    print('You entered an equal number of '+mineralnames+' analyses.\nWould you like to:')
+    print('1: Run them in sequence (gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN) or')
 else:
     print('You did not enter an equal number of analyses for each mineral.')
-    print('Runmode 2 will be used: run every possible combination of the input mineral analyses.\n')
-    print('If you would rather use runmode 1 (run in sequence: gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN),\n include the same number of analyses for each mineral in your input files.')
-    runmode = 2
-
-# run input mineral data in sequence if user selected runmode 1: gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN
-if runmode == 1:
-    for i in range(len(aSIOPX)): #iterate through mineral compositions
-        SIOPX, TIOPX, ALOPX, CROPX, FE3OPX, FE2OPX, MNOPX, MGOPX, CAOPX = aSIOPX[i], aTIOPX[i], aALOPX[i], aCROPX[i], aFE3OPX[i], aFE2OPX[i], aMNOPX[i], aMGOPX[i], aCAOPX[i]
-        XFEOPX, XMGOPX, XAL_M1 = aXFEOPX[i], aXMGOPX[i], aXAL_M1[i]
-        FEGAR, MNGAR, MGGAR, CAGAR = aFEGAR[i], aMNGAR[i], aMGGAR[i], aCAGAR[i]
-        CAPL, NAPL, KPL = aCAPL[i], aNAPL[i], aKPL[i]
-        if not skip_bt: # if using biotite
-            SIBT, TIBT, ALBT, FEBT, MNBT, MGBT, NABT, KBT = aSIBT[i], aTIBT[i], aALBT[i], aFEBT[i], aMNBT[i], aMGBT[i], aNABT[i], aKBT[i]
-        if not skip_crd: # if using cordierite
-            FECRD, MNCRD, MGCRD = aFECRD[i], aMNCRD[i], aMGCRD[i]
+    print('If you would rather use runmode 1 (run in sequence: gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN),\n include the same number of analyses for each mineral in your input files.\nWould you like to:')
+print('2: Run every possible combination of the input mineral analyses?')
+print('3: Run every possible combination, but only save the k most extreme combinations (e.g. the hottest)?')
+print('4: Search for the k hottest or coldest combinations without running every combination (branch and bound)?')
+print('5: Run a random sample of the possible combinations, until the distribution of T and P stops changing?')
+print('6: Run some minerals in sequence (e.g. gar1-opx1, gar2-opx2...) and every possible combination of the others?')
+print('7: Run every garnet analysis with every combination of the analyses near it (needs X and Y columns)?')
+print('8: Calculate maps of T and P from maps of garnet and opx compositions (needs gar.npy and opx.npy)?')
+print('9: Calculate T and P along a traverse, pairing garnet and opx at similar distances from the interface (needs Distance columns)?')
+print('10: Run every combination of the analyses of each sample, for many samples at once (needs Sample columns)?\n')
+runmode = int(input('Enter the runmode: '))
+while runmode not in [1, 2, 3, 4, 5, 6, 7, 8, 9, 10] or (runmode == 1 and len(set(rowcounts.values())) != 1) or \
+      (runmode == 10 and not all('sample' in extracolumns[m] for m in sampleminerals)) or \
+      (runmode == 7 and not all('x' in extracolumns[m] and 'y' in extracolumns[m] for m in minerals)) or \
+      (runmode == 8 and not (exists('gar.npy') and exists('opx.npy'))) or \
+      (runmode == 9 and not all('distance' in extracolumns[m] for m in ['gar', 'opx'])):
+    runmode = int(input('That runmode is not available. Enter the runmode: '))
+
+if runmode == 3:
+    print('\nRank the combinations by:')
+    for key in topkcriteria:
+        print(str(key)+': '+topkcriteria[key][0])
+    criterion = topkcriteria[int(input('Enter 1,2,3,4,5: '))][1]
+    k = int(input('How many combinations should be saved? '))
+if runmode == 4:
+    print('\nSearch for:')
+    for key in [1, 2]:
+        print(str(key)+': '+topkcriteria[key][0])
+    criterion = topkcriteria[int(input('Enter 1,2: '))][1]
+    k = int(input('How many combinations should be saved? '))
+if runmode == 5:
+    print('\nCombinations are sampled in batches. Sampling stops when the 5th, 50th and 95th percentiles')
+    print('of T and P change by less than the tolerances below from one batch to the next.')
+    batchsize = int(input('How many combinations per batch? '))
+    Ttolerance = float(input('T tolerance (C): '))
+    Ptolerance = float(input('P tolerance (kbar): '))
+    print('1: pseudo-random sampling')
+    print('2: quasi-random sampling (a Halton sequence over the analyses of each mineral)')
+    print('3: stratified sampling (every analysis of every mineral is used in at least m combinations)')
+    sampling = int(input('Enter 1,2,3: '))
+    if sampling == 3:
+        mincoverage = int(input('m: '))
+    seed = int(input('Random seed (the same seed gives the same sample): '))
+if runmode == 6:
+    print('\nWhich minerals were analysed in pairs (e.g. at the same contact) and should be run in sequence?')
+    print('Enter at least two of: '+' '.join(minerals)+' (separated by spaces). They must have the same number of analyses.')
+    paired = input('Paired minerals: ').lower().split()
+    while len(set(paired) & set(minerals)) < 2 or len(set(rowcounts[m] for m in minerals if m in paired)) != 1:
+        paired = input('Enter at least two minerals with the same number of analyses: ').lower().split()
+    paired = [m for m in minerals if m in paired]
+# runmodes 1 and 6 pair the analyses of some minerals by their rows in the input files. Merging or clustering the
+# analyses of one of them would shift its rows against those of the others, so those minerals keep all the analyses as read
+rowpaired = minerals if runmode == 1 else paired if runmode == 6 else []
+for m in rowpaired:
+    if m in reduced:
+        restoreanalyses({m: inputanalyses[m]})
+        print(m+': analyses not merged or clustered, as runmode '+str(runmode)+' pairs them by row with those of '+', '.join(p for p in rowpaired if p != m))
+if runmode == 7:
+    print('\nAnalyses of the other minerals are paired with each garnet analysis if they are:')
+    print('1: within a distance of the garnet analysis, or')
+    print('2: among the k analyses of each mineral nearest to the garnet analysis')
+    if int(input('Enter 1,2: ')) == 1:
+        maxdistance, nearestk = float(input('Distance (in the units of the X and Y columns): ')), 0
+    else:
+        maxdistance, nearestk = 0, int(input('k: '))
+    spatialindex = dict()
+if runmode == 8:
+    # the maps are read from disk a band of rows at a time, so they do not have to fit in memory
+    garmap, opxmap = npload('gar.npy', mmap_mode='r'), npload('opx.npy', mmap_mode='r')
+    if garmap.ndim != 3 or garmap.shape[2] != 11 or opxmap.shape != garmap.shape:
+        raise ValueError('gar.npy and opx.npy must both have the shape (rows, columns, 11), with the 11 cations of each pixel in the order of the input files')
+    print('\nEach garnet pixel is paired with the nearest opx pixel within a distance of the garnet pixel.')
+    mapradius = int(input('Distance (pixels): '))
+    mapoffsets = sorted([(dy, dx) for dy in range(-mapradius, mapradius + 1) for dx in range(-mapradius, mapradius + 1) \
+                         if dy ** 2 + dx ** 2 <= mapradius ** 2], key=lambda offset: (offset[0] ** 2 + offset[1] ** 2, offset))
+    mapanalysis = dict()
+    for m in minerals:
+        if m not in ['gar', 'opx']:
+            n = int(input('Which '+m+' analysis should be used with the maps? '))
+            while n not in analysisnumbers[m]:
+                n = int(input('That analysis is not available. Which '+m+' analysis should be used with the maps? '))
+            mapanalysis[m] = list(analysisnumbers[m]).index(n)
+if runmode == 9:
+    print('\nEach garnet analysis is paired with the opx analyses whose distance from the interface is:')
+    print('1: within a window of the distance of the garnet analysis, or')
+    print('2: the closest to the distance of the garnet analysis')
+    if int(input('Enter 1,2: ')) == 1:
+        transectwindow = float(input('Window (in the units of the Distance columns): '))
+    else:
+        transectwindow = None
+
+if runmode == 10:
+    # the analyses of each mineral in each sample, in the order in which the samples first appear in gar.txt, and the
+    # modes of each sample: those given for it in modes.txt, or those without a sample if none are given for it. A
+    # sample whose own modes leave out a mineral it has analyses of is reported and not calculated. A sample without
+    # biotite or cordierite analyses uses any analysis in their place, with a mode of 0 so that it is left out of its
+    # calculations
+    for m in [m for m in minerals if m not in sampleminerals]:
+        minerals.remove(m)
+        skip_crd, skip_bt = skip_crd or m == 'crd', skip_bt or m == 'bt'
+        print(m+': not used, as no sample has a mode of it above 0.01')
+    sampleanalyses, modesbysample, shared = dict(), dict(), []
+    for sample in dict.fromkeys(extracolumns['gar']['sample']):
+        analyses = {m: [i for i, name in enumerate(extracolumns[m]['sample']) if name == sample] for m in minerals}
+        given = samplemodes.get(sample, minmodes)
+        missing = [m for m in minerals if m not in given and (m not in ['crd', 'bt'] or analyses[m])]
+        if missing:
+            print('sample '+str(sample)+' not calculated, as modes.txt gives no mode of '+', '.join(missing)+' for it')
+            continue
+        if sample not in samplemodes:
+            shared.append(str(sample))
+        sampleanalyses[sample] = analyses
+        modesbysample[sample] = {m: given.get(m, minmodes[m]) for m in minmodes}
+        for m in ['crd', 'bt']:
+            if m in minerals and not sampleanalyses[sample][m]:
+                sampleanalyses[sample][m], modesbysample[sample][m] = [0], 0.0
+    if samplemodes and shared:
+        print('samples without modes of their own in modes.txt, calculated with the modes without a sample: '+', '.join(shared))
+    print('\n'+str(len(sampleanalyses))+' samples, '+str(sum(prod(len(analyses) for analyses in sampleanalyses[sample].values()) \
+          for sample in sampleanalyses))+' combinations')
+
+# run the calculations for each combination of mineral analyses, one chunk of combinations at a time
+# runmode 1: run input mineral data in sequence: gar1-opx1-pl1, gar2-opx2-pl2... garN-opxN-plN
+# runmode 2: run every possible combination of input mineral analyses
+# runmode 3: as runmode 2, but only the k best combinations are kept (in a heap), so that memory
+#            use depends on k rather than on the number of combinations
+# runmode 4: the same k best combinations as runmode 3 (ranked by T), found by branch and bound
+# runmode 5: batches of randomly sampled combinations, until the percentiles of T and P converge
+# runmode 6: the paired minerals in sequence, crossed with every analysis of the other minerals
+# runmode 7: every garnet analysis with every combination of the analyses of the other minerals near it
+# runmode 8: every garnet pixel of a map with the nearest opx pixel, one band of rows at a time, with all the
+#            pixels of a band calculated at once and the bands shared between processes (one per core)
+# runmode 9: the garnet and opx analyses of a traverse at similar distances from the interface, every
+#            chunk of combinations calculated at once
+# runmode 10: every combination of the analyses of each sample, with the combinations of many samples (each
+#             with its own modes, and with or without biotite and cordierite) calculated at once
+topk = []
+if runmode in [1, 2, 3, 4, 5, 6, 7] and resultcache is not None: # each reused from the result cache, if it was calculated before
+    contextkey = resultcontext()
+if runmode in [1, 2, 3, 6, 7]:
+    for combos in combinations():
+        for combo in combos:
+            row = solve(combo)
+            if runmode == 3:
+                savetopk(combo, row)
+            else:
+                outputfunc(combo, row)
+elif runmode == 4:
+    # Every branch is one choice of opx, gar (and crd and bt) analyses; its leaves are the plagioclase analyses.
+    # A branch is bounded by calculating it with the lowest and highest anorthite activity that its plagioclase can
+    # have (see plbounds()): first anywhere within PLBOX, then within the T and P between those two results. Branches
+    # are then searched best bound first, and skipped once their bound can no longer beat the k best found so far.
+    # In a branch that is not skipped every plagioclase is calculated, except those whose AAN lies (anywhere within
+    # the T and P of the branch) beyond that of a calculated plagioclase that cannot beat the k best, on its worse
+    # side. The opx and garnet analyses cannot be bounded like this, as each enters the mass balance and several
+    # activities. Branches of at most four plagioclase analyses are just calculated.
+    ipl = minerals.index('pl')
+    margins = [100 * step for step in TPsteps()] # (T final and P final are only calculated to within about TPsteps())
+    nsolves, nbounds, branches = 0, 0, []
+    for branch in product(*[range(nanalyses[m]) for m in minerals if m != 'pl']):
+        plallowed = list(range(nanalyses['pl']))
+        if filterrules: # only the plagioclase analyses the filter allows with this branch
+            plallowed = [pl for pl, allowed in zip(plallowed, combofilter(nparray([branch[:ipl] + (pl,) + branch[ipl:] for pl in plallowed]))) if allowed]
+        if len(plallowed) <= 4: # (bounding a branch takes four calculations)
+            for pl in plallowed:
+                combo = branch[:ipl] + (pl,) + branch[ipl:]
+                nsolves += 1
+                savetopk(combo, solve(combo))
+            continue
+        bound, box, worse = npinf, None, None # (calculated in full if the bounds leave PLBOX)
+        rows = plbounds(branch, plallowed, *PLBOX)
+        nbounds += 2
+        outer = TPrange(rows, margins)
+        if outer is not None and all(PLBOX[j][0] <= outer[j][0] and outer[j][1] <= PLBOX[j][1] for j in range(2)):
+            rows = plbounds(branch, plallowed, *outer)
+            nbounds += 2
+            inner = TPrange(rows, margins)
+            if inner is not None and all(outer[j][0] <= inner[j][0] and inner[j][1] <= outer[j][1] for j in range(2)):
+                scores = [criterion(row) for row in rows]
+                bound, box, worse = max(scores) + margins[0], inner, (0 if scores[0] <= scores[1] else 1) # worse 0: the lowest AAN
+        branches.append((bound, branch, plallowed, box, worse))
+    branches.sort(key=lambda b: b[0], reverse=True)
+    for bound, branch, plallowed, box, worse in branches:
+        if not beatstopk(bound): # no remaining branch can beat the k best
+            break
+        if worse is not None: # best first
+            activities = {pl: ANactivityrange(pl, *box) for pl in plallowed}
+            plallowed = sorted(plallowed, key=lambda pl: activities[pl][1 - worse], reverse=(worse == 0))
+        calculated = [] # (AAN at T final and P final, score) of each plagioclase calculated in this branch
+        for pl in plallowed:
+            if worse is not None:
+                edge = activities[pl][1 - worse] # the AAN of pl nearest the better end
+                if any((edge <= a if worse == 0 else edge >= a) and not beatstopk(score + margins[0]) for a, score in calculated):
+                    continue
+            combo = branch[:ipl] + (pl,) + branch[ipl:]
+            nsolves += 1
+            row = solve(combo)
+            score = savetopk(combo, row)
+            if worse is not None:
+                calculated.append((ANactivityrange(pl, [row[0] + 273], [row[1]])[0], score))
+    print('\n'+str(nsolves)+' of '+str(prod(nanalyses[m] for m in minerals))+' possible combinations calculated ('+str(nbounds)+' more calculations to bound them)')
+elif runmode == 5:
+    previous = None
+    coverage = [[0] * nanalyses[m] for m in minerals] # number of sampled combinations using each analysis
+    total = prod(nanalyses[m] for m in minerals)
+    for combos in combinations(batchsize):
+        for combo in combos:
+            outputfunc(combo, solve(combo))
+            for d in range(len(minerals)):
+                coverage[d][combo[d]] += 1
+        current = samplequantiles()
+        converged = previous is not None and all(abs(current[i] - previous[i]) < Ttolerance for i in range(3)) and all(abs(current[i] - previous[i]) < Ptolerance for i in range(3, 6))
+        if sampling == 3: # an analysis cannot be used in more than total / (number of analyses of its mineral) combinations
+            # (analyses that the filter rules exclude outright are not counted)
+            converged = converged and all(coverage[d][i] >= min(mincoverage, total // nanalyses[m]) for d, m in enumerate(minerals) \
+                                          for i in range(nanalyses[m]) if analysisallowed(m, i))
+        if converged:
+            break
+        previous = current
+    print('\n'+str(len(TCout) - 1)+' of '+str(total)+' possible combinations calculated')
+    print('effective sample size: '+str(round(effectivesamplesize(weightout[1:]), 1)))
+    print('every analysis was used in at least '+str(min([coverage[d][i] for d, m in enumerate(minerals) for i in range(nanalyses[m]) if analysisallowed(m, i)], default=0))+' combinations')
+    print('Fe-Al T final 5th, 50th, 95th percentiles (C): '+', '.join(str(round(q, 1)) for q in current[:3]))
+    print('Fe-Al P final 5th, 50th, 95th percentiles (kbar): '+', '.join(str(round(q, 2)) for q in current[3:]))
+elif runmode == 8:
+    Tmap = open_memmap('outputT.npy', mode='w+', dtype=float, shape=garmap.shape[:2])
+    Pmap = open_memmap('outputP.npy', mode='w+', dtype=float, shape=garmap.shape[:2])
+    maprows = max(1, 100000 // garmap.shape[1]) # about 100000 pixels per band
+    bands = [(start, min(start + maprows, garmap.shape[0])) for start in range(0, garmap.shape[0], maprows)]
+    if cpu_count() > 1 and 'fork' in get_all_start_methods(): # the processes start as copies of this one
+        with get_context('fork').Pool() as pool:
+            for start, stop, Tband, Pband, counts in pool.imap_unordered(mapband, bands):
+                Tmap[start:stop], Pmap[start:stop] = Tband, Pband
+                for stage, n in counts.items(): # (counted in the other process)
+                    unconverged[stage] = unconverged.get(stage, 0) + n
+    else:
+        for start, stop, Tband, Pband, counts in map(mapband, bands):
+            Tmap[start:stop], Pmap[start:stop] = Tband, Pband
+    Tmap.flush()
+    Pmap.flush()
+    print('\n'+str(int(npisfinite(Tmap).sum()))+' garnet pixels calculated')
+elif runmode == 9:
+    distanceout = [['gar distance'], ['opx distance']]
+    for combos in combinations():
+        setanalyses(combos)
+        RCLCvectorized()
+        outputbatch(combos)
+        distanceout[0] += [extracolumns['gar']['distance'][g] for g in combos[:, minerals.index('gar')]]
+        distanceout[1] += [extracolumns['opx']['distance'][o] for o in combos[:, minerals.index('opx')]]
+    results += distanceout
+elif runmode == 10:
+    sampleout = ['sample']
+    for combos in combinations():
+        setanalyses(combos)
+        modes = combomodes(combos)
+        RCLCvectorized(modes)
+        outputbatch(combos, modes)
+        sampleout += [extracolumns['gar']['sample'][g] for g in combos[:, minerals.index('gar')]]
+    results.append(sampleout)
+if resultcache is not None:
+    saveresults()
+    if runmode in [1, 2, 3, 4, 5, 6, 7]:
+        print('\nresult cache: '+str(resultcounts['reused'])+' combinations reused, '+str(resultcounts['calculated'])+' calculated')
+    evictresults()
+    resultcache.close()
+if runmode in [3, 4]: # best combination first
+    for score, n, combo, row in sorted(topk, reverse=True):
+        outputfunc(combo, row)
+if linearuncertainty:
+    # derivatives of T and P with respect to each cation and mode, and the linear uncertainty, of every
+    # combination in the output, 1000 combinations at a time
+    inputs = derivativeinputs()
+    derivativeout = [['d(Fe-Al T final)/d('+m+' '+element+')'] for m, element in inputs] + [['d(Fe-Al P final)/d('+m+' '+element+')'] for m, element in inputs]
+    linearout = [['Fe-Al T final linear 1 sigma'], ['Fe-Al P final linear 1 sigma'], ['Fe-Al T-P final linear covariance']]
+    for start in range(0, len(combosout), 1000):
+        combos = nparray(combosout[start:start + 1000], dtype=int)
+        dT, dP = sensitivities(combos)
+        for out, values in zip(derivativeout, npcolumn_stack([dT, dP]).T):
+            out += [float(value) for value in values]
+        for out, values in zip(linearout, zip(*linearerrors(combos, dT, dP))):
+            out += values
+    results += linearout + derivativeout
+if allmodels and combosout:
+    # T and P final of every combination in the output with each Al site model, 1000 combinations at a time. Model 4
+    # is the one every combination was calculated with, so only models 1-3 are calculated again
+    modelout = [['Fe-Al T final (Al model '+str(n)+')'] for n in [1, 2, 3, 4]] + [['Fe-Al P final (Al model '+str(n)+')'] for n in [1, 2, 3, 4]]
+    for start in range(0, len(combosout), 1000):
+        modelT, modelP = alsitemodels(nparray(combosout[start:start + 1000], dtype=int), [ALOPX1, ALOPX2, ALOPX3])
+        modelT = npcolumn_stack([modelT, nparray(TCout[1 + start:1 + start + 1000], dtype=float)])
+        modelP = npcolumn_stack([modelP, nparray(Pout[1 + start:1 + start + 1000], dtype=float)])
+        for out, values in zip(modelout, npcolumn_stack([modelT, modelP]).T):
+            out += [float(value) for value in values]
+    results += modelout
+if modescenarios and combosout:
+    # T and P final of every combination in the output with every set of modes, about 10000 calculations at a time
+    n = len(modescenarios['gar'])
+    sweepT, sweepP = [], []
+    with open('modesweepfile.csv', 'w', newline='') as f:
+        w = csvwriter(f)
+        w.writerow(['analyses used'] + [m+' mode' for m in minmodes] + ['Fe-Al T final', 'Fe-Al P final'])
+        for start in range(0, len(combosout), max(1, 10000 // n)):
+            combos = nparray(combosout[start:start + max(1, 10000 // n)], dtype=int)
+            modeT, modeP, modes = modesweep(combos)
+            for c, combo in enumerate(combos):
+                for j in range(n):
+                    w.writerow([combolabel(combo)] + [float(modes[m][c, j]) for m in minmodes] + [float(modeT[c, j]), float(modeP[c, j])])
+            sweepT.append(modeT.ravel())
+            sweepP.append(modeP.ravel())
+    sweepT, sweepP = npconcatenate(sweepT), npconcatenate(sweepP)
+    calculated = npisfinite(sweepT) & npisfinite(sweepP)
+    sweepweights = nparray(weightout[1:]).repeat(n)[calculated]
+    print('\n5th, 50th, 95th percentiles over '+str(n)+' sets of modes:')
+    print('Fe-Al T final (C): '+', '.join(str(round(q, 1)) for q in weightedpercentiles(sweepT[calculated], sweepweights, [5, 50, 95])))
+    print('Fe-Al P final (kbar): '+', '.join(str(round(q, 2)) for q in weightedpercentiles(sweepP[calculated], sweepweights, [5, 50, 95])))
+    print('T and P final of every combination with every set of modes saved to modesweepfile.csv')
+if fe3scenarios and combosout:
+    # T and P final of every combination in the output with every Fe3/(Fe3+Fe2) of opx and garnet, about 10000
+    # calculations at a time
+    n = len(fe3scenarios['opx'])
+    sweepT, sweepP = [], []
+    with open('fe3sweepfile.csv', 'w', newline='') as f:
+        w = csvwriter(f)
+        w.writerow(['analyses used', 'opx Fe3/(Fe3+Fe2)', 'gar Fe3/(Fe3+Fe2)', 'Fe-Al T final', 'Fe-Al P final'])
+        for start in range(0, len(combosout), max(1, 10000 // n)):
+            combos = nparray(combosout[start:start + max(1, 10000 // n)], dtype=int)
+            fe3T, fe3P, (opxfraction, garfraction) = fe3sweep(combos)
+            for c, combo in enumerate(combos):
+                for j in range(n):
+                    w.writerow([combolabel(combo), float(opxfraction[c, j]), float(garfraction[c, j]), float(fe3T[c, j]), float(fe3P[c, j])])
+            sweepT.append(fe3T.ravel())
+            sweepP.append(fe3P.ravel())
+    sweepT, sweepP = npconcatenate(sweepT), npconcatenate(sweepP)
+    calculated = npisfinite(sweepT) & npisfinite(sweepP)
+    sweepweights = nparray(weightout[1:]).repeat(n)[calculated]
+    print('\n5th, 50th, 95th percentiles over '+str(n)+' sets of Fe3/(Fe3+Fe2):')
+    print('Fe-Al T final (C): '+', '.join(str(round(q, 1)) for q in weightedpercentiles(sweepT[calculated], sweepweights, [5, 50, 95])))
+    print('Fe-Al P final (kbar): '+', '.join(str(round(q, 2)) for q in weightedpercentiles(sweepP[calculated], sweepweights, [5, 50, 95])))
+    print('T and P final of every combination with every Fe3/(Fe3+Fe2) saved to fe3sweepfile.csv')
+if replicates and runmode not in [2, 5]:
+    print('\nbootstrap confidence intervals are only calculated in runmodes 2 and 5, in which every analysis of each mineral is combined with every analysis of the others')
+elif replicates and combosout:
+    estimates, lower, upper, n = bootstrap()
+    if not n:
+        print('\nno bootstrap replicate drew the analyses of any calculation in the output, so no confidence intervals were calculated')
+    else:
+        print('\n'+str(round(confidence, 1))+'% bootstrap confidence intervals ('+str(n)+' replicates of the analyses of each mineral):')
+        for name, i, digits in [('median Fe-Al T final (C)', 0, 1), ('mean Fe-Al T final (C)', 1, 1),
+                                ('median Fe-Al P final (kbar)', 2, 2), ('mean Fe-Al P final (kbar)', 3, 2)]:
+            print(name+': '+str(round(estimates[i], digits))+'   '+str(round(lower[i], digits))+' to '+str(round(upper[i], digits)))
+        with open('bootstrapfile.csv', 'w', newline='') as f:
+            w = csvwriter(f)
+            w.writerow(['statistic', 'estimate', 'lower', 'upper'])
+            for i, name in enumerate(['median Fe-Al T final', 'mean Fe-Al T final', 'median Fe-Al P final', 'mean Fe-Al P final']):
+                w.writerow([name, estimates[i], lower[i], upper[i]])
+        print('bootstrap confidence intervals saved to bootstrapfile.csv')
+if allanalyses != None and runmode in [2, 5] and ncompare > 0:
+    # compare the percentiles of T and P of the representative analyses with those of a random sample of
+    # the combinations of all the analyses
+    clustered = weightedpercentiles(TCout[1:], weightout[1:], [5, 50, 95]) + weightedpercentiles(Pout[1:], weightout[1:], [5, 50, 95])
+    restoreanalyses(allanalyses)
+    shape = [nanalyses[m] for m in minerals]
+    flat = Random(0).sample(range(prod(shape)), min(ncompare, prod(shape)))
+    combos = npcolumn_stack(npunravel_index(nparray(flat, dtype=int), shape))
+    if filterrules:
+        combos = combos[combofilter(combos)]
+    sampleT, sampleP, sampleweights = [], [], []
+    for combo in combos:
+        setanalyses(combo)
         RCLCfunction()
-        outputfunc()
-        calctracker.append('calculation'+str(i+1))
-# Run every possible combination of input mineral analyses if use selected runmode 2
-elif runmode == 2:
-    for i in range(len(aSIOPX)): #iterate through each opx
-        SIOPX, TIOPX, ALOPX, CROPX, FE3OPX, FE2OPX, MNOPX, MGOPX, CAOPX = aSIOPX[i], aTIOPX[i], aALOPX[i], aCROPX[i], aFE3OPX[i], aFE2OPX[i], aMNOPX[i], aMGOPX[i], aCAOPX[i]
-        XFEOPX, XMGOPX, XAL_M1 = aXFEOPX[i], aXMGOPX[i], aXAL_M1[i]
-        for ii in range(len(aFEGAR)): #iterate through each garnet
-            FEGAR, MNGAR, MGGAR, CAGAR = aFEGAR[ii], aMNGAR[ii], aMGGAR[ii], aCAGAR[ii]
-            for iii in range(len(aCAPL)): #iterate through each plagioclase cations per 8 oxgyen
-                CAPL, NAPL, KPL = aCAPL[iii], aNAPL[iii], aKPL[iii]
-                if not skip_bt and not skip_crd: # if including biotite and cordierite
-                    for iv in range(len(aFECRD)): #iterate through each cordierite
-                        FECRD, MNCRD, MGCRD = aFECRD[iv], aMNCRD[iv], aMGCRD[iv]
-                        for v in range(len(aSIBT)): #biotite cations per 11 oxygen (10 O + 2(OH))
-                            SIBT, TIBT, ALBT, FEBT, MNBT, MGBT, NABT, KBT = aSIBT[v], aTIBT[v], aALBT[v], aFEBT[v], aMNBT[v], aMGBT[v], aNABT[v], aKBT[v]
-                            RCLCfunction()
-                            outputfunc()
-                            calctracker.append('opx'+str(i+1)+' gar'+str(ii+1)+' pl'+str(iii+1)+' bt'+str(v+1)+' crd'+str(iv+1))
-                elif not skip_bt: # if including biotite, but not cordierite
-                    for v in range(len(aSIBT)): #iterate through each biotite composition
-                        SIBT, TIBT, ALBT, FEBT, MNBT, MGBT, NABT, KBT = aSIBT[v], aTIBT[v], aALBT[v], aFEBT[v], aMNBT[v], aMGBT[v], aNABT[v], aKBT[v]
-                        RCLCfunction()
-                        outputfunc()
-                        calctracker.append('opx'+str(i+1)+' gar'+str(ii+1)+' pl'+str(iii+1)+' bt'+str(v+1))
-                elif not skip_crd: # if including cordierite but not biotite
-                    for iv in range(len(aFECRD)): # iterate through each cordierite composition
-                        FECRD, MNCRD, MGCRD = aFECRD[iv], aMNCRD[iv], aMGCRD[iv]
-                        RCLCfunction()
-                        outputfunc()
-                        calctracker.append('opx'+str(i+1)+' gar'+str(ii+1)+' pl'+str(iii+1)+' crd'+str(iv+1))
-                else: # if not using biotite or cordierite
-                    RCLCfunction()
-                    outputfunc()
-                    calctracker.append('opx'+str(i+1)+' gar'+str(ii+1)+' pl'+str(iii+1))
+        sampleT.append(TC)
+        sampleP.append(P)
+        sampleweights.append(comboweight(combo))
+    sample = weightedpercentiles(sampleT, sampleweights, [5, 50, 95]) + weightedpercentiles(sampleP, sampleweights, [5, 50, 95])
+    print('\n5th, 50th, 95th percentiles of the representative analyses, and of '+str(len(combos))+' random combinations of all the analyses:')
+    print('Fe-Al T final (C): '+', '.join(str(round(q, 1)) for q in clustered[:3])+'   all: '+', '.join(str(round(q, 1)) for q in sample[:3])+ \
+          '   shift: '+', '.join(str(round(a - b, 1)) for a, b in zip(clustered[:3], sample[:3])))
+    print('Fe-Al P final (kbar): '+', '.join(str(round(q, 2)) for q in clustered[3:])+'   all: '+', '.join(str(round(q, 2)) for q in sample[3:])+ \
+          '   shift: '+', '.join(str(round(a - b, 2)) for a, b in zip(clustered[3:], sample[3:])))
+if activitycache is not None:
+    lookups = cachecounts['hits'] + cachecounts['misses']
+    print('\nactivity cache: '+str(cachecounts['hits'])+' hits, '+str(cachecounts['misses'])+' misses ('+ \
+          str(round(100 * cachecounts['hits'] / max(lookups, 1), 1))+'% of '+str(lookups)+' activity calculations reused)')
+if any(unconverged.values()):
+    print('\nWARNING: T and P had not converged after '+str(MAXITERATIONS)+' iterations, so some results may be inaccurate:')
+    for stage, n in unconverged.items():
+        print(str(n)+' times in the '+stage)
 print('\ndone with calculations\n')
 ########################################################
 ## Done running calcs for various compositional combos #
@@ -968,11 +2800,19 @@ print('\ndone with calculations\n')
 ################ outputting results ####################
 ########################################################
 
-results = [calctracker,TCout,Pout,TGAROPXout,TGARBTout,TGARCRDout,TFEALIout,PFEALIout,TGAROPXIout,PGAROPXIout,TGARBTIout,PGARBTIout,TGARCRDIout,PGARCRDIout]
-with open('outputfile.csv', 'w', newline='') as f:
-    w = csvwriter(f)
-    w.writerows(results)
-print('calculation results saved to outputfile.csv\n')
+if runmode == 8:
+    print('maps of Fe-Al T final (C) and Fe-Al P final (kbar) saved to outputT.npy and outputP.npy\n')
+else:
+    if any(w != 1 for w in weightout[1:]):
+        results.append(weightout)
+    if mcdraws:
+        results += mcout
+    if thermodraws:
+        results += thermomcout
+    with open(outputname, 'w', newline='') as f:
+        w = csvwriter(f)
+        w.writerows(results)
+    print('calculation results saved to '+outputname+'\n')
 ########################################################
 ############## Done outputting results #################
 ########################################################